@@ -65,6 +65,10 @@ def getEraConfiguration(era : str, run : int, calibfile : Union[str, None] = Non
     cfg.update(calib)
     cfg['ReferenceRun'] = refrun
 
+    #the ESProducers only read the json format: sharded calibration stores need to be exported beforehand
+    if cfg.get('modcalib') is not None and os.path.isfile(os.path.join(cfg['modcalib'],'index.json')):
+        raise ValueError(f'{cfg["modcalib"]} is a calibration store, export it first with LocalCalibration/python/CalibStore.py export')
+
     return cfg
 
 
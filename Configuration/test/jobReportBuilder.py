@@ -5,40 +5,112 @@ import argparse
 import json
 import pprint
 import glob
+import xml.etree.ElementTree as ET
+
+def _toNumber(v : str):
+    """converts a metric value to int/float if possible, otherwise returns it untouched"""
+    try:
+        return int(v)
+    except (TypeError,ValueError):
+        pass
+    try:
+        return float(v)
+    except (TypeError,ValueError):
+        return v
+
+
+def parseFwkReport(f : str) -> dict:
+
+    """parses a framework job report in a single pass over the file.
+    The PerformanceSummary blocks are returned grouped by their Metric attribute
+    and the PerformanceModule blocks are grouped by module label and metric class.
+    An iterparse is tried first: if the document is not well-formed a line-based scan is used instead"""
+
+    summaries, modules = {}, {}
+
+    def _add(section, module, name, value):
+        if name is None: return
+        if module is None:
+            summaries.setdefault(section,{})[name] = value
+        else:
+            modules.setdefault(module,{}).setdefault(section,{})[name] = value
+
+    try:
+        section, module = None, None
+        for event, elem in ET.iterparse(f, events=('start','end')):
+            tag = elem.tag
+            if event=='start':
+                if tag in ['PerformanceSummary','PerformanceModule']:
+                    section = elem.get('Metric')
+                    module = elem.get('Module')
+                continue
+            if tag=='Metric' and section is not None:
+                _add(section, module, elem.get('Name'), elem.get('Value'))
+            elif tag in ['PerformanceSummary','PerformanceModule']:
+                section, module = None, None
+            elif tag!='Metric':
+                #release finished sub-trees (input/output file blocks can be large)
+                elem.clear()
+    except ET.ParseError as e:
+        print(f'[Warning] {f} is not well-formed ({e}), falling back to a line-based scan')
+        summaries, modules = {}, {}
+        rgx_open = re.compile(r'<Performance(Summary|Module)\s+([^>]*)>')
+        rgx_attr = re.compile(r'(\w+)="([^"]*)"')
+        rgx_metric = re.compile(r'<Metric\s+Name="([^"]*)"\s+Value="([^"]*)"\s*/>')
+        section, module = None, None
+        with open(f, 'r', errors='replace') as inf:
+            for line in inf:
+                if '<Performance' in line:
+                    m = rgx_open.search(line)
+                    if m is not None:
+                        attrs = dict(rgx_attr.findall(m.group(2)))
+                        section, module = attrs.get('Metric'), attrs.get('Module')
+                if '</Performance' in line:
+                    section, module = None, None
+                    continue
+                if section is None or '<Metric' not in line: continue
+                for name, value in rgx_metric.findall(line):
+                    _add(section, module, name, value)
+
+    return {'Summaries':summaries, 'Modules':modules}
+
 
 def processFwkReports(basedir : str,
                       fwkreportsPatt : str = 'FrameworkJobReport_(.*).xml',
                       metrics : list = ['NumberEvents','AvgEventTime','MaxEventTime','MinEventTime','EventThroughput','TotalJobCPU','TotalJobTime']):
 
-    """parse the required information from the xml file. 
-    AS ElementTree seems to fail processing these xml files a simple regex is used"""
-    
-    #wraps the parsing of metrics from the framework job report
-    def _parseMetrics(f,metrics): 
-        data={}
-        with open(f, 'r') as inf:
-            xmlstr = inf.read().replace('\n', '')
-            for m in metrics:
-                rgx = f'<Metric Name="{m}" Value="(\\d+(?:\\.\\d+)?)"/>'
-                result = re.findall(rgx, xmlstr)
-                if len(result)==0:
-                    data[m]="0"
-                else:
-                    data[m] = re.findall(rgx, xmlstr)[0]
-        return data
+    """parse the required information from the xml file.
+    The job-level metrics are kept as strings (one entry per step) for backwards compatibility,
+    the full content of the performance report is added as structured fields per step:
+    Timing, Memory, Storage (read/write bytes and timings), Summaries (all sections) and Modules (per module)"""
 
     #find FWK job reports in the directory given and parse them
     #the reconstruction step is identified based on the regex pattern
-    report=dict([(k,[]) for k in ['Step']+metrics])
+    report=dict([(k,[]) for k in ['Step']+metrics+['Timing','Memory','Storage','Summaries','Modules']])
     for f in [ os.path.join(basedir,xml) for xml in os.listdir(basedir) if re.search(fwkreportsPatt,xml) ]:        
         try:
             step = re.findall(fwkreportsPatt,f)[0]
         except:
             continue
         report['Step'].append(step)
-        step_data = _parseMetrics(f,metrics)
-        for k,v in step_data.items():
-            report[k].append(v)
+        fwk = parseFwkReport(f)
+
+        #job-level metrics may be found in any of the summary blocks
+        flat = {}
+        for section in fwk['Summaries'].values():
+            flat.update(section)
+        for m in metrics:
+            report[m].append( flat.get(m,"0") )
+
+        summaries = dict([(sec,dict([(k,_toNumber(v)) for k,v in vals.items()])) for sec,vals in fwk['Summaries'].items()])
+        report['Timing'].append( summaries.get('Timing',{}) )
+        report['Memory'].append( summaries.get('ApplicationMemory',{}) )
+        report['Storage'].append( summaries.get('StorageStatistics',{}) )
+        report['Summaries'].append( summaries )
+        report['Modules'].append( dict([
+            (mod,dict([(sec,dict([(k,_toNumber(v)) for k,v in vals.items()])) for sec,vals in secs.items()]))
+            for mod,secs in fwk['Modules'].items()
+        ]) )
     return {"JobReport":report}
 
 
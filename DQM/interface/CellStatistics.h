@@ -4,6 +4,7 @@
 #include <stdio.h>
 #include <cmath>
 #include <algorithm>
+#include <vector>
 
 namespace hgcal {
 
@@ -20,7 +21,7 @@ namespace hgcal {
     /**
        @short copy from another class
     */
-    CellStatistics(CellStatistics &t)
+    CellStatistics(const CellStatistics &t)
     {
       n=t.n;
       sum_x=t.sum_x;
@@ -45,7 +46,7 @@ namespace hgcal {
     /*
       @short updates the sums for the observable x and the spectators
     */
-    void update(double x, std::vector<double> s) {
+    void update(double x, const std::vector<double> &s) {
       
       n += 1;
 
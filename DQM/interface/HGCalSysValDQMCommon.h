@@ -2,6 +2,7 @@
 #define HGCalCommissioning_DQM_interface_HGCalSysValDQMCommon_h
 
 #include <string>
+#include <vector>
 
 namespace hgcal {
 
@@ -19,6 +20,20 @@ namespace hgcal {
     // @short label for SummaryIndices_t enum (ROOT format)
     std::string getLabelForSummaryIndex(SummaryIndices_t idx);
 
+    // @short an enum for the spectators correlated to the ADC in the pedestal moments (ADC_{-1} and the common mode estimators)
+    enum PedestalSpectators_t { SPECADCM1=0, SPECCM2, SPECCM4, SPECCMALL, LASTSPECTATOR };
+
+    // @short label for PedestalSpectators_t enum (same names as used by the LocalCalibration pedestals)
+    std::string getLabelForPedestalSpectator(PedestalSpectators_t idx);
+
+    // @short ordered names of the moments accumulated per channel for the pedestals:
+    // n, adc, adc_adc followed by {s}, {s}_{s}, adc_{s} for each spectator s
+    std::vector<std::string> getPedestalMomentLabels();
+
+    // @short common mode estimator of each e-Rx from the common mode words of the e-Rx of a module
+    // mode=2 (e-Rx), 4 (pairs of e-Rx in the same ROC) or -1 (module average) as in LocalCalibration/interface/helpers.h
+    std::vector<double> getCommonModePerErx(const std::vector<double> &erxcm, int mode);
+
   } // namespace dqm
 
 } // namespace hgcal
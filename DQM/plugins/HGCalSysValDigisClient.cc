@@ -86,6 +86,13 @@ private:
   void analyzeModules(const edm::Event& iEvent, const edm::EventSetup& iSetup, int trigTime);
   void analyzeTriggerModules(const edm::Event& iEvent, const edm::EventSetup& iSetup, int trigTime);
 
+  /**
+    @short accumulates the per-channel moments of ADC, ADC_{-1} and common mode in pedestal triggers (not prescaled)
+    in lumi-scoped monitoring elements: each lumi section is saved as an independent (mergeable) snapshot
+    the moments are the same as the ones used offline to derive the pedestals from NZS events
+  */
+  void accumulatePedestalMoments(const edm::Event& iEvent, const edm::EventSetup& iSetup);
+
   /** 
     @short for each module finds the channel with largest delta ADC to be used for special monitoring histograms
   */
@@ -108,6 +115,7 @@ private:
   std::map<MonitoredElementKey_t,MonitoredElement_t> followedModules_;
   std::map<std::string, std::map<MonitoredElementKey_t, MonitorElement*> > moduleHistos_;
   std::map<MonitoredElementKey_t, uint32_t> moduleSeeds_;
+  const unsigned int pedestalTrigType_;
 
   MonitorElement *trigTimeH_,*trigTypeH_;
   MonitorElement *fedQualityH_, *fedPayload_, *econdQualityH_, *cbQualityH_, *econdPayload_;
@@ -135,6 +143,7 @@ HGCalSysValDigisClient::HGCalSysValDigisClient(const edm::ParameterSet& iConfig)
       minEvents_(iConfig.getParameter<unsigned int>("MinimumEvents")),
       prescaleFactor_(std::max(1u, iConfig.getParameter<unsigned int>("PrescaleFactor"))),
       nProcessed_(0),
+      pedestalTrigType_(iConfig.getParameter<unsigned int>("PedestalTrigType")),
       skipTriggerDQM_(iConfig.getParameter<bool>("SkipTriggerDQM")) { }
 
 //
@@ -154,6 +163,7 @@ void HGCalSysValDigisClient::fillDescriptions(edm::ConfigurationDescriptions& de
   desc.add<unsigned int>("MinimumEvents", 10000);
   desc.add<unsigned int>("PrescaleFactor", 1);
   desc.add<bool>("SkipTriggerDQM", true);
+  desc.add<unsigned int>("PedestalTrigType", 0)->setComment("trigger type used to accumulate pedestal moments (0 to disable)");
   descriptions.addWithDefaultLabel(desc);
 }
 
@@ -181,6 +191,10 @@ void HGCalSysValDigisClient::analyze(const edm::Event& iEvent, const edm::EventS
   analyzeECONDFlags(iEvent,iSetup);
   analyzeFEDFlags(iEvent,iSetup);
 
+  //pedestal moments are accumulated for all the pedestal triggers
+  if(pedestalTrigType_>0 && trigType==int(pedestalTrigType_))
+    accumulatePedestalMoments(iEvent,iSetup);
+
   //check if this an event which should be tracked
   bool toProcess = (nProcessed_ < minEvents_) || (nProcessed_ % prescaleFactor_ == 0);
   if (!toProcess)
@@ -313,6 +327,80 @@ void HGCalSysValDigisClient::analyzeModules(const edm::Event& iEvent, const edm:
 
 }
 
+//
+void HGCalSysValDigisClient::accumulatePedestalMoments(const edm::Event& iEvent, const edm::EventSetup& iSetup) {
+
+  //read digis and dense index info
+  const auto& digis = iEvent.getHandle(digisTkn_);
+  if (!digis.isValid()) return;
+  const auto& digis_view = digis->const_view();
+  int32_t ndigis = digis_view.metadata().size();
+  const auto& denseIndexInfo = iSetup.getData(denseIndexInfoTkn_);
+  const auto& denseIndexInfo_view = denseIndexInfo.const_view();
+  auto &pedmoments = moduleHistos_["pedmoments"];
+
+  //first loop to collect the common mode words of each e-Rx
+  std::map<MonitoredElementKey_t, std::vector<double> > erxcm;
+  for (int32_t i = 0; i < ndigis; ++i) {
+    auto indexinfo = denseIndexInfo_view[i];
+    MonitoredElementKey_t key(indexinfo.fedId(), indexinfo.fedReadoutSeq());
+    if(pedmoments.find(key) == pedmoments.end()) continue;
+
+    auto digi = digis_view[i];
+    if(digi.flags()==hgcal::DIGI_FLAG::NotAvailable) continue;
+
+    auto &cm = erxcm[key];
+    if(cm.empty()) cm.resize(followedModules_[key].nErx, 0);
+    uint32_t iErx = indexinfo.chNumber()/37;
+    if(iErx<cm.size()) cm[iErx] = digi.cm();
+  }
+
+  //common mode estimators per e-Rx, in the order of the spectators
+  std::map<MonitoredElementKey_t, std::vector<std::vector<double> > > cmest;
+  for(const auto &it : erxcm) {
+    for(int mode : {2, 4, -1})
+      cmest[it.first].push_back( getCommonModePerErx(it.second, mode) );
+  }
+
+  //second loop to update the moments (same channel selection as offline: ADC available and not in TOT mode)
+  //the terms are in the order of getPedestalMomentLabels: n, adc, adc_adc, then s, s_s, adc_s for each spectator
+  std::vector<double> spectators(PedestalSpectators_t::LASTSPECTATOR, 0);
+  std::vector<double> moments;
+  for (int32_t i = 0; i < ndigis; ++i) {
+    auto indexinfo = denseIndexInfo_view[i];
+    MonitoredElementKey_t key(indexinfo.fedId(), indexinfo.fedReadoutSeq());
+    auto it = pedmoments.find(key);
+    if(it == pedmoments.end()) continue;
+
+    auto digi = digis_view[i];
+    if(digi.flags()==hgcal::DIGI_FLAG::NotAvailable) continue;
+    if(digi.tctp()>=3) continue;
+
+    uint32_t chIdx = indexinfo.chNumber();
+    if(int(chIdx)>=it->second->getNbinsX()) continue;
+    const auto &cm = cmest[key];
+    uint32_t iErx = chIdx/37;
+    spectators[PedestalSpectators_t::SPECADCM1] = digi.adcm1();
+    spectators[PedestalSpectators_t::SPECCM2] = cm[0][iErx];
+    spectators[PedestalSpectators_t::SPECCM4] = cm[1][iErx];
+    spectators[PedestalSpectators_t::SPECCMALL] = cm[2][iErx];
+
+    double adc = digi.adc();
+    moments = {1., adc, adc*adc};
+    for(auto s : spectators) {
+      moments.push_back(s);
+      moments.push_back(s*s);
+      moments.push_back(adc*s);
+    }
+    for(size_t ibin=0; ibin<moments.size(); ibin++) {
+      auto newVal = moments[ibin] + it->second->getBinContent(chIdx+1, ibin+1);
+      it->second->setBinContent(chIdx+1, ibin+1, newVal);
+    }
+  }
+
+}
+
+//
 void HGCalSysValDigisClient::analyzeTriggerModules(const edm::Event& iEvent, const edm::EventSetup& iSetup, int trigTime) {
   const auto& digisTrigger = iEvent.getHandle(digisTriggerTkn_);
   const auto& digisTrigger_view = digisTrigger->const_view();
@@ -593,6 +681,16 @@ void HGCalSysValDigisClient::bookHistograms(DQMStore::IBooker& ibook, edm::Run c
       moduleHistos_["sums"][k]->setBinLabel(i+1, label, 2);
     }
 
+    //pedestal moments are booked per lumi section to be harvested as snapshots
+    if(pedestalTrigType_>0) {
+      std::vector<std::string> labels = getPedestalMomentLabels();
+      ibook.setScope(MonitorElementData::Scope::LUMI);
+      moduleHistos_["pedmoments"][k] = ibook.book2DD("pedmoments" + tag, typecode + ";Channel;", nch, 0, nch, labels.size(), 0, labels.size());
+      ibook.setScope(MonitorElementData::Scope::RUN);
+      for(size_t i=0; i<labels.size(); i++)
+        moduleHistos_["pedmoments"][k]->setBinLabel(i+1, labels[i], 2);
+    }
+
   }// end followedModules_ loop
 
   // Trigger histograms
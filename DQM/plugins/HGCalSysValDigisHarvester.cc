@@ -74,6 +74,12 @@ protected:
                            edm::EventSetup const &);
   void dqmEndJob(DQMStore::IBooker &, DQMStore::IGetter &) override;
 
+  /**
+    @short writes the pedestal moments of the lumi section to a ROOT file (one TH2D per module, named after the typecode)
+    the snapshots only contain sums and can be added to derive the pedestals (see LocalCalibration/scripts/mergeDQMPedestalSnapshots.py)
+   */
+  void writePedestalSnapshot(DQMStore::IGetter &, edm::LuminosityBlock const &);
+
   std::map<TGraph*, double> extractBinLocations(TH2Poly* hist);
 
 private:
@@ -101,6 +107,9 @@ private:
 
   //skip trigger plots
   bool skipTriggerHarvesting_;
+
+  //output directory of the pedestal moments snapshots (empty to disable)
+  std::string pedestalSnapshotDir_;
     
   //module indexer / info
   edm::ESGetToken<HGCalMappingModuleIndexer, HGCalElectronicsMappingRcd> moduleIdxTkn_;
@@ -148,6 +157,7 @@ private:
 HGCalSysValDigisHarvester::HGCalSysValDigisHarvester(const edm::ParameterSet &iConfig)
   : templateDir_(iConfig.getParameter<std::string>("TemplateFiles")),
     skipTriggerHarvesting_(iConfig.getParameter<bool>("SkipTriggerHarvesting")),
+    pedestalSnapshotDir_(iConfig.getParameter<std::string>("PedestalSnapshotDir")),
     moduleIdxTkn_(esConsumes<edm::Transition::EndLuminosityBlock>()),
     moduleInfoTkn_(esConsumes<edm::Transition::EndLuminosityBlock>())
 {
@@ -159,6 +169,7 @@ void HGCalSysValDigisHarvester::fillDescriptions(edm::ConfigurationDescriptions
   edm::ParameterSetDescription desc;
   desc.add<std::string>("TemplateFiles","HGCalCommissioning/DQM/data");
   desc.add<bool>("SkipTriggerHarvesting",true);
+  desc.add<std::string>("PedestalSnapshotDir","")->setComment("directory for the per lumi section pedestal moments (empty to disable)");
   descriptions.addWithDefaultLabel(desc);
 }
 
@@ -176,6 +187,40 @@ void HGCalSysValDigisHarvester::dqmEndLuminosityBlock(DQMStore::IBooker &ibooker
    dqmDAQHexaPlots(ibooker, igetter, iLumi, iSetup);
    if(!skipTriggerHarvesting_)
      dqmTriggerHexaPlots(ibooker, igetter, iLumi, iSetup); 
+   if(!pedestalSnapshotDir_.empty())
+     writePedestalSnapshot(igetter, iLumi);
+}
+
+//
+void HGCalSysValDigisHarvester::writePedestalSnapshot(DQMStore::IGetter &igetter, edm::LuminosityBlock const &iLumi) {
+
+  //the module typecodes are read from the ECON-D payload histogram labels (the bin index is the dqmIndex)
+  const MonitorElement *me = igetter.get("HGCAL/Digis/econdPayload");
+  if(me==nullptr) return;
+  TAxis *xaxis = me->getTH2F()->GetXaxis();
+
+  std::ostringstream url;
+  url << pedestalSnapshotDir_ << "/pedestal_moments_run" << iLumi.run() << "_ls" << std::setfill('0') << std::setw(4) << iLumi.luminosityBlock() << ".root";
+  TFile *fOut = TFile::Open(url.str().c_str(), "RECREATE");
+  if(fOut==nullptr || fOut->IsZombie()) {
+    edm::LogWarning("HGCalSysValDigisHarvester") << "Unable to create pedestal snapshot " << url.str();
+    return;
+  }
+
+  size_t nmods(0);
+  for(int i=1; i<=xaxis->GetNbins(); i++) {
+    std::ostringstream name;
+    name << "HGCAL/Digis/pedmoments_module_" << i-1;
+    const MonitorElement *pedme = igetter.get(name.str());
+    if(pedme==nullptr) continue;
+    TH2D *h = (TH2D*) pedme->getTH2D()->Clone(xaxis->GetBinLabel(i));
+    h->SetDirectory(fOut);
+    h->Write();
+    nmods++;
+  }
+  fOut->Close();
+
+  LogDebug("HGCalSysValDigisHarvester") << "Pedestal moments of " << nmods << " modules stored in " << url.str();
 }
 
 
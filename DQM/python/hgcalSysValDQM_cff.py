@@ -1,14 +1,17 @@
 import FWCore.ParameterSet.Config as cms
 
 
-def customizeSysValDQM(process, runNumber : int = 123456, MinimumEvents : int = 5000, PrescaleFactor=5000):
+def customizeSysValDQM(process, runNumber : int = 123456, MinimumEvents : int = 5000, PrescaleFactor=5000,
+                       PedestalTrigType : int = 0, PedestalSnapshotDir : str = ''):
 
     #DQM modules
     process.load('HGCalCommissioning.DQM.hgCalSysValDigisClient_cfi')
     process.hgCalSysValDigisClient.MinimumEvents = MinimumEvents
     process.hgCalSysValDigisClient.PrescaleFactor = PrescaleFactor
     process.hgCalSysValDigisClient.SkipTriggerDQM = True
+    process.hgCalSysValDigisClient.PedestalTrigType = PedestalTrigType
     process.load('HGCalCommissioning.DQM.hgCalSysValDigisHarvester_cfi')
+    process.hgCalSysValDigisHarvester.PedestalSnapshotDir = PedestalSnapshotDir if PedestalTrigType>0 else ''
 
     #DQM saver
     process.DQMStore = cms.Service("DQMStore")
@@ -32,6 +32,49 @@ namespace hgcal
                   return label;
             }
 
+            //
+            std::string getLabelForPedestalSpectator(PedestalSpectators_t idx) {
+                  std::string label = "adcm1";
+                  if(idx==PedestalSpectators_t::SPECCM2) label = "cm2";
+                  else if(idx==PedestalSpectators_t::SPECCM4) label = "cm4";
+                  else if(idx==PedestalSpectators_t::SPECCMALL) label = "cmall";
+                  return label;
+            }
+
+            //
+            std::vector<std::string> getPedestalMomentLabels() {
+                  std::vector<std::string> labels = {"n", "adc", "adc_adc"};
+                  for(size_t i=0; i<PedestalSpectators_t::LASTSPECTATOR; i++) {
+                        std::string s = getLabelForPedestalSpectator(PedestalSpectators_t(i));
+                        labels.push_back(s);
+                        labels.push_back(s + "_" + s);
+                        labels.push_back("adc_" + s);
+                  }
+                  return labels;
+            }
+
+            //
+            std::vector<double> getCommonModePerErx(const std::vector<double> &erxcm, int mode) {
+                  size_t nErx = erxcm.size();
+                  double modulecm(0.);
+                  for(auto cm : erxcm) modulecm += cm;
+
+                  std::vector<double> cmavg(nErx, 0.);
+                  for(size_t i=0; i<nErx; i++) {
+                        if(mode==-1) {
+                              cmavg[i] = modulecm/(2*nErx);
+                        }
+                        else if(mode==4 && (i%2==1 || i+1<nErx)) {
+                              size_t j = i%2==1 ? i-1 : i+1;
+                              cmavg[i] = (erxcm[i]+erxcm[j])/4;
+                        }
+                        else {
+                              cmavg[i] = erxcm[i]/2;
+                        }
+                  }
+                  return cmavg;
+            }
+
       } // namespace dqm
       
 } // namespace hgcal
\ No newline at end of file
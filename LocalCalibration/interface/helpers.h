@@ -3,6 +3,13 @@
 
 #include "ROOT/RVec.hxx"
 
+#include <array>
+#include <cassert>
+#include <algorithm>
+#include <map>
+#include <string>
+#include <vector>
+
 using namespace ROOT::VecOps; 
 
 using rvec_f = const RVec<float>;
@@ -40,6 +47,141 @@ rvec_b matchesUV(const rvec_i &HGCDigi_u,const rvec_i &HGCDigi_v,int seed_u, int
   return (HGCDigi_u==seed_u) && (HGCDigi_v==seed_v);  
 }
 
+//channel/eRx layout of the ROCs : the fixed-size tables and accumulators below cover up to 6 ROCs (HD modules)
+constexpr int kChPerErx = 37;
+constexpr int kChPerRoc = 2*kChPerErx;
+constexpr int kMaxRocs = 6;
+constexpr int kMaxErx = 2*kMaxRocs;
+constexpr int kMaxCh = kMaxRocs*kChPerRoc;
+
+template<typename T, typename F>
+constexpr std::array<T,kMaxCh> makeChannelTable(F f) {
+  std::array<T,kMaxCh> table{};
+  for(int i=0; i<kMaxCh; i++) table[i] = f(i);
+  return table;
+}
+
+//precomputed channel -> ROC index and sign used in the alternated sum
+constexpr auto kChToRoc = makeChannelTable<int>([](int ch) { return ch/kChPerRoc; });
+constexpr auto kChAltSign = makeChannelTable<float>([](int ch) { return ch%2==0 ? -1.f : 1.f; });
+
+/**
+   @short sums over the channels of each ROC computed in a single pass
+   idx : roc indices (0 for ROCs without channels)
+   n : # channels
+   ds : direct sum
+   as : alternated sum
+   mean : ds/n
+   the sums are accumulated directly in fixed-size arrays, only the first nrocs entries are used:
+   view() exposes them as RVec columns without copying, so that no memory is allocated per event
+ */
+struct RocSums {
+  int nrocs = 0;
+  std::array<float,kMaxRocs> idx{}, n{}, ds{}, as{}, mean{};
+  RVec<float> view(const std::array<float,kMaxRocs> &sums) const {
+    return RVec<float>(const_cast<float*>(sums.data()), nrocs);
+  }
+};
+
+RocSums rocSums(const rvec_i &ch, const rvec_f &en) {
+
+  RocSums sums;
+  for(size_t i=0; i<ch.size(); i++) {
+    if(ch[i]<0 || ch[i]>=kMaxCh) continue;
+    const int iroc = kChToRoc[ch[i]];
+    sums.n[iroc] += 1.f;
+    sums.ds[iroc] += en[i];
+    sums.as[iroc] += kChAltSign[ch[i]]*en[i];
+    sums.nrocs = std::max(sums.nrocs, iroc+1);
+  }
+
+  for(int iroc=0; iroc<sums.nrocs; iroc++) {
+    sums.idx[iroc] = sums.n[iroc]>0 ? iroc : 0;
+    sums.mean[iroc] = sums.n[iroc]>0 ? sums.ds[iroc]/sums.n[iroc] : 0.f;
+  }
+  return sums;
+}
+
+/**
+   @short neighbor table of the channels of a module type in CSR layout:
+   the neighbors of readout channel ch are indices[offsets[ch]] ... indices[offsets[ch+1]-1]
+   (built and registered from python, see python/NeighborTable.py)
+ */
+struct NeighborTable {
+  std::vector<int> offsets, indices;
+  int nch() const { return int(offsets.size())-1; }
+};
+
+std::map<std::string,NeighborTable> &neighborTables() {
+  static std::map<std::string,NeighborTable> tables;
+  return tables;
+}
+
+void registerNeighborTable(const std::string &name, const std::vector<int> &offsets, const std::vector<int> &indices) {
+  assert(!offsets.empty() && int(offsets.size())-1<=kMaxCh && offsets.back()==int(indices.size()));
+  neighborTables()[name] = NeighborTable{offsets, indices};
+}
+
+const NeighborTable &neighborTable(const std::string &name) {
+  return neighborTables().at(name);
+}
+
+/**
+   @short sum of the energy in the neighbors of each hit (linear gather from a dense per-channel array)
+ */
+rvec_f neighborSum(const NeighborTable &table, const rvec_i &ch, const rvec_f &en) {
+
+  std::array<float,kMaxCh> dense{};
+  for(size_t i=0; i<ch.size(); i++)
+    if(ch[i]>=0 && ch[i]<kMaxCh) dense[ch[i]] = en[i];
+
+  RVec<float> nbsum(ch.size(), 0.f);
+  for(size_t i=0; i<ch.size(); i++) {
+    if(ch[i]<0 || ch[i]>=table.nch()) continue;
+    for(int k=table.offsets[ch[i]]; k<table.offsets[ch[i]+1]; k++)
+      nbsum[i] += dense[table.indices[k]];
+  }
+  return nbsum;
+}
+
+/**
+   @short flags the hits above threshold which are local maxima (cluster seeds)
+ */
+rvec_b isLocalMax(const NeighborTable &table, const rvec_i &ch, const rvec_f &en, float threshold) {
+
+  std::array<float,kMaxCh> dense{};
+  for(size_t i=0; i<ch.size(); i++)
+    if(ch[i]>=0 && ch[i]<kMaxCh) dense[ch[i]] = en[i];
+
+  RVec<bool> seed(ch.size(), false);
+  for(size_t i=0; i<ch.size(); i++) {
+    if(en[i]<=threshold || ch[i]<0 || ch[i]>=table.nch()) continue;
+    bool ismax(true);
+    for(int k=table.offsets[ch[i]]; k<table.offsets[ch[i]+1] && ismax; k++)
+      ismax = en[i]>=dense[table.indices[k]];
+    seed[i] = ismax;
+  }
+  return seed;
+}
+
+/**
+   @short selects the hits which are the seed channel or its neighbors
+ */
+rvec_b neighborMask(const NeighborTable &table, const rvec_i &ch, int seed) {
+
+  std::array<bool,kMaxCh> isnb{};
+  if(seed>=0 && seed<table.nch()) {
+    isnb[seed] = true;
+    for(int k=table.offsets[seed]; k<table.offsets[seed+1]; k++)
+      isnb[table.indices[k]] = true;
+  }
+
+  RVec<bool> mask(ch.size(), false);
+  for(size_t i=0; i<ch.size(); i++)
+    mask[i] = ch[i]>=0 && ch[i]<kMaxCh && isnb[ch[i]];
+  return mask;
+}
+
 /**
    @short coherent noise estimator
    computes either the direct sum or the alternated sum over the channels a ROC
@@ -48,90 +190,116 @@ rvec_b matchesUV(const rvec_i &HGCDigi_u,const rvec_i &HGCDigi_v,int seed_u, int
           1 : return # channels
           2 : direct sum
           3 : alternated sum
+   (prefer rocSums when more than one of them is needed)
  */
 rvec_f sumOverRoc(const rvec_i &ch, const rvec_f &en, int mode) {
+  const RocSums sums = rocSums(ch, en);
+  const auto &out = mode==0 ? sums.idx : (mode==1 ? sums.n : (mode==2 ? sums.ds : sums.as));
+  return RVec<float>(out.begin(), out.begin()+sums.nrocs);
+}
 
-  std::vector<float> sums;
+/**
+   @short averages the common mode words of each eRx in different flavours
+   1. CM2 = (CM0+CM1)/2 in the same eRx (mode=2)
+   2. CM4 = (CM0+CM1+CM2+CM3)/4 in the same ROC (mode=4)
+   3. CM* =(CM0+CM1+CM2+CM3+...)/N in the same module (mode=-1)
+   the cm words are read from the first channel of each eRx
+ */
+std::array<float,kMaxErx> commonModePerErx(const rvec_i &cm, int mode) {
 
-  //loop over channels and build sums per roc
-  for(size_t i=0; i<ch.size(); i++){
-    
-    int iroc = int(ch[i]/74);
-    if(int(sums.size())<=iroc) sums.resize(iroc+1,0.);
+  assert((mode==2 || mode==4 || mode==-1) && cm.size()%kChPerErx==0);
+
+  const int nErx = int(cm.size()/kChPerErx);
+  assert(nErx<=kMaxErx);
 
-    if(mode==0) {
-      sums[iroc]=iroc;
+  std::array<float,kMaxErx> erxcm{};
+  float modulecm(0.);
+  for(int i=0; i<nErx; i++) {
+    erxcm[i] = cm[i*kChPerErx];
+    modulecm += erxcm[i];
+  }
+
+  std::array<float,kMaxErx> cmavg{};
+  for(int i=0; i<nErx; i++) {
+    if(mode==-1) {
+      cmavg[i] = modulecm/(2*nErx);
     }
-    else if (mode==1) {
-      sums[iroc]+=1;
+    else if(mode==4 && (i%2==1 || i<nErx-1)) {
+      int j = i%2==1 ? i-1 : i+1;
+      cmavg[i] = (erxcm[i]+erxcm[j])/4;
     }
     else {
-      float kfact =
-        mode==3 ?
-        (ch[i]%2==0 ? -1 : 1) :
-        1.;
-      sums[iroc] += en[i]*kfact;
+      cmavg[i] = erxcm[i]/2;
     }
   }
-
-
-  return rvec_f(sums.begin(), sums.end());
+  return cmavg;
 }
 
 /**
-   @short computes the common mode noise in different flavours
-   1. CM2 = (CM0+CM1)/2 in the same eRx (mode=2)
-   2. CM4 = (CM0+CM1+CM2+CM3)/4 in the same ROC (mode=4)
-   3. CM* =(CM0+CM1+CM2+CM3+...)/N in the same module (mode=-1)
+   @short computes the common mode noise to assign to each channel (see commonModePerErx)
    it is assumed that the vector of cm is already filtered within a single module
  */
 rvec_f commonMode(const rvec_i &cm, int mode=2) {
 
-  assert((mode==2 || mode==4 || mode==-1) && cm.size()%37==0);
+  const auto cmavg = commonModePerErx(cm, mode);
+  RVec<float> chcm(cm.size());
+  for(size_t i=0; i<cm.size(); i++)
+    chcm[i] = cmavg[i/kChPerErx];
+  return chcm;
+}
 
-  //
-  int nErx = int(cm.size()/37);
+/**
+   @short subtracts in place the common mode (scaled by a slope) from the ADC of the channels of a module
+ */
+void subtractCommonMode(RVec<float> &adc, const rvec_i &cm, int mode=2, float slope=1.) {
 
-  //build the sums to assign per eRx
-  std::vector<float> cmavg(nErx,0.);
-  std::vector<float> navg(nErx,0.);
-  for(int i=0; i<nErx; i++) {
+  assert(adc.size()==cm.size());
+  const auto cmavg = commonModePerErx(cm, mode);
+  for(size_t i=0; i<adc.size(); i++)
+    adc[i] -= slope*cmavg[i/kChPerErx];
+}
 
-    cmavg[i] += cm[i*37];
-    navg[i] += 2;
+/**
+   @short returns the common-mode-subtracted ADC (single copy of the input, then subtracted in place)
+ */
+rvec_f commonModeSubtracted(const rvec_i &adc, const rvec_i &cm, int mode=2, float slope=1.) {
+  RVec<float> sub(adc.begin(), adc.end());
+  subtractCommonMode(sub, cm, mode, slope);
+  return sub;
+}
 
-    //sum all eRx
-    if(mode==-1) {
-      for(int j=0; j<nErx; j++) {
-        if(i==j) continue;
-        cmavg[i] += cm[j*37];
-        navg[i] += 2;
-      }      
-    }
+/**
+   @short offsets of the occupied window of an observable at each scan point, used for the adaptive binning
+   of the scan histograms: the observable is shifted by the offset of its scan point before filling
+   (registered from python, see energyScanHistoFiller in scripts/DigiAnalysisUtils.py)
+ */
+std::map<std::string,std::vector<float> > &scanWindows() {
+  static std::map<std::string,std::vector<float> > windows;
+  return windows;
+}
 
-    //sum in the same ROC
-    if(mode==4) {      
-      if(i%2==1) {
-        cmavg[i] += cm[(i-1)*37];
-        navg[i] += 2;
-      }
-      if(i%2==0 && i<nErx-1) {
-        cmavg[i] += cm[(i+1)*37];
-        navg[i] += 2;
-      }
-    }
-  }//end for
+void registerScanWindow(const std::string &name, const std::vector<float> &offsets) {
+  scanWindows()[name] = offsets;
+}
 
-  //assign the CM to use per readout channel
-  std::vector<float> chcm(cm.size(),0.);
-  for(size_t i=0; i<cm.size(); i++){    
-    int iErx( int(i/37) );
-    chcm[i] =  navg[iErx]>0 ? cmavg[iErx] / navg[iErx] : 0.;
-  }
+const std::vector<float> &scanWindow(const std::string &name) {
+  return scanWindows().at(name);
+}
 
-  return rvec_f(chcm.begin(), chcm.end());
+/**
+   @short shifts the observable by the window offset of the scan point ix (starting at 1)
+ */
+RVec<float> shiftToWindow(const rvec_i &v, const std::vector<float> &offsets, int ix) {
+  float offset = (ix>=1 && ix<=int(offsets.size())) ? offsets[ix-1] : 0.f;
+  RVec<float> shifted(v.size());
+  for(size_t i=0; i<v.size(); i++) shifted[i] = v[i]-offset;
+  return shifted;
 }
 
+float shiftToWindow(double v, const std::vector<float> &offsets, int ix) {
+  float offset = (ix>=1 && ix<=int(offsets.size())) ? offsets[ix-1] : 0.f;
+  return v-offset;
+}
 
 
 #endif
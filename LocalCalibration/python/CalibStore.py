@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+try:
+    from HGCalCommissioning.LocalCalibration.JSONEncoder import saveAsJson
+    from HGCalCommissioning.LocalCalibration.Checkpoint import fileHash
+except ImportError:
+    sys.path.append('./python/')
+    from JSONEncoder import saveAsJson
+    from Checkpoint import fileHash
+
+# name of the index file of a store and version of its format
+INDEX_NAME = 'index.json'
+STORE_VERSION = 1
+
+
+def isCalibStore(url : str) -> bool:
+    """A calibration store is a directory with an index file."""
+    return os.path.isdir(url) and os.path.isfile(os.path.join(url, INDEX_NAME))
+
+
+def shardName(typecode : str, sha1 : str) -> str:
+    """File name of the shard of a module in the store (includes the checksum, so a rewrite never overwrites a shard in use)."""
+    return f'{typecode}_{sha1[:12]}.json'
+
+
+def writeCalibStore(calib, storedir : str, era : str = None, runRange : list = None, source : str = None) -> str:
+    """
+    Writes a level-0 calibration dict (or json file) as a store with one json file per module and an index
+    with the checksum, number of channels and parameters of each shard, and the era / run range of validity.
+    The shards are named after their checksum and the index is written last (both through a temporary file and a rename):
+    an interrupted write does not leave a readable store behind, and rewriting a store does not modify the shards
+    referenced by the previous index, so readers which opened it keep a consistent view.
+    Shards which are no longer referenced are not removed, as readers load them lazily.
+    Returns the url of the index.
+    """
+
+    if isinstance(calib, str):
+        source = calib if source is None else source
+        with open(calib) as fin:
+            calib = json.load(fin)
+
+    os.makedirs(storedir, exist_ok=True)
+    modules = {}
+    for typecode, params in sorted(calib.items()):
+        tmpurl = os.path.join(storedir, f'.{typecode}.{os.getpid()}.tmp')
+        saveAsJson(tmpurl, params)
+        sha1 = fileHash(tmpurl)
+        shard = shardName(typecode, sha1)
+        os.replace(tmpurl, os.path.join(storedir, shard))
+        modules[typecode] = {
+            'file': shard,
+            'sha1': sha1,
+            'nch': len(params['Channel']) if 'Channel' in params else None,
+            'params': sorted(params.keys())
+        }
+
+    index = {
+        'version': STORE_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source': source,
+        'era': era,
+        'runRange': list(runRange) if runRange is not None else None,
+        'modules': modules
+    }
+    indexurl = os.path.join(storedir, INDEX_NAME)
+    tmpurl = f'{indexurl}.{os.getpid()}.tmp'
+    with open(tmpurl, 'w') as fout:
+        json.dump(index, fout, indent=2)
+    os.replace(tmpurl, indexurl)
+    return indexurl
+
+
+class CalibStore:
+    """
+    Lazy, read-only access to a sharded calibration store (see writeCalibStore).
+    Only the index is read when opening the store: the shard of a module is read (and checked against the
+    checksum in the index) the first time one of its parameters is requested, and kept in memory afterwards.
+    """
+
+    def __init__(self, storedir : str, verify : bool = True):
+        if not isCalibStore(storedir):
+            raise IOError(f'{storedir} is not a calibration store')
+        self.storedir = storedir
+        self.verify = verify
+        with open(os.path.join(storedir, INDEX_NAME)) as fin:
+            self.index = json.load(fin)
+        if self.index.get('version', 0) > STORE_VERSION:
+            raise ValueError(f'{storedir} has version {self.index["version"]}, only <={STORE_VERSION} is supported')
+        self._shards = {}
+
+    @property
+    def era(self) -> str:
+        return self.index.get('era')
+
+    @property
+    def runRange(self) -> list:
+        return self.index.get('runRange')
+
+    def covers(self, run : int) -> bool:
+        """True if the run is in the run range of the store (or if no range was specified)."""
+        if self.runRange is None:
+            return True
+        first, last = self.runRange
+        return (first is None or run>=first) and (last is None or run<=last)
+
+    def keys(self) -> list:
+        return list(self.index['modules'].keys())
+
+    def __contains__(self, typecode : str) -> bool:
+        return typecode in self.index['modules']
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.index['modules'])
+
+    def __getitem__(self, typecode : str) -> dict:
+        return self.get(typecode)
+
+    def params(self, typecode : str) -> list:
+        """Parameters available for a module (from the index, the shard is not read)."""
+        return self.index['modules'][typecode]['params']
+
+    def checksum(self, typecode : str) -> str:
+        """Checksum of the shard of a module: modules with the same checksum have identical calibrations."""
+        return self.index['modules'][typecode]['sha1']
+
+    def _readShard(self, typecode : str) -> dict:
+        if typecode in self._shards:
+            return self._shards[typecode]
+        if typecode not in self:
+            raise KeyError(f'{typecode} is not in {self.storedir}')
+        info = self.index['modules'][typecode]
+        url = os.path.join(self.storedir, info['file'])
+        if self.verify and fileHash(url)!=info['sha1']:
+            raise IOError(f'Checksum of {url} does not match the index')
+        with open(url) as fin:
+            self._shards[typecode] = json.load(fin)
+        return self._shards[typecode]
+
+    def get(self, typecode : str, params : list = None) -> dict:
+        """Calibration of a module, optionally restricted to a list of parameters."""
+        shard = self._readShard(typecode)
+        if params is None:
+            return dict(shard)
+        missing = [p for p in params if p not in shard]
+        if len(missing)>0:
+            raise KeyError(f'{missing} not available for {typecode} in {self.storedir}')
+        return { p: shard[p] for p in params }
+
+    def load(self, typecodes : list = None, params : list = None) -> dict:
+        """Calibrations of a list of modules (all if None) as {typecode: {parameter: values}}."""
+        typecodes = self.keys() if typecodes is None else typecodes
+        return { t: self.get(t, params) for t in typecodes }
+
+
+def loadCalib(url : str, typecodes : list = None, params : list = None) -> dict:
+    """Reads a calibration from a store or from a monolithic json file, optionally restricted to some modules and parameters."""
+    if isCalibStore(url):
+        return CalibStore(url).load(typecodes, params)
+    with open(url) as fin:
+        calib = json.load(fin)
+    if typecodes is not None:
+        calib = { t: calib[t] for t in typecodes }
+    if params is not None:
+        calib = { t: { p: v[p] for p in params } for t, v in calib.items() }
+    return calib
+
+
+def exportJson(storedir : str, jsonurl : str, typecodes : list = None, params : list = None) -> str:
+    """Exports a store (or some of its modules / parameters) to the monolithic json format."""
+    saveAsJson(jsonurl, CalibStore(storedir).load(typecodes, params))
+    return jsonurl
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Converts level-0 calibration json files to/from sharded calibration stores')
+    subparsers = parser.add_subparsers(dest='cmd', required=True)
+    parser_shard = subparsers.add_parser('shard', help='write a json file as a store')
+    parser_shard.add_argument('input', help='level-0 calibration json file')
+    parser_shard.add_argument('-o', '--output', required=True, help='output store directory=%(default)s')
+    parser_shard.add_argument('--era', default=None, help='era of the calibration=%(default)s')
+    parser_shard.add_argument('--runRange', type=int, nargs=2, default=None, help='first and last run of validity=%(default)s')
+    parser_export = subparsers.add_parser('export', help='export a store as a json file')
+    parser_export.add_argument('input', help='store directory')
+    parser_export.add_argument('-o', '--output', default='level0_calib_params.json', help='output json file=%(default)s')
+    parser_export.add_argument('-m', '--moduleList', nargs='+', default=None, help='modules to export=%(default)s')
+    parser_export.add_argument('-p', '--params', nargs='+', default=None, help='parameters to export=%(default)s')
+    args = parser.parse_args()
+
+    if args.cmd=='shard':
+        indexurl = writeCalibStore(args.input, args.output, era=args.era, runRange=args.runRange)
+        print(f'Store written with index {indexurl}')
+    else:
+        jsonurl = exportJson(args.input, args.output, args.moduleList, args.params)
+        print(f'Store exported to {jsonurl}')
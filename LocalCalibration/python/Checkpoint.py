@@ -0,0 +1,106 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import traceback
+
+# command line options which do not change the result of the analysis of a module
+IGNORED_ARGS = ['input', 'output', 'scanmap', 'moduleList', 'task_spec', 'maxThreads', 'forceRewrite', 'skipHistoFiller',
+                'createHistoFillerTask', 'nosub', 'verbosity', 'resume', 'catalog', 'stagingDir', 'stagingSizeGB']
+
+
+def fileHash(url : str, blocksize : int = 1<<22) -> str:
+    """SHA1 of the contents of a file, read in blocks."""
+    sha1 = hashlib.sha1()
+    with open(url,'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def argsHash(cmdargs, ignore : list = IGNORED_ARGS) -> str:
+    """SHA1 of the command line options relevant for the analysis."""
+    args = { k: v for k, v in sorted(vars(cmdargs).items()) if k not in ignore }
+    return hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def atomicDump(url : str, obj):
+    """Pickles obj to a temporary file in the same directory and renames it, so that a killed job never leaves a truncated file."""
+    outdir = os.path.dirname(os.path.abspath(url))
+    os.makedirs(outdir, exist_ok=True)
+    fd, tmpurl = tempfile.mkstemp(dir=outdir, prefix='.'+os.path.basename(url), suffix='.tmp')
+    try:
+        with os.fdopen(fd,'wb') as fout:
+            pickle.dump(obj, fout, protocol=pickle.HIGHEST_PROTOCOL)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmpurl, url)
+    except BaseException:
+        if os.path.isfile(tmpurl):
+            os.remove(tmpurl)
+        raise
+
+
+class CheckpointedTask:
+    """Picklable wrapper of the per-module analysis for multiprocessing pools.
+    The result of each module is stored in {ckptdir}/{typecode}.pkl together with the size, modification time
+    (and, in resume mode, the hash) of the histogram file and the hash of the command line options.
+    In resume mode a module is not re-analyzed if neither has changed.
+    Returns (typecode, result, error): failures are caught and reported in error so that the other modules
+    are still analyzed and checkpointed."""
+
+    def __init__(self, func, ckptdir : str, argshash : str, resume : bool = False):
+        self.func = func
+        self.ckptdir = ckptdir
+        self.argshash = argshash
+        self.resume = resume
+
+    def histoInfo(self, url : str, cached : dict = None, hash : bool = True) -> dict:
+        """Size, modification time and hash of the histogram file. The hash is re-used if size and time are unchanged,
+        otherwise it is only computed if hash is True (it is left empty when not resuming, to avoid reading the file)."""
+        if not os.path.isfile(url):
+            return { 'url': url, 'size': None, 'mtime': None, 'sha1': None }
+        st = os.stat(url)
+        info = { 'url': url, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': None }
+        if cached is not None and cached.get('size')==info['size'] and cached.get('mtime')==info['mtime']:
+            info['sha1'] = cached.get('sha1')
+        elif hash:
+            info['sha1'] = fileHash(url)
+        return info
+
+    def sameHisto(self, histo : dict, cached : dict) -> bool:
+        """The histogram file is unchanged if it has the same size and modification time, or the same hash, as in the checkpoint."""
+        if histo['size'] is None or cached is None:
+            return False
+        if histo['size']==cached.get('size') and histo['mtime']==cached.get('mtime'):
+            return True
+        return histo['sha1'] is not None and histo['sha1']==cached.get('sha1')
+
+    def load(self, url : str) -> dict:
+        """Loads a checkpoint, returns None if missing or unreadable."""
+        try:
+            with open(url,'rb') as fin:
+                return pickle.load(fin)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def __call__(self, task):
+        typecode, url = task[0], task[1]
+        ckpturl = f'{self.ckptdir}/{typecode}.pkl'
+
+        # re-use the previous result if inputs are unchanged
+        ckpt = self.load(ckpturl) if self.resume else None
+        histo = self.histoInfo(url, cached=ckpt['histo'] if ckpt else None, hash=self.resume)
+        if ckpt is not None and ckpt['args']==self.argshash and self.sameHisto(histo, ckpt['histo']):
+            print(f'Resuming {typecode} from {ckpturl}')
+            return typecode, ckpt['result'], None
+
+        try:
+            result = self.func(task)
+        except Exception as e:
+            print(f'ERROR! Analysis of {typecode} failed : {e}')
+            traceback.print_exc()
+            return typecode, None, f'{type(e).__name__}: {e}'
+        atomicDump(ckpturl, { 'typecode': typecode, 'histo': histo, 'args': self.argshash, 'result': result })
+        return typecode, result, None
@@ -0,0 +1,185 @@
+import os
+import re
+import glob
+import json
+import time
+import fnmatch
+import sqlite3
+
+# default location of the catalog (kept out of EOS, where sqlite locking is not reliable)
+DEFAULT_CATALOG = os.environ.get('HGCAL_FILECATALOG', os.path.expanduser('~/.cache/hgcal_filecatalog.db'))
+
+
+def parseRunLumi(url : str, nano_patt : str = r'NANO_(\d+)_(\d+)\.root$') -> tuple:
+    """Run and lumi chunk from a NANO file name, (None, None) for other files."""
+    m = re.search(nano_patt, os.path.basename(url))
+    if m is None:
+        return None, None
+    return int(m.group(1)), int(m.group(2))
+
+
+def readNANOInfo(url : str) -> tuple:
+    """Opens a NANO file and returns the number of events and the modules as {typecode: (fedId, Seq, nErx)}."""
+    import ROOT
+    fIn = ROOT.TFile.Open(url)
+    if not fIn or fIn.IsZombie():
+        raise IOError(f'Could not open {url}')
+    entries = int(fIn.Get("Events").GetEntries()) # from the tree header, no event loop
+    fIn.Close()
+    modules = {}
+    runs = ROOT.RDataFrame("Runs",url).AsNumpy()
+    for k,v in runs.items():
+        if k.find('HGCTypeCodes')!=0 : continue
+        typecode = k.replace('HGCTypeCodes_','')
+        idx = v[0][0]
+        nerx = int(runs['HGCReadout_nErx'][0][idx]) if 'HGCReadout_nErx' in runs else 6 # remove once all NANO has this
+        modules[typecode] = (int(runs['HGCReadout_FED'][0][idx]), int(runs['HGCReadout_Seq'][0][idx]), nerx)
+    return entries, modules
+
+
+class FileCatalog:
+    """
+    Persistent catalog of the files of the scan inputs (run, lumi chunk, path, size, mtime, entries, modules) in a sqlite file.
+    Directories are only listed again if their mtime changed and files are only re-inspected if their size or mtime changed,
+    so that once the catalog is filled the calibration tools can build their tasks without touching any data file.
+    """
+
+    def __init__(self, url : str = DEFAULT_CATALOG):
+        self.url = url
+        self._conn, self._pid = None, None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection to the catalog, re-opened in forked processes."""
+        if self._conn is None or self._pid!=os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.url)), exist_ok=True)
+            self._conn = sqlite3.connect(self.url, timeout=60)
+            self._conn.row_factory = sqlite3.Row
+            self._pid = os.getpid()
+            with self._conn:
+                self._conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, directory TEXT, run INTEGER, lumi INTEGER, '
+                                   'size INTEGER, mtime REAL, entries INTEGER, modules TEXT)')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime REAL, updated REAL)')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS files_dir ON files (directory)')
+                self._conn.execute('CREATE INDEX IF NOT EXISTS files_run ON files (run, lumi)')
+        return self._conn
+
+    def update(self, directory : str, force : bool = False) -> dict:
+        """
+        Synchronizes the catalog with the content of a directory by stat-diffing: new files are added,
+        files with a different size/mtime have their metadata reset, missing files are removed.
+        The directory is only listed again if its mtime changed (files added or removed),
+        the files already in the catalog are always stat'ed as they may be rewritten in place.
+        Returns the number of added/changed/removed files.
+        """
+        directory = os.path.normpath(directory)
+        counts = { 'added':0, 'changed':0, 'removed':0 }
+        try:
+            dirmtime = os.stat(directory).st_mtime
+        except OSError:
+            return counts
+        row = self.conn.execute('SELECT mtime FROM directories WHERE path=?', (directory,)).fetchone()
+        listdir = force or row is None or row['mtime']!=dirmtime
+
+        known = { r['path'] : (r['size'],r['mtime']) for r in self.conn.execute('SELECT path, size, mtime FROM files WHERE directory=?', (directory,)) }
+        if listdir:
+            current = { entry.path : entry.stat() for entry in os.scandir(directory) if entry.is_file() }
+        else:
+            current = { }
+            for path in known:
+                try:
+                    current[path] = os.stat(path)
+                except OSError:
+                    continue
+        with self.conn:
+            for path, st in current.items():
+                if path not in known:
+                    run, lumi = parseRunLumi(path)
+                    self.conn.execute('INSERT INTO files VALUES (?,?,?,?,?,?,NULL,NULL)', (path, directory, run, lumi, st.st_size, st.st_mtime))
+                    counts['added'] += 1
+                elif known[path]!=(st.st_size, st.st_mtime):
+                    self.conn.execute('UPDATE files SET size=?, mtime=?, entries=NULL, modules=NULL WHERE path=?', (st.st_size, st.st_mtime, path))
+                    counts['changed'] += 1
+            removed = [ (p,) for p in known if p not in current ]
+            self.conn.executemany('DELETE FROM files WHERE path=?', removed)
+            counts['removed'] = len(removed)
+            if listdir:
+                self.conn.execute('INSERT OR REPLACE INTO directories VALUES (?,?,?)', (directory, dirmtime, time.time()))
+        return counts
+
+    def glob(self, pattern : str) -> list:
+        """Drop-in replacement of glob.glob for files: the directories are synchronized and the file names matched in the catalog."""
+        dirpattern, fpattern = os.path.split(os.path.normpath(pattern))
+        directories = glob.glob(dirpattern) if glob.has_magic(dirpattern) else [dirpattern or '.']
+        urls = []
+        for directory in directories:
+            directory = os.path.normpath(directory)
+            self.update(directory)
+            urls += [ r['path'] for r in self.conn.execute('SELECT path FROM files WHERE directory=? ORDER BY path', (directory,))
+                      if fnmatch.fnmatchcase(os.path.basename(r['path']), fpattern) ]
+        return urls
+
+    def inspect(self, url : str) -> dict:
+        """Returns the catalog entry of a file, reading the number of events and the modules once if not yet known."""
+        url = os.path.normpath(url)
+        row = self.conn.execute('SELECT * FROM files WHERE path=?', (url,)).fetchone()
+        if row is None:
+            self.update(os.path.dirname(url), force=True)
+            row = self.conn.execute('SELECT * FROM files WHERE path=?', (url,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(url)
+        if row['modules'] is None:
+            entries, modules = readNANOInfo(url)
+            with self.conn:
+                self.conn.execute('UPDATE files SET entries=?, modules=? WHERE path=?', (entries, json.dumps(modules), url))
+            row = self.conn.execute('SELECT * FROM files WHERE path=?', (url,)).fetchone()
+        return self.toDict(row)
+
+    def getModules(self, url : str) -> dict:
+        """Modules of a NANO file as {typecode: (fedId, Seq, nErx)}."""
+        return { k: tuple(v) for k, v in self.inspect(url)['modules'].items() }
+
+    def query(self, run : int = None, lumi : int = None, directory : str = None, typecode : str = None) -> list:
+        """Catalog entries matching a run, lumi chunk, directory and/or module (only already inspected files for the module)."""
+        conds, values = [], []
+        for col, val in [('run',run), ('lumi',lumi), ('directory', os.path.normpath(directory) if directory else None)]:
+            if val is None: continue
+            conds.append(f'{col}=?')
+            values.append(val)
+        sql = 'SELECT * FROM files' + (' WHERE '+' AND '.join(conds) if conds else '') + ' ORDER BY run, lumi, path'
+        rows = [ self.toDict(r) for r in self.conn.execute(sql, values) ]
+        if typecode is not None:
+            rows = [ r for r in rows if r['modules'] is not None and typecode in r['modules'] ]
+        return rows
+
+    @staticmethod
+    def toDict(row : sqlite3.Row) -> dict:
+        entry = dict(row)
+        entry['modules'] = json.loads(entry['modules']) if entry['modules'] is not None else None
+        return entry
+
+
+if __name__ == '__main__':
+
+    # fill or refresh the catalog for a list of directories, e.g.
+    # python3 python/FileCatalog.py /eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/Test/Run*/*/prompt --inspect
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directories', nargs='+', help='directories (or patterns) to catalog')
+    parser.add_argument('-c', '--catalog', default=DEFAULT_CATALOG, help='catalog file=%(default)s')
+    parser.add_argument('--inspect', action='store_true', help='read entries and modules of the NANO files not yet inspected')
+    parser.add_argument('--force', action='store_true', help='list directories even if their mtime did not change')
+    args = parser.parse_args()
+
+    catalog = FileCatalog(args.catalog)
+    for pattern in args.directories:
+        for directory in glob.glob(pattern):
+            counts = catalog.update(directory, force=args.force)
+            print(f'{directory} : {counts}')
+            if not args.inspect: continue
+            for entry in catalog.query(directory=directory):
+                if entry['run'] is None or entry['modules'] is not None: continue
+                try:
+                    catalog.inspect(entry['path'])
+                except Exception as e:
+                    print(f'WARNING! Failed to inspect {entry["path"]} : {e}')
@@ -0,0 +1,97 @@
+import os
+import fcntl
+
+# directory where the compiled helper libraries are kept (JIT only if empty)
+HELPERS_LIBDIR = os.environ.get('HGCAL_HELPERS_LIBDIR', os.path.abspath('./lib'))
+
+# ROOT libraries the helpers need to be linked against
+HELPERS_DEPS = {
+    'helpers.h'    : ['libROOTVecOps'],
+    'fit_models.h' : ['libRooFitCore', 'libRooFit'],
+}
+
+# headers already made available in this process
+_loaded = {}
+
+
+def libraryPath(header : str, libdir : str = HELPERS_LIBDIR) -> str:
+    """Path of the shared library compiled from a header, e.g. interface/helpers.h -> {libdir}/libhelpers.so"""
+    import ROOT
+    name = os.path.splitext(os.path.basename(header))[0]
+    return f'{libdir}/lib{name}.{ROOT.gSystem.GetSoExt()}'
+
+
+def isUpToDate(header : str, lib : str) -> bool:
+    return os.path.isfile(lib) and os.path.getmtime(lib)>=os.path.getmtime(header)
+
+
+def buildLibrary(header : str, libdir : str = HELPERS_LIBDIR, force : bool = False) -> str:
+    """
+    Compiles a header with ACLiC into a shared library with its dictionary. A lock in the library directory
+    makes concurrent processes wait for the first one to build it instead of compiling it several times.
+    Returns the path to the library or None if the compilation failed.
+    """
+    import ROOT
+    os.makedirs(libdir, exist_ok=True)
+    lib = libraryPath(header, libdir)
+    with open(lib+'.lock','a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if force or not isUpToDate(header, lib):
+                print(f'Compiling {header} into {lib}')
+                for dep in HELPERS_DEPS.get(os.path.basename(header),[]):
+                    ROOT.gSystem.Load(dep)
+                opts = 'kOf' if force else 'kO'
+                if not ROOT.gSystem.CompileMacro(os.path.abspath(header), opts, os.path.splitext(os.path.basename(lib))[0], libdir):
+                    return None
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return lib if os.path.isfile(lib) else None
+
+
+def loadHelpers(header : str, libdir : str = HELPERS_LIBDIR, build : bool = True) -> bool:
+    """
+    Makes the functions of a header available to ROOT (and RDataFrame Define/Filter expressions):
+    the precompiled library is loaded with gSystem.Load (and built once if missing or older than the header)
+    falling back to the JIT of the header with gInterpreter.Declare.
+    Returns True if the compiled library is used. Repeated calls in the same process are no-ops.
+    """
+    import ROOT
+    if header in _loaded:
+        return _loaded[header]
+
+    compiled = False
+    if libdir:
+        lib = libraryPath(header, libdir)
+        if build and not isUpToDate(header, lib):
+            try:
+                lib = buildLibrary(header, libdir)
+            except OSError as e:
+                print(f'WARNING! Could not build library for {header} : {e}')
+                lib = None
+        if lib is not None and isUpToDate(header, lib):
+            for dep in HELPERS_DEPS.get(os.path.basename(header),[]):
+                ROOT.gSystem.Load(dep)
+            compiled = ROOT.gSystem.Load(lib)>=0
+
+    if not compiled:
+        print(f'Compiled library for {header} not available, falling back to JIT')
+        ROOT.gInterpreter.Declare(f'#include "{header}"')
+    _loaded[header] = compiled
+    return compiled
+
+
+if __name__ == '__main__':
+
+    # (re-)build the helper libraries once, e.g. after a header has been changed
+    # python3 python/HelperLibrary.py interface/helpers.h interface/fit_models.h
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('headers', nargs='*', default=['interface/helpers.h','interface/fit_models.h'], help='headers to compile=%(default)s')
+    parser.add_argument('-l', '--libdir', default=HELPERS_LIBDIR, help='output directory=%(default)s')
+    parser.add_argument('--force', action='store_true', help='re-compile even if the libraries are up to date')
+    args = parser.parse_args()
+
+    for header in args.headers:
+        lib = buildLibrary(header, args.libdir, force=args.force)
+        print(f'{header} -> {lib}')
@@ -0,0 +1,210 @@
+import numpy as np
+
+# parameters of the MIP model, in the same order as the floating parameters of the RooFit model in interface/fit_models.h
+PARNAMES = ['bkg_frac', 'loc', 'mpv', 'sigma', 'sigmal', 'singlemip_frac']
+
+# internal parameter order: shape parameters first, then the fractions
+_IPARS = ['loc', 'sigma', 'mpv', 'sigmal', 'singlemip_frac', 'bkg_frac']
+_TOEXT = [_IPARS.index(p) for p in PARNAMES]
+
+# parameter ranges (same defaults as defineMIPFitWorkspace)
+DEFAULT_BOUNDS = {
+    'loc'            : (-10., 10.),
+    'sigma'          : (0.5, 10.),
+    'mpv'            : (5., 35.),
+    'sigmal'         : (1., 70.),
+    'singlemip_frac' : (0.95, 1.),
+    'bkg_frac'       : (0., 1.),
+}
+
+
+def landauCF(t : np.ndarray) -> tuple:
+    """
+    Characteristic function of the standard Landau distribution (normalised as TMath::Landau, i.e. peak at ~-0.22)
+    and its logarithmic derivative, for t>=0: psi(t) = exp(-pi/2 t - i t ln t)
+    """
+    logt = np.log(np.where(t>0, t, 1.))
+    psi = np.exp(-0.5*np.pi*t - 1j*t*logt)
+    dlogpsi = np.where(t>0, -0.5*np.pi - 1j*(logt+1.), 0.)
+    return psi, dlogpsi
+
+
+class LandauGaussModel:
+    """
+    Binned noise + MIP model of interface/fit_models.h evaluated for a batch of channels at once:
+      bkg_frac * Gauss(loc,sigma) + (1-bkg_frac) * [ f * Landau(loc+mpv,sigmal) + (1-f) * Landau(loc+2mpv,sigmal) ] (x) Gauss(0,sigma)
+    with f = singlemip_frac. The Landau (x) Gauss convolutions are computed as a product of the (analytic) characteristic
+    functions followed by an inverse FFT on a fine grid which is padded to keep the Landau tail from wrapping around.
+    Each component is normalised in the histogram range. Returns the pdf at the bin centres and its gradient.
+    """
+
+    def __init__(self, centers : np.ndarray, oversample : int = 2, padding : float = 8.):
+        self.centers = np.asarray(centers, dtype=float)
+        self.nbins = len(self.centers)
+        self.width = self.centers[1]-self.centers[0]
+        self.oversample = oversample
+        self.h = self.width/oversample
+        nfine = int(np.ceil(padding*self.nbins*oversample))
+        self.ngrid = 1<<int(np.ceil(np.log2(nfine)))
+        self.omega = 2*np.pi*np.fft.rfftfreq(self.ngrid, d=self.h)
+
+    def _conv(self, shift, sigma, sigmal):
+        """Landau(shift,sigmal) (x) Gauss(0,sigma) at the bin centres and its derivatives in (shift, sigma, sigmal)."""
+        w = self.omega[None,:]
+        psi, dlogpsi = landauCF(sigmal[:,None]*w)
+        cf = np.exp(1j*w*(shift[:,None]-self.centers[0])) * psi * np.exp(-0.5*(sigma[:,None]*w)**2)
+        terms = np.stack([cf, 1j*w*cf, -sigma[:,None]*w*w*cf, w*dlogpsi*cf]) # value, d/dshift, d/dsigma, d/dsigmal
+        vals = np.fft.irfft(np.conj(terms), n=self.ngrid, axis=-1)[...,:self.nbins*self.oversample:self.oversample]/self.h
+        return vals[0], vals[1], vals[2], vals[3]
+
+    @staticmethod
+    def _normalise(c, dc, width):
+        """Normalise a component (and its derivatives) to unit integral in the histogram range."""
+        norm = c.sum(axis=-1, keepdims=True)*width
+        dnorm = dc.sum(axis=-1, keepdims=True)*width
+        cn = c/norm
+        return cn, (dc - cn[None]*dnorm)/norm[None]
+
+    def evaluate(self, pars : np.ndarray) -> tuple:
+        """pdf (nch,nbins) and gradient (6,nch,nbins) for the parameters pars (nch,6) in the internal order."""
+        loc, sigma, mpv, sigmal, frac, bkg = pars.T
+        x = self.centers[None,:]
+
+        # noise
+        z = (x-loc[:,None])/sigma[:,None]
+        g = np.exp(-0.5*z*z)/(np.sqrt(2*np.pi)*sigma[:,None])
+        dg = np.stack([g*z/sigma[:,None], g*(z*z-1)/sigma[:,None]]) # d/dloc, d/dsigma
+        g, dg = self._normalise(g, dg, self.width)
+
+        # single and double MIP
+        l1, dl1_dshift, dl1_dsigma, dl1_dsigmal = self._conv(loc+mpv, sigma, sigmal)
+        l1, dl1 = self._normalise(l1, np.stack([dl1_dshift, dl1_dsigma, dl1_dshift, dl1_dsigmal]), self.width)
+        l2, dl2_dshift, dl2_dsigma, dl2_dsigmal = self._conv(loc+2*mpv, sigma, sigmal)
+        l2, dl2 = self._normalise(l2, np.stack([dl2_dshift, dl2_dsigma, 2*dl2_dshift, dl2_dsigmal]), self.width)
+
+        # combine
+        frac, bkg = frac[:,None], bkg[:,None]
+        sig = frac*l1 + (1-frac)*l2
+        pdf = bkg*g + (1-bkg)*sig
+        grad = np.zeros((6,)+pdf.shape)
+        grad[0:4] = (1-bkg)[None]*(frac[None]*dl1 + (1-frac)[None]*dl2)
+        grad[0:2] += bkg[None]*dg
+        grad[4] = (1-bkg)*(l1-l2)
+        grad[5] = g-sig
+        return pdf, grad
+
+
+def initialParameters(centers : np.ndarray, counts : np.ndarray, bounds : dict = DEFAULT_BOUNDS, noiseran : tuple = (-5.,5.)) -> np.ndarray:
+    """Starting values (nch,6) in the internal order: noise from the moments in noiseran, MPV from the peak above the noise."""
+    x = centers[None,:]
+    innoise = (centers>=noiseran[0]) & (centers<=noiseran[1])
+    n0 = np.where(innoise[None,:], counts, 0.)
+    sumw = n0.sum(axis=1)
+    loc = np.divide((n0*x).sum(axis=1), sumw, out=np.zeros(len(counts)), where=sumw>0)
+    var = np.divide((n0*x*x).sum(axis=1), sumw, out=np.ones(len(counts)), where=sumw>0) - loc**2
+    sigma = np.sqrt(np.clip(var, bounds['sigma'][0]**2, None))
+    above = x>(loc+3*sigma)[:,None]
+    ipeak = np.argmax(np.where(above, counts, -1), axis=1)
+    mpv = centers[ipeak]-loc
+    total = counts.sum(axis=1)
+    bkg = np.divide(np.where(~above, counts, 0).sum(axis=1), total, out=np.full(len(counts),0.8), where=total>0)
+    pars = np.stack([loc, sigma, mpv, np.full(len(counts),1.), np.full(len(counts),0.975), bkg], axis=1)
+    lo, hi = np.array([bounds[p] for p in _IPARS]).T
+    return np.clip(np.nan_to_num(pars), lo, hi)
+
+
+def fitMIPSpectra(centers : np.ndarray, counts : np.ndarray, batchSize : int = 64, bounds : dict = DEFAULT_BOUNDS,
+                  maxiter : int = 200, tol : float = 1e-6, verbose : bool = False) -> dict:
+    """
+    Binned maximum likelihood fit of the MIP model (see LandauGaussModel) to the energy spectra counts (nch,nbins)
+    with bin centres centers. The channels of a batch are minimised together with damped Newton steps
+    (Levenberg-Marquardt on the Fisher information built from the analytic gradient), projected on the parameter ranges.
+    Each channel has its own damping and stops when the decrease of its negative log-likelihood is below tol.
+    The uncertainties are obtained from the Hessian, computed from finite differences of the gradient.
+    Returns a dict with parNames, parVals (nch,6), parUncs (nch,6), chi2, ndof, status and model (expected counts per bin)
+    where status is 0 if converged, 1 if maxiter was reached, 2 if the Hessian is not positive definite, 3 for empty spectra.
+    """
+    centers = np.asarray(centers, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    nch, nbins = counts.shape
+    model = LandauGaussModel(centers)
+    lo, hi = np.array([bounds[p] for p in _IPARS]).T
+    total = counts.sum(axis=1)
+
+    def nllAndGrad(pars, n, fisher=False):
+        pdf, grad = model.evaluate(pars)
+        pdf = np.clip(pdf, 1e-300, None)
+        nll = -(n*np.log(pdf*model.width)).sum(axis=1)
+        dnll = -(n[None]*grad/pdf[None]).sum(axis=2).T
+        if not fisher:
+            return nll, dnll
+        info = np.einsum('icj,kcj->cik', grad, grad/pdf[None])*(n.sum(axis=1)*model.width)[:,None,None]
+        return nll, dnll, info
+
+    parvals = initialParameters(centers, counts, bounds)
+    paruncs = np.zeros((nch,6))
+    status = np.where(total>0, 0, 3)
+    for i0 in range(0, nch, batchSize):
+        sel = np.arange(i0, min(i0+batchSize,nch))
+        sel = sel[total[sel]>0]
+        if len(sel)==0: continue
+        n = counts[sel]
+        pars = parvals[sel]
+        damping = np.full(len(sel), 1e-3)
+        active = np.ones(len(sel), dtype=bool)
+        nll, dnll, info = nllAndGrad(pars, n, fisher=True)
+        for it in range(maxiter):
+            if not active.any(): break
+            ia = np.nonzero(active)[0]
+
+            # Newton step on the free parameters (the ones at a range limit with the gradient pointing outwards are fixed)
+            p, g = pars[ia], dnll[ia]
+            fixed = ((p<=lo) & (g>0)) | ((p>=hi) & (g<0))
+            a = info[ia] + damping[ia,None,None]*np.einsum('cii->ci', info[ia])[:,:,None]*np.eye(6)[None]
+            a[fixed] = 0.
+            a = np.where(fixed[:,None,:], 0., a) + np.where(fixed[:,:,None], np.eye(6)[None], 0.)
+            step = np.linalg.solve(a, np.where(fixed, 0., -g)[...,None])[...,0]
+            ptry = np.clip(p+step, lo, hi)
+            nlltry, dnlltry, infotry = nllAndGrad(ptry, n[ia], fisher=True)
+
+            # accept the steps which decrease the likelihood, increase the damping otherwise
+            accept = np.isfinite(nlltry) & (nlltry<=nll[ia])
+            done = (accept & (nll[ia]-nlltry<tol)) | (damping[ia]>1e10)
+            ib = ia[accept]
+            pars[ib], nll[ib], dnll[ib], info[ib] = ptry[accept], nlltry[accept], dnlltry[accept], infotry[accept]
+            damping[ia] = np.where(accept, np.maximum(damping[ia]/10, 1e-9), damping[ia]*10)
+            active[ia[done]] = False
+        parvals[sel] = pars
+        status[sel[active]] = 1
+        if verbose:
+            print(f'Batch {i0//batchSize}: {len(sel)} channels, {it+1} iterations, {active.sum()} not converged')
+
+        # Hessian of each channel: the likelihood is separable so each parameter is shifted in all channels at once
+        hess = np.zeros((len(sel),6,6))
+        eps = 1e-5*np.maximum(1., np.abs(pars))
+        eps = np.where(pars+eps>hi, -eps, eps) # stay in range
+        for ip in range(6):
+            shifted = pars.copy()
+            shifted[:,ip] += eps[:,ip]
+            _, g1 = nllAndGrad(shifted, n)
+            hess[:,:,ip] = (g1-dnll)/eps[:,ip,None]
+        hess = 0.5*(hess+np.transpose(hess,(0,2,1)))
+        posdef = np.all(np.linalg.eigvalsh(hess)>0, axis=1)
+        cov = np.linalg.pinv(hess)
+        paruncs[sel] = np.sqrt(np.abs(np.diagonal(cov, axis1=1, axis2=2)))
+        status[sel] = np.where((status[sel]==0) & ~posdef, 2, status[sel])
+
+    # goodness of fit (empty bins are not used, as in the RooFit chi2)
+    pdf, _ = model.evaluate(parvals)
+    expected = total[:,None]*pdf*model.width
+    filled = counts>0
+    chi2 = np.where(filled, (counts-expected)**2/np.where(filled, counts, 1.), 0.).sum(axis=1)
+    return {
+        'parNames' : PARNAMES,
+        'parVals'  : parvals[:,_TOEXT],
+        'parUncs'  : paruncs[:,_TOEXT],
+        'chi2'     : chi2,
+        'ndof'     : np.full(nch, nbins-6),
+        'status'   : status,
+        'model'    : expected,
+    }
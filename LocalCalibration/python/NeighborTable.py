@@ -0,0 +1,77 @@
+import sys
+import numpy as np
+from functools import lru_cache
+try:
+    from HGCalCommissioning.LocalCalibration.mapping import getChannelMap, waferType, DEFAULT_CELLMAP
+except ImportError:
+    sys.path.append('./python/')
+    from mapping import getChannelMap, waferType, DEFAULT_CELLMAP
+
+
+@lru_cache(maxsize=None)
+def buildNeighborTable(waftype : str, cellmap : str = DEFAULT_CELLMAP, maxduv : int = 1) -> tuple:
+    """
+    Builds the neighbor table of the readout channels of a wafer type in CSR layout (offsets, indices):
+    the neighbors of channel ch are indices[offsets[ch]:offsets[ch+1]]. Neighbors are the cells within maxduv
+    in hexagonal (u,v) distance, the channel itself is not included. Only Si cells (no calibration/CM channels) have neighbors.
+    The table is built once per process for each wafer type.
+    """
+    chmap = getChannelMap(waftype, cellmap)
+    issi = (chmap.chtype==1)
+    ch = np.nonzero(issi)[0].astype(np.int32)
+    u, v = chmap.u[issi], chmap.v[issi]
+
+    # look up the channel at each (u+du,v+dv) in the dense (u,v) map
+    src, dst = [], []
+    for du in range(-maxduv, maxduv+1):
+        for dv in range(-maxduv, maxduv+1):
+            if (du==0 and dv==0) or abs(dv-du)>maxduv: continue
+            nb = chmap.fromUV(u+du, v+dv)
+            found = (nb>=0)
+            found[found] = issi[nb[found]]
+            src.append(ch[found])
+            dst.append(nb[found])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+
+    order = np.lexsort((dst, src))
+    indices = dst[order].astype(np.int32)
+    offsets = np.zeros(chmap.nch+1, dtype=np.int32)
+    offsets[1:] = np.cumsum(np.bincount(src, minlength=chmap.nch))
+    return offsets, indices
+
+
+def neighborRows(offsets : np.ndarray) -> np.ndarray:
+    """Row (channel) of each entry of the indices array."""
+    return np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+
+
+def neighborSum(offsets : np.ndarray, indices : np.ndarray, values : np.ndarray) -> np.ndarray:
+    """Sum of the values of the neighbors of each channel (values is a dense per-channel array, last axis)."""
+    values = np.asarray(values)
+    gathered = values[...,indices]
+    rows = neighborRows(offsets)
+    nbsum = np.zeros(values.shape[:-1]+(len(offsets)-1,), dtype=gathered.dtype)
+    np.add.at(nbsum, (...,rows), gathered)
+    return nbsum
+
+
+def localMaxima(offsets : np.ndarray, indices : np.ndarray, values : np.ndarray, threshold : float = 0.) -> np.ndarray:
+    """Mask of the channels above threshold whose value is not smaller than any of their neighbors (cluster seeds)."""
+    values = np.asarray(values)
+    rows = neighborRows(offsets)
+    nbmax = np.full(values.shape[:-1]+(len(offsets)-1,), -np.inf)
+    np.maximum.at(nbmax, (...,rows), values[...,indices])
+    return (values>threshold) & (values>=nbmax)
+
+
+def declareNeighborTable(typecode : str, cellmap : str = DEFAULT_CELLMAP, maxduv : int = 1) -> str:
+    """
+    Registers the neighbor table of the module in the C++ helpers (see interface/helpers.h) and returns its name,
+    to be used in RDataFrame expressions as e.g. neighborSum(neighborTable("ML-F_1"),ch,en)
+    """
+    import ROOT
+    waftype = waferType(typecode)
+    name = f'{waftype}_{maxduv}'
+    offsets, indices = buildNeighborTable(waftype, cellmap, maxduv)
+    ROOT.registerNeighborTable(name, ROOT.std.vector['int'](offsets.tolist()), ROOT.std.vector['int'](indices.tolist()))
+    return name
@@ -0,0 +1,198 @@
+import os
+import time
+import json
+import resource
+import threading
+from contextlib import contextmanager
+
+
+def getRSS() -> float:
+    """Current resident set size of this process in MB (Linux /proc, falls back on the peak RSS)."""
+    try:
+        with open('/proc/self/statm','r') as statm:
+            return int(statm.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024.**2
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def getChildrenPeakRSS() -> float:
+    """Largest peak RSS among the terminated (and waited for) child processes in MB, e.g. the workers of a closed pool."""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024.
+
+
+def getCPUTime(children : bool = True) -> float:
+    """User+system CPU time of this process (and of its finished children) in seconds."""
+    t = os.times()
+    cpu = t.user + t.system
+    if children:
+        cpu += t.children_user + t.children_system
+    return cpu
+
+
+class PeakRSSMonitor:
+    """Samples the RSS of the current process in a background thread to get the peak of a block of code."""
+
+    def __init__(self, interval : float = 0.2):
+        self.interval = interval
+        self.peak = getRSS()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, getRSS())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, getRSS())
+        return False
+
+
+def profileCall(func, args, name : str, category : str) -> tuple:
+    """Runs func(args) and returns (result, record) with wall time, CPU time and peak RSS of the call."""
+    t0, cpu0, ts = time.perf_counter(), getCPUTime(), time.time()
+    with PeakRSSMonitor() as mon:
+        result = func(args)
+    record = {
+        'name': name,
+        'category': category,
+        'pid': os.getpid(),
+        'start': ts,
+        'wall': time.perf_counter()-t0,
+        'cpu': getCPUTime()-cpu0,
+        'peak_rss': mon.peak,
+    }
+    return result, record
+
+
+class ProfiledTask:
+    """Picklable wrapper of a task function for multiprocessing pools: returns (result, profiling record).
+    The task label is taken from the element labelidx of the task tuple."""
+
+    def __init__(self, func, category : str, labelidx : int = 0):
+        self.func = func
+        self.category = category
+        self.labelidx = labelidx
+
+    def __call__(self, task):
+        try:
+            name = str(task[self.labelidx])
+        except (TypeError, IndexError):
+            name = self.category
+        return profileCall(self.func, task, name=name, category=self.category)
+
+
+class StageProfiler:
+    """Collects wall time, CPU time (including child processes) and peak RSS for the stages of a job
+    and for the tasks run in worker processes, and writes them as a Chrome trace and a summary table."""
+
+    def __init__(self, name : str = 'job'):
+        self.name = name
+        self.pid = os.getpid()
+        self.records = []
+        self._open = {}
+
+    def start(self, name : str):
+        """Starts profiling a stage run in the main process (to be closed with stop)."""
+        mon = PeakRSSMonitor()
+        mon.__enter__()
+        self._open[name] = (time.perf_counter(), getCPUTime(), time.time(), mon)
+
+    def stop(self, name : str):
+        """Stops profiling a stage opened with start and stores its record."""
+        t0, cpu0, ts, mon = self._open.pop(name)
+        mon.__exit__()
+        self.records.append({
+            'name': name,
+            'category': 'stage',
+            'pid': self.pid,
+            'start': ts,
+            'wall': time.perf_counter()-t0,
+            'cpu': getCPUTime()-cpu0,
+            'peak_rss': mon.peak,
+            'peak_rss_children': getChildrenPeakRSS(),
+        })
+
+    @contextmanager
+    def stage(self, name : str):
+        """Context manager to profile a stage run in the main process."""
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def map(self, pool, func, tasks : list, category : str, labelidx : int = 0) -> list:
+        """Runs func over tasks (with a pool if given, sequentially otherwise) collecting a record per task."""
+        wrapped = ProfiledTask(func, category, labelidx)
+        outputs = pool.map(wrapped, tasks) if pool is not None else [wrapped(t) for t in tasks]
+        self.records += [rec for _, rec in outputs]
+        return [res for res, _ in outputs]
+
+    def imap(self, pool, func, tasks : list, category : str, labelidx : int = 0):
+        """Generator running func over tasks with imap_unordered (sequentially if no pool is given):
+        results are yielded as soon as each task finishes, collecting a record per task."""
+        wrapped = ProfiledTask(func, category, labelidx)
+        outputs = pool.imap_unordered(wrapped, tasks) if pool is not None else map(wrapped, tasks)
+        for res, rec in outputs:
+            self.records.append(rec)
+            yield res
+
+    def add(self, record : dict):
+        """Adds a record returned by a ProfiledTask."""
+        self.records.append(record)
+
+    def toChromeTrace(self) -> dict:
+        """Chrome trace event format (complete events), to be loaded in chrome://tracing or Perfetto."""
+        t0 = min([r['start'] for r in self.records], default=0.)
+        events = []
+        for r in self.records:
+            events.append({
+                'name': r['name'],
+                'cat': r['category'],
+                'ph': 'X',
+                'ts': (r['start']-t0)*1e6,
+                'dur': r['wall']*1e6,
+                'pid': r['pid'],
+                'tid': 0 if r['category']=='stage' else 1,
+                'args': { k: r[k] for k in r if k not in ['name','category','pid','start','wall'] },
+            })
+        return { 'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': { 'job': self.name } }
+
+    def summary(self) -> list:
+        """Summary rows per record, sorted by stage/category and decreasing wall time."""
+        rows = [ { 'category': r['category'], 'name': r['name'], 'pid': r['pid'],
+                   'wall_s': r['wall'], 'cpu_s': r['cpu'], 'peak_rss_mb': r['peak_rss'],
+                   'peak_rss_children_mb': r.get('peak_rss_children', float('nan')) } for r in self.records ]
+        return sorted(rows, key=lambda r: (r['category']!='stage', r['category'], -r['wall_s']))
+
+    def save(self, outdir : str, tag : str = 'profile') -> tuple:
+        """Writes {tag}_trace.json and {tag}_summary.csv in outdir."""
+        os.makedirs(outdir, exist_ok=True)
+        trace_url = f'{outdir}/{tag}_trace.json'
+        with open(trace_url,'w') as fout:
+            json.dump(self.toChromeTrace(), fout)
+        summary_url = f'{outdir}/{tag}_summary.csv'
+        rows = self.summary()
+        with open(summary_url,'w') as fout:
+            fout.write('category,name,pid,wall_s,cpu_s,peak_rss_mb,peak_rss_children_mb\n')
+            for r in rows:
+                fout.write(f"{r['category']},{r['name']},{r['pid']},{r['wall_s']:.3f},{r['cpu_s']:.3f},{r['peak_rss_mb']:.1f},{r['peak_rss_children_mb']:.1f}\n")
+        return trace_url, summary_url
+
+    def printSummary(self):
+        """Prints the stage summary."""
+        for r in self.summary():
+            if r['category']!='stage': continue
+            print(f"[Profile] {r['name']:<24} wall={r['wall_s']:8.1f}s cpu={r['cpu_s']:8.1f}s peak RSS={r['peak_rss_mb']:8.1f}MB (children {r['peak_rss_children_mb']:8.1f}MB)")
+        tasks = [r for r in self.summary() if r['category']!='stage']
+        if len(tasks)>0:
+            worst = max(tasks, key=lambda r: r['peak_rss_mb'])
+            slowest = max(tasks, key=lambda r: r['wall_s'])
+            print(f"[Profile] slowest task: {slowest['category']}/{slowest['name']} ({slowest['wall_s']:.1f}s)")
+            print(f"[Profile] largest task: {worst['category']}/{worst['name']} ({worst['peak_rss_mb']:.1f}MB)")
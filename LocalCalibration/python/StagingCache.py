@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import zlib
+import fcntl
+import shutil
+import hashlib
+import subprocess
+
+# default scratch area used to stage the input files (disabled if empty)
+DEFAULT_STAGING_DIR = os.environ.get('HGCAL_STAGING_DIR', '')
+
+
+def adler32(url : str, blocksize : int = 1<<22) -> str:
+    """Adler32 checksum of a local file as 8 hex digits (same convention as xrootd/EOS)."""
+    value = 1
+    with open(url,'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            value = zlib.adler32(block, value)
+    return f'{value & 0xffffffff:08x}'
+
+
+def remoteChecksum(url : str) -> str:
+    """Adler32 checksum of a file stored on a xrootd server (None if it can't be queried)."""
+    m = re.match(r'(root://[^/]+)/(/.*)', url)
+    if m is None:
+        return None
+    try:
+        out = subprocess.run(['xrdfs', m.group(1), 'query', 'checksum', m.group(2)], capture_output=True, text=True, timeout=120)
+        algo, value = out.stdout.split()[:2]
+        return value.lower().zfill(8) if out.returncode==0 and algo=='adler32' else None
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+def remoteSize(url : str) -> int:
+    """Size of a file stored on a xrootd server (None if it can't be queried)."""
+    m = re.match(r'(root://[^/]+)/(/.*)', url)
+    if m is None:
+        return None
+    try:
+        out = subprocess.run(['xrdfs', m.group(1), 'stat', m.group(2)], capture_output=True, text=True, timeout=120)
+        size = re.search(r'^Size:\s+(\d+)', out.stdout, re.MULTILINE)
+        return int(size.group(1)) if out.returncode==0 and size is not None else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class StagingCache:
+    """
+    Size-bounded (LRU) cache of input files in a local scratch directory.
+    Each staged file has a lock file (held exclusively while copying and shared while in use, so that
+    concurrent workers copy a file only once and never evict a file being read) and a metadata file
+    with its source, size, checksum and last use. Copies are verified against the checksum of the source.
+    """
+
+    def __init__(self, scratch : str, maxsize_gb : float = 100.):
+        self.scratch = os.path.abspath(scratch)
+        self.maxsize = maxsize_gb*1024**3
+        os.makedirs(self.scratch, exist_ok=True)
+
+    def localName(self, url : str) -> str:
+        """Unique local name for a source url."""
+        return f'{self.scratch}/{hashlib.sha1(url.encode()).hexdigest()[:16]}_{os.path.basename(url)}'
+
+    @staticmethod
+    def sourceStat(url : str) -> tuple:
+        """Size and mtime of local sources (remote ones are not stat'ed to avoid a round trip)."""
+        if url.find('root://')==0:
+            return None, None
+        st = os.stat(url)
+        return st.st_size, st.st_mtime
+
+    @staticmethod
+    def sourceSize(url : str) -> int:
+        """Size of the source, queried from the server for remote files (None if unknown)."""
+        if url.find('root://')==0:
+            return remoteSize(url)
+        return os.path.getsize(url)
+
+    def readMeta(self, local : str) -> dict:
+        try:
+            with open(local+'.meta','r') as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return None
+
+    def writeMeta(self, local : str, meta : dict):
+        tmp = f'{local}.meta.{os.getpid()}.tmp'
+        with open(tmp,'w') as fout:
+            json.dump(meta, fout)
+        os.replace(tmp, local+'.meta')
+
+    def isValid(self, url : str, local : str, meta : dict) -> bool:
+        """
+        A staged file is valid if its size matches the metadata and the source did not change: local sources are
+        compared by size and mtime, remote ones by the checksum stored on the server (or by size if it can't be queried).
+        """
+        if meta is None or meta.get('source')!=url or not os.path.isfile(local):
+            return False
+        if os.path.getsize(local)!=meta['size']:
+            return False
+        if url.find('root://')==0:
+            checksum = remoteChecksum(url)
+            if checksum is not None:
+                return checksum==meta.get('adler32')
+            size = remoteSize(url)
+            return size is None or size==meta['size']
+        size, mtime = self.sourceStat(url)
+        return size==meta['size'] and mtime==meta['mtime']
+
+    def copy(self, url : str, local : str) -> dict:
+        """Copies the source to the scratch area (temporary file + rename) and verifies its checksum."""
+        tmp = local+'.part'
+        size, mtime = self.sourceStat(url)
+        if url.find('root://')==0:
+            subprocess.run(['xrdcp', '-f', '-s', url, tmp], check=True)
+            expected = remoteChecksum(url)
+        else:
+            shutil.copyfile(url, tmp)
+            expected = adler32(url)
+        checksum = adler32(tmp)
+        if expected is not None and checksum!=expected:
+            os.remove(tmp)
+            raise IOError(f'Checksum mismatch when staging {url}: {checksum} != {expected}')
+        os.replace(tmp, local)
+        return { 'source':url, 'size':os.path.getsize(local), 'mtime':mtime, 'adler32':checksum, 'lastused':time.time() }
+
+    def stage(self, url : str) -> tuple:
+        """
+        Returns (local path, lock) for a source url, copying it if needed.
+        The shared lock must be kept while the file is read and released with release().
+        The exclusive lock is never waited for, to avoid dead-locks between tasks holding shared locks on other files.
+        """
+        local = self.localName(url)
+        lock = open(local+'.lock','a')
+        while True:
+            
+            # already staged: keep a shared lock so that the file can't be evicted
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            meta = self.readMeta(local)
+            if self.isValid(url, local, meta):
+                meta['lastused'] = time.time()
+                self.writeMeta(local, meta)
+                return local, lock
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            
+            # stage it unless somebody else is doing it (then wait for it and check again)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                time.sleep(1)
+                continue
+            try:
+                meta = self.readMeta(local)
+                if not self.isValid(url, local, meta):
+                    print(f'Staging {url} to {local}')
+                    size = self.sourceSize(url)
+                    if size is None: # fall back on the previous copy, if any
+                        size = meta['size'] if meta else 0
+                    self.evict(reserve = size)
+                    self.writeMeta(local, self.copy(url, local))
+            except BaseException:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+                raise
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        
+    @staticmethod
+    def release(lock):
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def evict(self, reserve : float = 0):
+        """Removes the least recently used files which are not in use until the cache is below its maximum size."""
+        entries = []
+        for name in os.listdir(self.scratch):
+            if not name.endswith('.meta'): continue
+            local = f'{self.scratch}/{name[:-5]}'
+            meta = self.readMeta(local)
+            if meta is None or not os.path.isfile(local): continue
+            entries.append( (meta.get('lastused',0), local, os.path.getsize(local)) )
+        total = sum(e[2] for e in entries) + reserve
+        for _, local, size in sorted(entries):
+            if total<=self.maxsize: break
+            with open(local+'.lock','a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue # in use or being staged
+                for f in [local, local+'.meta']:
+                    if os.path.isfile(f):
+                        os.remove(f)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            total -= size
+            print(f'Evicted {local} from staging cache')
+
+
+class StagedTask:
+    """
+    Picklable wrapper of a histogram filler task (outdir, module, task_spec, cmdargs): the files of the RDataFrame
+    specification are staged in the cache and the filler runs on a copy of the specification pointing to them.
+    Split specifications (spec.json:ix) are supported: the scan point index is passed on with the staged copy.
+    """
+
+    def __init__(self, func, scratch : str, maxsize_gb : float = 100.):
+        self.func = func
+        self.scratch = scratch
+        self.maxsize_gb = maxsize_gb
+
+    def __call__(self, task):
+        outdir, module, task_spec, cmdargs = task
+        cache = StagingCache(self.scratch, self.maxsize_gb)
+        task_spec, ix = task_spec.split(':') if ':' in task_spec else (task_spec, None)
+        with open(task_spec,'r') as fin:
+            spec = json.load(fin)
+
+        # stage starting from a different file in each task so that concurrent tasks copy different files
+        urls = sorted(set(f for sample in spec['samples'].values() for f in sample['files']))
+        if len(urls)>0:
+            first = int(hashlib.sha1(str(module).encode()).hexdigest(),16)%len(urls)
+            urls = urls[first:]+urls[:first]
+        locks, staged = [], {}
+        try:
+            for url in urls:
+                staged[url], lock = cache.stage(url)
+                locks.append(lock)
+            for sample in spec['samples'].values():
+                sample['files'] = [ staged[f] for f in sample['files'] ]
+            # split tasks of the same spec write the same staged copy: write it atomically
+            staged_spec = task_spec.replace('.json','_staged.json')
+            tmp = f'{staged_spec}.{os.getpid()}.tmp'
+            with open(tmp,'w') as fout:
+                json.dump(spec, fout, indent=2)
+            os.replace(tmp, staged_spec)
+            if ix is not None:
+                staged_spec = f'{staged_spec}:{ix}'
+            return self.func( (outdir, module, staged_spec, cmdargs) )
+        finally:
+            for lock in locks:
+                cache.release(lock)
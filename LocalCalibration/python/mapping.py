@@ -1,4 +1,16 @@
 # Author: Izaak Neutelings (April 2025)
+import os
+import numpy as np
+from functools import lru_cache
+
+# cell map with the readout sequence, ROC pin and (u,v) coordinates of the channels of each wafer type
+DEFAULT_CELLMAP = os.path.expandvars("$CMSSW_DATA_PATH/data-Geometry-HGCalMapping/V00-01-00/Geometry/HGCalMapping/data/CellMaps/WaferCellMapTraces.txt")
+
+
+def waferType(typecode : str) -> str:
+    """Wafer type used in the cell map from a module typecode, e.g. ML_F3PT-TX-0003 -> ML-F"""
+    return typecode.replace('_','-')[0:4]
+
 
 def getFEChannelIndex(ich_ros, h_chType, isHD=False):
     """
@@ -16,4 +28,99 @@ def getFEChannelIndex(ich_ros, h_chType, isHD=False):
     if isHD: # swap eRx's
          ich_fe = (36+ich_fe) if ich_fe<36 else (ich_fe-36)
     return ich_fe
-    
+
+
+def getFEChannelIndices(chtypes, isHD=False):
+    """
+    Vectorised version of getFEChannelIndex for all the channels of a module at once:
+    chtypes is the array of channel types in readout sequence (or the chType TH1).
+    Returns the array of FE channel indices (-1 for calibration channels).
+    """
+    if hasattr(chtypes,'GetNbinsX'):
+        chtypes = np.array([chtypes.GetBinContent(i+1) for i in range(chtypes.GetNbinsX())])
+    isch = (np.asarray(chtypes)!=0)
+    nch = len(isch)
+    nrocs = (nch+73)//74
+    perroc = np.zeros(nrocs*74, dtype=np.int32)
+    perroc[:nch] = isch
+    ich_fe = np.cumsum(perroc.reshape(nrocs,74), axis=1).ravel()[:nch] - 1 # count within each ROC
+    if isHD: # swap eRx's
+        ich_fe = np.where(ich_fe<36, ich_fe+36, ich_fe-36)
+    return np.where(isch, ich_fe, -1)
+
+
+class ChannelMap:
+    """
+    Bidirectional lookup arrays of the channels of a wafer type, built once from the cell map.
+    All the arrays are indexed by the channel index in the readout sequence (ROS) and the inverse maps
+    are dense arrays, so that each conversion is a single array indexing operation which accepts arrays:
+      ROS <-> (eRx, seq), ROS <-> (ROC, FE index), ROS <-> (u,v)
+    Channels which are not found are returned as -1.
+    """
+
+    def __init__(self, waftype : str, cellmap : str = DEFAULT_CELLMAP):
+        import pandas as pd
+        df = pd.read_csv(cellmap, sep=' ')
+        df = df[df.Typecode==waftype]
+        if len(df)==0:
+            raise ValueError(f'No cells found for {waftype} in {cellmap}')
+        self.waftype = waftype
+        self.isHD = (waftype[1]=='H')
+
+        ros = ((df.ROC*2 + df.HalfROC)*37 + df.Seq).to_numpy(dtype=np.int32)
+        self.nch = 74*(int(ros.max())//74 + 1)
+        self.nrocs = self.nch//74
+        def dense(values, fill=-1):
+            arr = np.full(self.nch, fill, dtype=np.int32)
+            arr[ros] = values
+            return arr
+        self.erx = np.arange(self.nch, dtype=np.int32)//37
+        self.roc = self.erx//2
+        self.half = self.erx%2
+        self.seq = np.arange(self.nch, dtype=np.int32)%37
+        self.chtype = dense(np.where(df.ROCpin.isin(['CALIB0','CALIB1']), 0, np.where(df.SiCell<0, -1, 1)), fill=0)
+        self.u = dense(df.iu.to_numpy())
+        self.v = dense(df.iv.to_numpy())
+        self.fe = getFEChannelIndices(self.chtype, isHD=self.isHD)
+
+        # inverse maps
+        self.fe2ros = np.full((self.nrocs,72), -1, dtype=np.int32)
+        isfe = self.fe>=0
+        self.fe2ros[self.roc[isfe], self.fe[isfe]] = np.nonzero(isfe)[0]
+        hasuv = (self.chtype==1) & (self.u>=0) & (self.v>=0)
+        self.uv2ros = np.full((self.u.max()+1, self.v.max()+1), -1, dtype=np.int32)
+        self.uv2ros[self.u[hasuv], self.v[hasuv]] = np.nonzero(hasuv)[0]
+
+    def rosIndex(self, erx, seq):
+        """ROS index from the eRx and sequence in the eRx."""
+        return np.asarray(erx)*37 + np.asarray(seq)
+
+    def toFE(self, ros):
+        """(ROC, FE index) of the ROS channels."""
+        ros = np.asarray(ros)
+        return self.roc[ros], self.fe[ros]
+
+    def fromFE(self, roc, fe):
+        """ROS index of the FE channels of a ROC."""
+        return self.fe2ros[np.asarray(roc), np.asarray(fe)]
+
+    def toUV(self, ros):
+        """(u,v) of the ROS channels."""
+        ros = np.asarray(ros)
+        return self.u[ros], self.v[ros]
+
+    def fromUV(self, u, v):
+        """ROS index of the cells at (u,v)."""
+        u, v = np.asarray(u), np.asarray(v)
+        inrange = (u>=0) & (v>=0) & (u<self.uv2ros.shape[0]) & (v<self.uv2ros.shape[1])
+        return np.where(inrange, self.uv2ros[np.clip(u,0,self.uv2ros.shape[0]-1), np.clip(v,0,self.uv2ros.shape[1]-1)], -1)
+
+    def injectedMask(self, injchans):
+        """Mask of the ROS channels which are injected when the FE channels injchans are selected in all the ROCs."""
+        return np.isin(self.fe, np.asarray(injchans)) & (self.fe>=0)
+
+
+@lru_cache(maxsize=None)
+def getChannelMap(typecode : str, cellmap : str = DEFAULT_CELLMAP) -> ChannelMap:
+    """Channel map of the wafer type of a module (or of a wafer type), built once per process."""
+    return ChannelMap(waferType(typecode), cellmap)
@@ -3,14 +3,18 @@ import os
 import sys
 import re
 import itertools
+import fnmatch
 import json
 import gzip
 import pandas as pd
+import numpy as np
 try:
-  from HGCalCommissioning.LocalCalibration.mapping import getFEChannelIndex
+  from HGCalCommissioning.LocalCalibration.mapping import getFEChannelIndices
+  from HGCalCommissioning.LocalCalibration.HelperLibrary import loadHelpers
 except ImportError:
   sys.path.append('./python/')
-  from mapping import getFEChannelIndex
+  from mapping import getFEChannelIndices
+  from HelperLibrary import loadHelpers
 
 
 def defineDigiDataFrameFromSpecs(specs, attachProgressBar=True, ix_filter_cond='ix>=0'):
@@ -20,7 +24,7 @@ def defineDigiDataFrameFromSpecs(specs, attachProgressBar=True, ix_filter_cond='
     """
     
     #start RDataFrame from specifications
-    ROOT.gInterpreter.Declare('#include "interface/helpers.h"')
+    loadHelpers('interface/helpers.h')
     rdf = ROOT.RDF.Experimental.FromSpec(specs)
     if attachProgressBar:
         ROOT.RDF.Experimental.AddProgressBar(rdf)
@@ -60,6 +64,102 @@ def defineDigiDataFrameFromSpecs(specs, attachProgressBar=True, ix_filter_cond='
     return rdf
 
 
+def getClusterStarts(url : str, treename : str = 'Events') -> tuple:
+    """returns the first entry of each cluster of a tree and its number of entries"""
+    fIn = ROOT.TFile.Open(url)
+    tree = fIn.Get(treename)
+    nentries = tree.GetEntries()
+    starts = []
+    it = tree.GetClusterIterator(0)
+    start = it.Next()
+    while start < nentries:
+        starts.append(int(start))
+        start = it.Next()
+    fIn.Close()
+    return starts, int(nentries)
+
+
+def buildShardedSpecs(task_spec : str, nshards : int, outdir : str, cache : dict = None) -> list:
+    """
+    splits the dataset described by a task specification in (up to) nshards global entry ranges
+    the boundaries are aligned to the clusters of the trees so that no basket is decompressed twice
+    the specifications of the shards are written in outdir with a "range" (global entry range for RDataFrame)
+    and an "unsharded" key pointing to the original specification
+    cache is an optional dict to re-use the cluster boundaries of files shared by different tasks
+    """
+    cache = {} if cache is None else cache
+    with open(task_spec) as json_data:
+        spec = json.load(json_data)
+
+    # cluster boundaries in the global entry numbering (samples and files are chained in order)
+    boundaries, offset = [], 0
+    for sample in spec['samples'].values():
+        treename = sample['trees'][0]
+        for f in sample['files']:
+            if (f,treename) not in cache:
+                cache[(f,treename)] = getClusterStarts(f, treename)
+            starts, nentries = cache[(f,treename)]
+            boundaries += [offset+s for s in starts]
+            offset += nentries
+    if offset==0 or nshards<=1:
+        return [task_spec]
+
+    # pick the cluster boundary closest to each equal-size split
+    edges = [0]
+    for i in range(1, nshards):
+        target = offset*i/nshards
+        edge = min(boundaries, key=lambda b: abs(b-target))
+        if edge>edges[-1]:
+            edges.append(edge)
+    edges.append(offset)
+
+    # write a specification per shard
+    os.makedirs(outdir, exist_ok=True)
+    specs = []
+    basename = os.path.basename(task_spec).replace('.json','')
+    for i in range(len(edges)-1):
+        shard_spec = dict(spec, range=[edges[i], edges[i+1]], unsharded=task_spec)
+        shard_url = f'{outdir}/{basename}_shard{i}.json'
+        with open(shard_url,'w') as fout:
+            json.dump(shard_spec, fout, indent=2)
+        specs.append(shard_url)
+    return specs
+
+
+def getUnshardedSpec(task_spec : str) -> str:
+    """returns the original specification if task_spec describes a shard"""
+    with open(task_spec) as json_data:
+        return json.load(json_data).get('unsharded', task_spec)
+
+
+def mergeShardHistograms(rfiles : list, rfile : str, keepfirst : list = ['scaninfo','injChansMap','*_zoffset']) -> str:
+    """
+    merges the histograms filled in different shards: histograms are added,
+    except for those matching the patterns in keepfirst (scan information, maps, window offsets)
+    which are not additive and are taken from the first shard
+    """
+    merged = {}
+    for url in rfiles:
+        fIn = ROOT.TFile.Open(url)
+        for key in fIn.GetListOfKeys():
+            obj = key.ReadObj()
+            name = obj.GetName()
+            if name not in merged:
+                obj.SetDirectory(0)
+                merged[name] = obj
+            elif not any(fnmatch.fnmatchcase(name, patt) for patt in keepfirst):
+                merged[name].Add(obj)
+        fIn.Close()
+    fillHistogramsAndSave(histolist=list(merged.values()), rfile=rfile)
+    return rfile
+
+
+def mergeShardsTask(args):
+    """merges the shards of a module into a file with the same name as the shard files in outdir, the signature is such that it can be dispatched using a pool"""
+    outdir, module, rfiles = args
+    return (module, mergeShardHistograms(rfiles, f'{outdir}/{os.path.basename(rfiles[0])}'))
+
+
 def analyzeSimplePedestal(outdir, module, task_spec, filter_cond : str = ''):
     """
     a base method to fill histograms which are common in most of the runs dedicated to extract baseline constants for the offline and online
@@ -69,7 +169,7 @@ def analyzeSimplePedestal(outdir, module, task_spec, filter_cond : str = ''):
     an alternative would be to use boost histograms and Josh Bendavid's narf
     """
 
-    ROOT.gInterpreter.Declare('#include "interface/helpers.h"')
+    loadHelpers('interface/helpers.h')
 
     #read #pts and #eErx from first task
     with open(task_spec) as json_data:
@@ -78,8 +178,8 @@ def analyzeSimplePedestal(outdir, module, task_spec, filter_cond : str = ''):
     nch = nerx*37
     npts = max(d['metadata']['index'] for s, d in samples.items()) #len(samples)
 
-    #run a mini scan to determine appropriate bounds
-    minirdf = defineDigiDataFrameFromSpecs(task_spec)
+    #run a mini scan to determine appropriate bounds (on the full dataset, so that shards have the same binning)
+    minirdf = defineDigiDataFrameFromSpecs(getUnshardedSpec(task_spec))
     minirdf = minirdf.Range(1000)
     if len(filter_cond)>0:
         minirdf = minirdf.Filter(filter_cond)
@@ -231,13 +331,12 @@ def adcScanHistoFiller(args):
          chTypes  = [h for h in histolist if h.GetName()=="chType"][0] # 0: calib, 1: normal, 2: CM
          isHD     = (nerx==12) # swap e-Rx inside each HGCROC
          injChansMap = ROOT.TH2S('injChansMap', f"Injected channel map;Scan point;Channel", *ptbins, *chbins)
-         chanMap  = [(c,cf) for c in range(nch) if (cf:=getFEChannelIndex(c,chTypes,isHD=isHD))>=0]
+         ich_fe   = getFEChannelIndices(chTypes,isHD=isHD)
          for key, sample in samples.items(): # loop over scan points
              idx = sample['metadata']['index'] # scan point index
              injChans = [int(c) for c in sample['metadata']['InjChans'].split(',')] # RDF FromSpec cannot handle a list
-             for ich, ich_fe in chanMap:
-                 if ich_fe in injChans:
-                     injChansMap.SetBinContent(idx,ich+1,1)
+             for ich in np.nonzero((ich_fe>=0) & np.isin(ich_fe,injChans))[0]:
+                 injChansMap.SetBinContent(idx,int(ich)+1,1)
          histolist.append(injChansMap)
      
      # store
@@ -247,20 +346,29 @@ def adcScanHistoFiller(args):
      return (module,rfile)
 
 
-def energyScanHistoFiller(outdir, module, task_spec, filter_conds: dict, verb: int=0):
+def energyScanHistoFiller(outdir, module, task_spec, filter_conds: dict, verb: int=0, adaptiveBinning: bool=False):
     """
     A base method to fill histograms in a scan (each sub-task in task_spec) is treated as a scan point
     filter_conds is a dict used to define different sub-samples for which the histos will be filled
+    if adaptiveBinning is set, a first pass finds the occupied window of each observable at each scan point
+    and the observable axis of the histograms only spans the widest window: the values are shifted by the offset
+    of the window of their scan point, which is stored in the {name}_zoffset histograms (see getScanOffsets)
+    the first pass is an extra event loop over the full dataset, so adaptive binning is opt-in: it trades I/O for memory
+    adaptive binning is not used for split tasks and shards, as their outputs need to have the same binning to be merged
     """
 
     ix_filt=-1
     if ':' in task_spec:
         task_spec,ix_filt = task_spec.split(':')
+        adaptiveBinning = False
     
     # read #pts and #eErx from first task
     scantype = 'test'
     with open(task_spec) as json_data:
-        samples = json.load(json_data)['samples']
+        spec = json.load(json_data)
+    samples = spec['samples']
+    if 'unsharded' in spec:
+        adaptiveBinning = False
     npts = max(d['metadata']['index'] for s, d in samples.items()) #len(samples)
     nerx = samples['data1']['metadata']['nerx']
     nch = nerx*37
@@ -305,38 +413,219 @@ def energyScanHistoFiller(outdir, module, task_spec, filter_conds: dict, verb: i
         raise IOError(f"Did not recognize scantype={scantype}...")
     
     # prepare RDF
-    ROOT.gInterpreter.Declare('#include "interface/helpers.h"')
+    loadHelpers('interface/helpers.h')
     ix_filter_cond='ix>=0' if ix_filt==-1 else f'ix=={ix_filt}'
     rdf = defineDigiDataFrameFromSpecs(specs=task_spec, attachProgressBar=True, ix_filter_cond=ix_filter_cond)
     
-    # declare histograms (per sample filtered)
+    # declare histograms (per sample filtered): name, title, channel and observable columns, observable binning
     chbins = (nch,-0.5,nch-0.5)    
     bin10b = (1024,-0.5,1023.5) # 10 bits for ADC
     bin12b = (4096,-0.5,4095.5) # 12 bits for TOT
-    graphlist = [ ]
+    histdefs = [
+      ("adc",      "ADC;Scan point;Channel;ADC",   'chadc', 'adc',       bin10b),
+      ("adc_tctp3","ADC;Scan point;Channel;ADC",   'chtot', 'adc_tctp3', bin10b),
+      ("nadc",     "nADC;Scan point;Channel;nADC", 'chadc', 'nchadc',    bin10b),
+      ("tot",      "TOT;Scan point;Channel;TOT",   'chtot', 'tot',       bin12b),
+      ("ntot",     "nTOT;Scan point;Channel;nTOT", 'chtot', 'nchtot',    bin12b),
+      ("toa",      "TOA;Scan point;Channel;TOA",   'chtoa', 'toa',       bin10b),
+      ("ntoa",     "nTOA;Scan point;Channel;nTOA", 'chtoa', 'nchtoa',    bin10b),
+    ]
+    filtered_rdfs = { }
     for tag, filterval in filter_conds.items():
-        filtered_rdf = rdf.Filter(filterval)
         if tag and tag[0]!='_':
           tag = '_'+tag
-        graphlist = [
-          filtered_rdf.Histo3D(("adc"+tag,      "ADC;Scan point;Channel;ADC",   *ptbins, *chbins, *bin10b), 'ix', 'chadc', 'adc'),
-          filtered_rdf.Histo3D(("adc_tctp3"+tag,"ADC;Scan point;Channel;ADC",   *ptbins, *chbins, *bin10b), 'ix', 'chtot', 'adc_tctp3'),
-          filtered_rdf.Histo3D(("nadc"+tag,     "nADC;Scan point;Channel;nADC", *ptbins, *chbins, *bin10b), 'ix', 'chadc', 'nchadc'),
-          filtered_rdf.Histo3D(("tot"+tag,      "TOT;Scan point;Channel;TOT",   *ptbins, *chbins, *bin12b), 'ix', 'chtot', 'tot'),
-          filtered_rdf.Histo3D(("ntot"+tag,     "nTOT;Scan point;Channel;nTOT", *ptbins, *chbins, *bin12b), 'ix', 'chtot', 'nchtot'),
-          filtered_rdf.Histo3D(("toa"+tag,      "TOA;Scan point;Channel;TOA",   *ptbins, *chbins, *bin10b), 'ix', 'chtoa', 'toa'),
-          filtered_rdf.Histo3D(("ntoa"+tag,     "nTOA;Scan point;Channel;nTOA", *ptbins, *chbins, *bin10b), 'ix', 'chtoa', 'nchtoa'),
-        ]
+        filtered_rdfs[tag] = rdf.Filter(filterval)
+    
+    # first pass: occupancy of each observable vs. scan point
+    windows = { }
+    if adaptiveBinning:
+        occupancy = { }
+        for tag, filtered_rdf in filtered_rdfs.items():
+            for hname, htitle, chcol, col, zbins in histdefs:
+                occupancy[hname+tag] = filtered_rdf.Histo2D((f"occ_{hname}{tag}", "", *ptbins, *zbins), 'ix', col)
+        ROOT.RDF.RunGraphs(list(occupancy.values()))
+        for hname, h2 in occupancy.items():
+            offsets, nbins = findScanWindows(h2.GetValue())
+            windows[hname] = (offsets, nbins)
+            ROOT.registerScanWindow(f"{module}_{hname}", ROOT.std.vector['float'](offsets.tolist()))
+        if verb>=1:
+            nbins_dense = sum(len(filter_conds)*zbins[0] for _, _, _, _, zbins in histdefs)
+            nbins_adapt = sum(nbins for _, nbins in windows.values())
+            print(f"energyScanHistoFiller: adaptive binning of {module} uses {nbins_adapt}/{nbins_dense} observable bins")
+    
+    # second pass: fill the histograms
+    graphlist = [ ]
+    offsetlist = [ ]
+    for tag, filtered_rdf in filtered_rdfs.items():
+        for hname, htitle, chcol, col, zbins in histdefs:
+            if hname+tag in windows:
+                offsets, nbins = windows[hname+tag]
+                zbins = (nbins, zbins[1], zbins[1]+nbins*(zbins[2]-zbins[1])/zbins[0])
+                wcol = f"{col}_{hname}{tag}_win"
+                filtered_rdf = filtered_rdf.Define(wcol, f'shiftToWindow({col},scanWindow("{module}_{hname}{tag}"),ix)')
+                col = wcol
+                hoffset = ROOT.TH1F(f"{hname}{tag}_zoffset", f"{htitle.split(';')[-1]} window offset;Scan point;Offset", *ptbins)
+                for ix, offset in enumerate(offsets):
+                    hoffset.SetBinContent(ix+1, offset)
+                offsetlist.append(hoffset)
+            graphlist.append(filtered_rdf.Histo3D((hname+tag, htitle, *ptbins, *chbins, *zbins), 'ix', chcol, col))
     
     # run and save
     ROOT.RDF.RunGraphs(graphlist)
-    histolist = [obj.GetValue() for obj in graphlist] + [scanInfoHist]
+    histolist = [obj.GetValue() for obj in graphlist] + offsetlist + [scanInfoHist]
     postfix='' if ix_filt==-1 else f'_ix{ix_filt}'
     rfile = f'{outdir}/{module}{postfix}.root'
     fillHistogramsAndSave(histolist = histolist, rfile = rfile)    
     return rfile
 
 
+def momentsHistoFiller(outdir, module, task_spec, filter_conds : dict, cmlist : list = ['cm2','cm4','cmall']):
+    """
+    Fills per-channel streaming moment accumulators in a single pass: for each sub-sample defined by filter_conds
+    the number of entries, sums and sums of squares of ADC (BX) and ADC-1 (BX-1), of each common mode estimator
+    and the cross-terms needed for the correlations, are filled as weights of 1D histograms in channel.
+    The memory is constant in the number of events and the histograms can be added (e.g. when merging shards).
+    """
+
+    #read #eErx from first task
+    with open(task_spec) as json_data:
+        samples = json.load(json_data)['samples']
+    nerx = samples['data1']['metadata']['nerx']
+    nch = nerx*37
+    chbinning = (nch,-0.5,nch-0.5)
+
+    #define the terms to accumulate as products of observables (casted to double to avoid overflows)
+    terms = { 'adc':['adc'], 'adcm1':['adcm1'], 'adc_adc':['adc','adc'], 'adcm1_adcm1':['adcm1','adcm1'], 'adc_adcm1':['adc','adcm1'] }
+    for cm in cmlist:
+        terms.update( { cm:[cm], f'{cm}_{cm}':[cm,cm], f'adc_{cm}':['adc',cm] } )
+    rdf = defineDigiDataFrameFromSpecs(task_spec)
+    for term, obs in terms.items():
+        rdf = rdf.Define(f'w_{term}', '*'.join(f'ROOT::VecOps::RVec<double>({x})' for x in obs))
+
+    #book one histogram per term and sub-sample
+    graphlist = []
+    for tag, filterval in filter_conds.items():
+        filtered_rdf = rdf.Filter(filterval)
+        graphlist.append( filtered_rdf.Histo1D((f'n_{tag}', ';Channel;Entries', *chbinning), 'chadc') )
+        for term in terms:
+            graphlist.append( filtered_rdf.Histo1D((f'sum_{term}_{tag}', f';Channel;#Sigma {term}', *chbinning), 'chadc', f'w_{term}') )
+
+    #run and save
+    ROOT.RDF.RunGraphs(graphlist)
+    histolist = [obj.GetValue() for obj in graphlist]
+    rfile = f'{outdir}/{module}.root'
+    fillHistogramsAndSave(histolist = histolist, rfile = rfile)
+    return rfile
+
+
+def profileMoments(url : str, tag : str, cmlist : list = ['cm2','cm4','cmall']) -> dict:
+    """
+    Computes per-channel means, RMS and linear regression of ADC on ADC-1 and the common mode estimators
+    from the moment accumulators filled by momentsHistoFiller for a given sub-sample
+    """
+
+    if not os.path.isfile(url) or not url.endswith('.root'):
+        raise IOError(f'{url} is not a ROOT file')
+
+    fIn = ROOT.TFile.Open(url)
+    def _get(name):
+        h = fIn.Get(name)
+        return np.array([h.GetBinContent(i+1) for i in range(h.GetNbinsX())])
+    n = _get(f'n_{tag}')
+    terms = ['adc','adc_adc'] + [t for x in ['adcm1']+cmlist for t in (x, f'{x}_{x}', f'adc_{x}')]
+    sums = { term : _get(f'sum_{term}_{tag}') for term in terms }
+    fIn.Close()
+
+    return momentsFromSums(n, sums, cmlist)
+
+
+def momentsFromSums(n : np.ndarray, sums : dict, cmlist : list = ['cm2','cm4','cmall']) -> dict:
+    """
+    Computes per-channel means, RMS and linear regression of ADC on ADC-1 and the common mode estimators
+    from the number of entries and the sums of each term (adc, adc_adc, and x, x_x, adc_x for each x in adcm1+cmlist)
+    """
+
+    nsafe = np.where(n>0, n, 1.)
+    mean = lambda term : sums[term]/nsafe
+
+    adc_mean = mean('adc')
+    adc_var = np.clip(mean('adc_adc')-adc_mean**2, 0, None)
+    results = { 'N':n, 'ADC_mean':adc_mean, 'ADC_rms':np.sqrt(adc_var) }
+    for x in ['adcm1']+cmlist:
+        x_mean = mean(x)
+        x_var = np.clip(mean(f'{x}_{x}')-x_mean**2, 0, None)
+        cov = mean(f'adc_{x}') - adc_mean*x_mean
+        isvalid = (n>1) & (x_var>1e-6)
+        slope = np.divide(cov, x_var, out=np.zeros_like(cov), where=isvalid)
+        rho = np.divide(cov, np.sqrt(x_var*adc_var), out=np.zeros_like(cov), where=isvalid & (adc_var>0))
+        results.update( { f'{x}_mean':x_mean, f'{x}_rms':np.sqrt(x_var), f'{x}_slope':slope,
+                          f'{x}_intercept':adc_mean-slope*x_mean, f'{x}_rho':rho } )
+
+    return results
+
+
+def histToArray(h) -> np.ndarray:
+    """bin contents of a TH1/TH2/TH3 (without under/overflows) as an array, indexed as [ybin][xbin] for 2D and [zbin][ybin][xbin] for 3D histograms"""
+    buf = h.GetArray()
+    buf.reshape((h.GetNcells(),))
+    arr = np.array(buf, copy=True, dtype=float)
+    if h.GetDimension()==1:
+        return arr[1:-1]
+    if h.GetDimension()==3:
+        return arr.reshape(h.GetNbinsZ()+2, h.GetNbinsY()+2, h.GetNbinsX()+2)[1:-1,1:-1,1:-1]
+    return arr.reshape(h.GetNbinsY()+2, h.GetNbinsX()+2)[1:-1,1:-1]
+
+
+def profileToArrays(prof) -> tuple:
+    """
+    means and errors (with the error option set in the profile) of all the bins of a TProfile/TProfile2D as arrays (see histToArray)
+    the projections are done in C++ and a few bins are cross-checked against GetBinContent/GetBinError
+    """
+    if prof.GetDimension()==1:
+        means = prof.ProjectionX(prof.GetName()+'_means','E')
+        errors = prof.ProjectionX(prof.GetName()+'_errors','C=E')
+    else:
+        means = prof.ProjectionXY(prof.GetName()+'_means','E')
+        errors = prof.ProjectionXY(prof.GetName()+'_errors','C=E')
+    for ibin in np.linspace(0, prof.GetNcells()-1, 7).astype(int):
+        ibin = int(ibin)
+        if not np.isclose(means.GetBinContent(ibin), prof.GetBinContent(ibin)) or not np.isclose(errors.GetBinContent(ibin), prof.GetBinError(ibin)):
+            raise ValueError(f'Projection of {prof.GetName()} differs from the profile in bin {ibin}')
+    result = (histToArray(means), histToArray(errors))
+    means.Delete()
+    errors.Delete()
+    return result
+
+
+def weightedLinearFit(x, y, yerr, mask=None) -> dict:
+    """
+    Closed-form weighted least squares fit of y = slope*x + offset for many series at once.
+    y, yerr (and the optional mask of points to use) are (series x points) arrays, x is common to all series.
+    The uncertainties are scaled by sqrt(chi2/ndof) as in scipy's curve_fit with relative sigma.
+    A fit is valid if it has more than 2 points and a non-degenerate x distribution.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    yerr = np.asarray(yerr, dtype=float)
+    if mask is None:
+        mask = np.ones(y.shape, dtype=bool)
+    mask = mask & (yerr>0)
+    w = np.where(mask, 1./np.where(mask, yerr, 1.)**2, 0.)
+    S, Sx, Sy = w.sum(axis=1), (w*x).sum(axis=1), (w*y).sum(axis=1)
+    Sxx, Sxy = (w*x*x).sum(axis=1), (w*x*y).sum(axis=1)
+    det = S*Sxx-Sx**2
+    npts = mask.sum(axis=1)
+    valid = (npts>2) & (det>0)
+    safedet = np.where(valid, det, 1.)
+    slope = (S*Sxy-Sx*Sy)/safedet
+    offset = (Sxx*Sy-Sx*Sxy)/safedet
+    chi2 = (np.where(mask, (y-slope[:,None]*x-offset[:,None])/np.where(mask, yerr, 1.), 0.)**2).sum(axis=1)
+    ndof = np.maximum(npts-2, 1)
+    return { 'slope':slope, 'slope_unc':np.sqrt(S/safedet*chi2/ndof),
+             'offset':offset, 'offset_unc':np.sqrt(Sxx/safedet*chi2/ndof),
+             'chi2':chi2, 'ndof':ndof, 'npts':npts, 'valid':valid }
+
+
 def fillHistogramsAndSave(histolist : list, rfile : str):
     """saves list of histograms in ROOT file"""
 
@@ -384,6 +673,28 @@ def profile3DHisto(url, hname):
     return cor_values
     
 
+def findScanWindows(h2) -> tuple:
+    """
+    finds the window of occupied bins of an observable at each scan point from a (scan point x observable) histogram
+    returns the offsets of the windows (in units of the observable) and the number of bins of the widest window
+    """
+    occ = histToArray(h2) # [observable bin][scan point]
+    filled = occ>0
+    anyfilled = filled.any(axis=0)
+    first = np.where(anyfilled, filled.argmax(axis=0), 0)
+    last = np.where(anyfilled, occ.shape[0]-1-filled[::-1].argmax(axis=0), 0)
+    nbins = max(1, int((last-first+1).max()))
+    return first*h2.GetYaxis().GetBinWidth(1), nbins
+
+
+def getScanOffsets(infile, hname : str, npts : int) -> np.ndarray:
+    """offsets of the observable windows per scan point of an adaptively binned scan histogram (zeros if not adaptive)"""
+    hoffset = infile.Get(f"{hname}_zoffset")
+    if not hoffset:
+        return np.zeros(npts)
+    return histToArray(hoffset)
+
+
 def profile3DScanHisto(infname, hnames, storehists=True, adc_cut=180, verb=0):
     """
     This method analyzes a 3D histogram created by energyScanHistoFiller.
@@ -402,6 +713,7 @@ def profile3DScanHisto(infname, hnames, storehists=True, adc_cut=180, verb=0):
         print(f"profile3DScanHisto: WARNING! No histogram {hname!r} found in {infname}...")
       hists3D[hname] = hist3D
     hinfo = infile.Get('scaninfo')
+    zoffsets = { hname: getScanOffsets(infile, hname, hinfo.GetNbinsX()) for hname in hnames }
     
     # prepare output file
     outdname = os.path.dirname(os.path.dirname(infname))
@@ -520,6 +832,7 @@ def profile3DScanHisto(infname, hnames, storehists=True, adc_cut=180, verb=0):
           #create projection
           ztit = hist3D.GetZaxis().GetTitle()
           nz, zmin, zmax = hist3D.GetNbinsZ(), hist3D.GetZaxis().GetXmin(), hist3D.GetZaxis().GetXmax()
+          zmin, zmax = zmin+zoffsets[hname][ix-1], zmax+zoffsets[hname][ix-1] # window of this scan point
           zname  = f"{hname}_scan{ix}_chan{ichan}"
           ztitle = f"Scan {ix}, q_{{#lower[-0.25]{{inj}}}}={inj_q:3.1f}, channel={ichan};{ztit};Events"
           zhist  = ROOT.TH1F(zname,ztitle,nz,zmin,zmax)
@@ -27,13 +27,15 @@ class HGCalCalPulseScan(HGCalCalibration):
                             help="skip fits and use results already stored in the feather files")
         parser.add_argument("--minq_totfit", default=250., type=float,
                             help="minimum charge for TOT fit")
+        parser.add_argument("--adaptiveBinning", action='store_true',
+                            help="book the observables only in their occupied window per scan point (extra pass over the data)")
     
     @staticmethod
     def histofiller(args):
         """Customize the base histo filler from the digi analysis utils."""
         outdir, module, task_spec, cmdargs = args
         filter_conds = { '': "HGCMetaData_trigType==2" }
-        status = DAU.energyScanHistoFiller(outdir, module, task_spec, filter_conds, verb=cmdargs.verbosity)
+        status = DAU.energyScanHistoFiller(outdir, module, task_spec, filter_conds, verb=cmdargs.verbosity, adaptiveBinning=cmdargs.adaptiveBinning)
         return status
     
     @staticmethod
@@ -57,49 +59,49 @@ class HGCalCalPulseScan(HGCalCalibration):
           
         return {'Typecode':typecode,'Fits':fit_results}
     
-    def createCorrectionsFile(self, results):
-        """Final tweaks of the analysis results to export as a json file for CMSSW."""
+    def mergeResult(self, result):
+        """Converts the fits of a module to its per-channel corrections as soon as they are available."""
 
-        correctors={}
         popts = ['adc2fC','adc0','tot2fC','tot0','totlin','a']
-        for r in results:
-
-          typecode = r.pop('Typecode')
-          fit_results = r['Fits']
-          nerx = fit_results['erx'].max()+1
-          avg_module = fit_results[popts].agg(np.average)
+        typecode = result.pop('Typecode')
+        fit_results = result['Fits']
+        nerx = fit_results['erx'].max()+1
+        avg_module = fit_results[popts].agg(np.average)
+        
+        r_corrections = dict( [(p,[]) for p in popts] )
+          
+        #loop over erx
+        for ierx in range(nerx):
+          mask = (fit_results['erx']==ierx)
+          group = fit_results[mask]
           
-          r_corrections = dict( [(p,[]) for p in popts] )
-            
-          #loop over erx
-          for ierx in range(nerx):
-            mask = (fit_results['erx']==ierx)
-            group = fit_results[mask]
-            
-            #start by preparing the average
-            if mask.sum()>0:
-              avg_erx = group[popts].agg(np.average)
+          #start by preparing the average
+          if mask.sum()>0:
+            avg_erx = group[popts].agg(np.average)
+          else:
+            avg_erx = avg_module
+
+          #loop over the channels
+          for ich in range(37):
+            mask_ch = (group['channel']==ich+37*ierx)
+            if mask_ch.sum()==1:
+              row_ch = group[mask_ch][popts].iloc[0]
             else:
-              avg_erx = avg_module
+              row_ch = avg_erx
 
-            #loop over the channels
-            for ich in range(37):
-              mask_ch = (group['channel']==ich+37*ierx)
-              if mask_ch.sum()==1:
-                row_ch = group[mask_ch][popts].iloc[0]
-              else:
-                row_ch = avg_erx
+            #add final channel parameter to the corrections
+            for p in popts:
+              r_corrections[p].append( row_ch[p] )
 
-              #add final channel parameter to the corrections
-              for p in popts:
-                r_corrections[p].append( row_ch[p] )
+        #add to the final list of corrections
+        self.correctors[typecode]=r_corrections
+    
+    def createCorrectionsFile(self, results):
+        """Final tweaks of the analysis results to export as a json file for CMSSW."""
 
-          #add to the final list of corrections
-          correctors[typecode]=r_corrections
-            
         #export final result
         jsonurl = f'{self.cmdargs.output}/config_params_calpulse.json'
-        saveAsJson(jsonurl, correctors)
+        saveAsJson(jsonurl, self.correctors)
 
         #do hexplots if required
         if self.cmdargs.doHexPlots:
@@ -10,13 +10,23 @@ from multiprocessing import Pool
 
 # import common HGCalCommissioning tools
 sys.path.append("./")
-from DigiAnalysisUtils import analyzeSimplePedestal
+from DigiAnalysisUtils import analyzeSimplePedestal, buildShardedSpecs, mergeShardsTask
 from HGCalCalibTaskWrapper import submitWrappedTasks
 try:
   from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+  from HGCalCommissioning.LocalCalibration.Profiler import StageProfiler
+  from HGCalCommissioning.LocalCalibration.Checkpoint import CheckpointedTask, argsHash
+  from HGCalCommissioning.LocalCalibration.FileCatalog import FileCatalog, DEFAULT_CATALOG
+  from HGCalCommissioning.LocalCalibration.StagingCache import StagedTask, DEFAULT_STAGING_DIR
+  from HGCalCommissioning.LocalCalibration.HelperLibrary import loadHelpers
 except ImportError:
   sys.path.append("./python/")
   from JSONEncoder import *
+  from Profiler import StageProfiler
+  from Checkpoint import CheckpointedTask, argsHash
+  from FileCatalog import FileCatalog, DEFAULT_CATALOG
+  from StagingCache import StagedTask, DEFAULT_STAGING_DIR
+  from HelperLibrary import loadHelpers
 
 
 class HGCalCalibration(ABC):
@@ -41,8 +51,18 @@ class HGCalCalibration(ABC):
         self.runtype   = runtype
         self.scanparam = scanparam
         self.jsonurl   = None # final product: string to JSON file
+        self.profiler  = StageProfiler(self.__class__.__name__) # wall/CPU time and peak RSS per stage and task
+        try:
+            self.runAnalysisFlow(raw_args)
+        finally:
+            self.saveProfile()
+        
+    
+    def runAnalysisFlow(self, raw_args=None):
+        """Executes histogram filling, histogram analysis and creation of corrections, profiling each stage."""
         
         # parse arguments and add as class attributes
+        self.profiler.start('parseArguments')
         self.parser = argparse.ArgumentParser(prog=self.__class__.__name__)
         self.parser.add_argument('-i', "--input", nargs='+',
                                  default="/eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/Test/Run1743170957/c7e3e9cc-0cbd-11f0-8349-b8ca3af74182/prompt",
@@ -59,12 +79,22 @@ class HGCalCalibration(ABC):
                                  help="process only these modules (csv list) %(default)s")
         self.parser.add_argument("--task_spec",
                                  help="process a previously created task_spec")
+        self.parser.add_argument("--catalog", default=DEFAULT_CATALOG,
+                                 help="file catalog used to find the NANO files and their modules=%(default)s")
+        self.parser.add_argument("--stagingDir", default=DEFAULT_STAGING_DIR,
+                                 help="local scratch directory where the histogram fillers stage their input files (disabled if empty)=%(default)r")
+        self.parser.add_argument("--stagingSizeGB", type=float, default=100.,
+                                 help="maximum size of the staging area, least recently used files are evicted=%(default)s")
+        self.parser.add_argument("--nShards", type=int, default=1,
+                                 help="split the inputs of each histo filler task in cluster-aligned entry ranges filled in parallel=%(default)s")
         self.parser.add_argument("--maxThreads", type=int, default=8,
                                  help="max threads to use=%(default)s")
         self.parser.add_argument("--forceRewrite", action='store_true',
                                  help="force re-write of previous output=%(default)s")
         self.parser.add_argument("--skipHistoFiller", action='store_true',
                                  help="skip filling of the histograms=%(default)s")
+        self.parser.add_argument("--resume", action='store_true',
+                                 help="re-use checkpointed module results if histograms and options are unchanged=%(default)s")
         self.parser.add_argument("--doControlPlots", action='store_true',
                                  help="enable control plots (if available)")
         self.parser.add_argument("--doHexPlots", action='store_true',
@@ -77,16 +107,19 @@ class HGCalCalibration(ABC):
                                  help="set verbosity level" )
         self.addCommandLineOptions(self.parser)
         self.cmdargs = self.parser.parse_args(raw_args)
+        self.catalog = FileCatalog(self.cmdargs.catalog)
+        self.profiler.stop('parseArguments')
         
         # build the list of runs to analyze
-        scanmap = {}
-        if not self.cmdargs.scanmap is None:
-            with open(self.cmdargs.scanmap,'r') as mapfile:
-                scanmap = json.load(mapfile)
-        else:
-            scanmap['inc'] = { 'idx':0, 'input': [], 'params':{} }
-            for i in self.cmdargs.input:
-                scanmap['inc']['input'] += glob.glob(f'{i}/NANO*.root')
+        with self.profiler.stage('buildScanMap'):
+            scanmap = {}
+            if not self.cmdargs.scanmap is None:
+                with open(self.cmdargs.scanmap,'r') as mapfile:
+                    scanmap = json.load(mapfile)
+            else:
+                scanmap['inc'] = { 'idx':0, 'input': [], 'params':{} }
+                for i in self.cmdargs.input:
+                    scanmap['inc']['input'] += self.catalog.glob(f'{i}/NANO*.root')
         
         # histogram filling
         calibresults = []
@@ -98,19 +131,27 @@ class HGCalCalibration(ABC):
                 self.histofiller = analyzeSimplePedestal
             
             # prepare the jobs (run info#modules, sub-samples, etc.)
-            self.prepareHistogramFiller(scanmap)
+            with self.profiler.stage('prepareHistogramFiller'):
+                self.prepareHistogramFiller(scanmap)
 
             if self.cmdargs.createHistoFillerTask:
                 submitWrappedTasks(tasks=self.histofill_tasks, classname=type(self).__name__, dryRun=self.cmdargs.nosub)
                 return
                         
-            # launch tasks and fill rootfiles
-            if self.cmdargs.maxThreads<=1: # sequential
-                for task in self.histofill_tasks:
-                  calibresults.append(self.histofiller(task))
-            else: # multiprocess
-                with Pool(self.cmdargs.maxThreads) as p:
-                    calibresults = p.map(self.histofiller, self.histofill_tasks)
+            # load (building it once if needed) the compiled helpers before forking so that the workers don't JIT them
+            with self.profiler.stage('loadHelpers'):
+                loadHelpers('interface/helpers.h')
+
+            # launch tasks and fill rootfiles (reading the inputs from the local staging area if enabled)
+            histofiller = self.histofiller
+            if self.cmdargs.stagingDir:
+                histofiller = StagedTask(self.histofiller, self.cmdargs.stagingDir, self.cmdargs.stagingSizeGB)
+            with self.profiler.stage('histofiller'):
+                if self.cmdargs.maxThreads<=1: # sequential
+                    calibresults = self.fillHistograms(histofiller, None)
+                else: # multiprocess
+                    with Pool(self.cmdargs.maxThreads) as p:
+                        calibresults = self.fillHistograms(histofiller, p)
             print(f'Histo filling produced the following results {calibresults}')
         else:
             for url in glob.glob(f'{self.cmdargs.output}/histofiller/*.root'):
@@ -129,14 +170,73 @@ class HGCalCalibration(ABC):
         tasklist = [ (typecode, url, self.cmdargs) for (typecode,url) in calibresults ]
         if len(self.cmdargs.moduleList)>0: # filter again
             tasklist = [ x for x in tasklist if x[0] in self.cmdargs.moduleList]
-        with Pool(self.cmdargs.maxThreads) as p:
-            results = p.map(self.analyze, tasklist)            
+        # each module result is checkpointed as soon as it is done, in resume mode unchanged modules are not re-analyzed
+        # workers store plots and bulky objects themselves so only compact records are merged here, as they arrive
+        self.results, self.correctors, failed = [], { }, { }
+        with self.profiler.stage('analyze'):
+            analyzer = CheckpointedTask(self.analyze, f'{self.cmdargs.output}/checkpoints', argsHash(self.cmdargs), resume=self.cmdargs.resume)
+            with Pool(self.cmdargs.maxThreads) as p:
+                for typecode, result, err in self.profiler.imap(p, analyzer, tasklist, 'analyze', labelidx=0):
+                    if err is not None:
+                        failed[typecode] = err
+                        continue
+                    self.mergeResult(result)
+        if len(failed)>0:
+            for typecode, err in failed.items():
+                print(f'ERROR! {typecode} : {err}')
+            raise RuntimeError(f'Analysis failed for {len(failed)}/{len(tasklist)} modules, fix and re-run with --skipHistoFiller --resume')
         
         # create the corrections based on the analysis results
-        self.jsonurl = self.createCorrectionsFile(results)
+        with self.profiler.stage('createCorrectionsFile'):
+            self.jsonurl = self.createCorrectionsFile(self.results)
         print(f'Corrections stored in {self.jsonurl}')
         
     
+    def fillHistograms(self, histofiller, pool=None) -> list:
+        """
+        Runs the histogram filler tasks. If --nShards>1 each task is split in cluster-aligned entry ranges:
+        the partial histograms of all shards are filled in parallel and then merged per module.
+        """
+        if self.cmdargs.nShards<=1:
+            return self.profiler.map(pool, histofiller, self.histofill_tasks, 'histofiller', labelidx=1)
+
+        # split the tasks (those already restricted to a scan point are run as they are)
+        shard_tasks, shard_keys, tasks = [], [], []
+        cluster_cache = {}
+        for outdir, module, task_spec, cmdargs in self.histofill_tasks:
+            if ':' in task_spec:
+                tasks.append( (outdir, module, task_spec, cmdargs) )
+                continue
+            for i, shard_spec in enumerate(buildShardedSpecs(task_spec, self.cmdargs.nShards, f'{outdir}/shards', cache=cluster_cache)):
+                shard_outdir = f'{outdir}/shards/shard{i}'
+                os.makedirs(shard_outdir, exist_ok=True)
+                shard_tasks.append( (shard_outdir, module, shard_spec, cmdargs) )
+                shard_keys.append( (outdir, module) )
+        print(f'Split {len(self.histofill_tasks)-len(tasks)} histo filler tasks in {len(shard_tasks)} shards')
+
+        # fill the shards and merge the files they report (fillers return either the file or (module, file))
+        results = self.profiler.map(pool, histofiller, tasks, 'histofiller', labelidx=1)
+        shard_results = self.profiler.map(pool, histofiller, shard_tasks, 'histofiller', labelidx=2)
+        rfiles = {}
+        for key, res in zip(shard_keys, shard_results):
+            rfile = res[1] if isinstance(res, (tuple,list)) else res
+            if rfile is None or not os.path.isfile(rfile):
+                raise IOError(f'Histo filler of shard {len(rfiles.get(key,[]))} of {key[1]} did not produce a file : {res}')
+            rfiles.setdefault(key, []).append(rfile)
+        merge_tasks = [ (outdir, module, urls) for (outdir, module), urls in rfiles.items() ]
+        results += self.profiler.map(pool, mergeShardsTask, merge_tasks, 'mergeShards', labelidx=1)
+        return results
+        
+    
+    def saveProfile(self):
+        """Stores the profiling of the stages and tasks as a Chrome trace and a summary table in the output directory."""
+        if not hasattr(self, 'cmdargs') or not os.path.isdir(self.cmdargs.output):
+            return
+        self.profiler.printSummary()
+        trace_url, summary_url = self.profiler.save(f'{self.cmdargs.output}/profile')
+        print(f'Profiling trace stored in {trace_url} and summary in {summary_url}')
+        
+    
     @abstractmethod
     def addCommandLineOptions(self, parser : argparse.ArgumentParser):
         pass
@@ -153,6 +253,13 @@ class HGCalCalibration(ABC):
         pass
         
     
+    def mergeResult(self, result):
+        """Called in the main process as soon as the analysis of a module is available (in completion order).
+        By default results are kept for createCorrectionsFile. Derived classes can instead merge each result into
+        the per-module correctors in self.correctors as it arrives, so that only the compact correctors are kept in memory."""
+        self.results.append(result)
+        
+    
     def prepareHistogramFiller(self, scanmap : dict):
         """
         Steers preparation of the analysis for a run
@@ -263,32 +370,14 @@ class HGCalCalibration(ABC):
         
     
     def getModulesFromRun(self, f : str) -> dict:
-        """Reads the run tree and builds a dict of {typecode: (fedId,Seq), ...}."""
+        """Builds a dict of {typecode: (fedId,Seq,nErx), ...} from the file catalog (the file is only read the first time)."""
 
-        modules_dict = {}
-        runs = ROOT.RDataFrame("Runs",f).AsNumpy()
-        for k,v in runs.items():
+        modules_dict = self.catalog.getModules(f)
 
-            # select typecode branches
-            if k.find('HGCTypeCodes')!=0 : continue
-            module_typecode = k.replace('HGCTypeCodes_','')
+        # skip the modules which are not required
+        if len(self.cmdargs.moduleList)>0:
+            modules_dict = { k: v for k, v in modules_dict.items() if k in self.cmdargs.moduleList }
 
-            # skip if the module is not required
-            if len(self.cmdargs.moduleList)>0 and not module_typecode in self.cmdargs.moduleList:
-                continue
-                        
-            # save the required information
-            module_idx = v[0][0]
-            module_fed = runs['HGCReadout_FED'][0][module_idx]
-            module_seq = runs['HGCReadout_Seq'][0][module_idx]
-            if 'HGCReadout_nErx' in runs:
-                module_nerx = runs['HGCReadout_nErx'][0][module_idx]
-            else:
-                # remove once all NANO has this
-                print(f'Using default nErx for {module_typecode}') 
-                module_nerx =  6
-            modules_dict[module_typecode] = (module_fed,module_seq,module_nerx)
-             
         return modules_dict
         
     
@@ -3,6 +3,8 @@ import argparse
 import json
 import glob
 import importlib
+import multiprocessing as mp
+from multiprocessing.connection import wait
 import pandas as pd
 
 # import common HGCalCommissioning tools
@@ -10,9 +12,11 @@ sys.path.extend(["./","./python/HGCROCconfig/"])
 from HGCROCInterface import DPGjsonToROCYaml
 try:
   from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+  from HGCalCommissioning.LocalCalibration.FileCatalog import FileCatalog, DEFAULT_CATALOG
 except ImportError:
   sys.path.append('./python/')
   from JSONEncoder import *
+  from FileCatalog import FileCatalog, DEFAULT_CATALOG
 
 # dictionary between run type and HGCalCalibration class
 calibclass_dict = {
@@ -23,6 +27,14 @@ calibclass_dict = {
   'vref_noinv_scan': 'VRefScan',
 }
 
+# order in which calibrations depend on each other: pedestal -> trim_inv -> vref
+calibstage_dict = {
+  'pedestal':        0,
+  'trim_inv_scan':   1,
+  'vref_inv_scan':   2,
+  'vref_noinv_scan': 2,
+}
+
 class HGCalCalibrationManager:
     
     def __init__(self):
@@ -36,53 +48,182 @@ class HGCalCalibrationManager:
                             help='output directory')
         parser.add_argument('-r', "--reference", default="0000010151",
                             help="reference/relay number")
+        parser.add_argument("--references", nargs='+', default=[],
+                            help="batch mode: list of reference/relay numbers")
+        parser.add_argument("--runs", nargs='+', default=[],
+                            help="batch mode: runs or run ranges (e.g. 1700-1750 1802) whose references are processed")
+        parser.add_argument("--maxCores", type=int, default=os.cpu_count(),
+                            help="batch mode: global number of cores shared by the concurrent calibrations=%(default)r")
+        parser.add_argument("--threadsPerJob", type=int, default=8,
+                            help="batch mode: threads given to each calibration (--maxThreads)=%(default)r")
+        parser.add_argument("--catalog", default=DEFAULT_CATALOG,
+                            help="file catalog used to find job reports and NANO files=%(default)r")
         parser.add_argument('-p', "--modargs", default="",
                             help="command line arguments to pass to calibration module, e.g. -p='--skipHistoFiller'")
         cmdargs = parser.parse_args()
         print(cmdargs)
+        self.cmdargs = cmdargs
+        self.catalog = FileCatalog(cmdargs.catalog)
         
-        # open run registry
+        # open run registry (only once, also in batch mode)
         if not os.path.isfile(cmdargs.input):
           print(f'[Warning] {cmdargs.input} is not a valid registry file')
           return
         df = pd.read_feather(cmdargs.input)
         
+        # batch mode: resolve all references, then run them following the dependency graph
+        if len(cmdargs.references)>0 or len(cmdargs.runs)>0:
+            jobs = [ ]
+            for reference in self.selectReferences(df, cmdargs.references, cmdargs.runs):
+                job = self.prepareReference(df[df['Reference']==reference], reference)
+                if job is not None:
+                    jobs.append(job)
+            self.buildDependencyGraph(jobs)
+            self.runBatch(jobs, maxCores=cmdargs.maxCores, threadsPerJob=cmdargs.threadsPerJob)
+            return
+        
         # select entries that match reference
-        df = df[df['Reference']==cmdargs.reference]
+        job = self.prepareReference(df[df['Reference']==cmdargs.reference], cmdargs.reference)
+        if job is None:
+            return
+        self.jsonurl = self.runCalibration(job, cmdargs.modargs.split(' ') if cmdargs.modargs else [])
+
+
+    def prepareReference(self, df : pd.DataFrame, reference : str):
+        """
+        Builds the scan map of a reference (assumes df is already filtered for it) and stores it in the output directory.
+        Returns a job dict { reference, runtype, calibclass, outputdir, scanmap, runs } or None if it can't be processed.
+        """
         
         # get the status and the dictionary defining the job
         scan_status, scan_map = self.getScanInputs(df)
         if not scan_status:
-            print(f'[WARNING] Run type {cmdargs.reference} seems not complete, skipping it!')
-            return
+            print(f'[WARNING] Run type {reference} seems not complete, skipping it!')
+            return None
         
         # extract the calibration type and load module that handles it
         runtype = df['Type'].iloc[-1]
-        calibclass = calibclass_dict[runtype]
+        calibclass = calibclass_dict.get(runtype)
         if not calibclass:
             print(f'[WARNING] Run type {runtype} is not supported by HGCalCalibrationManager, skipping it!')
-            return
+            return None
         
         # prepare scan map
-        outputdir = f'{cmdargs.output}/{runtype}/Relay{cmdargs.reference}'
+        outputdir = f'{self.cmdargs.output}/{runtype}/Relay{reference}'
         os.makedirs(outputdir, exist_ok=True)
         print(f'Output directory is now {outputdir}')
         scan_map_json = f'{outputdir}/scan_map.json'
         saveAsJson(scan_map_json,scan_map)
+        print(f'Scan map defined @ {scan_map_json}')
+        
+        return { 'reference':reference, 'runtype':runtype, 'calibclass':calibclass, 'outputdir':outputdir,
+                 'scanmap':scan_map_json, 'runs':sorted(int(r) for r in scan_map.keys()), 'catalog':self.cmdargs.catalog }
+
+
+    @staticmethod
+    def runCalibration(job : dict, modargs : list = []) -> str:
+        """Runs the calibration module of a job and converts the resulting JSON to the ROC YAML configuration."""
 
         # call calibration module
-        print(f'Scan map defined @ {scan_map_json}')
-        calib_module_args = ['--scanmap',scan_map_json,'-o',outputdir,'--forceRewrite']
-        if cmdargs.modargs:
-            calib_module_args += cmdargs.modargs.split(' ')
-        calib_module_name = f'HGCal{calibclass}'
+        calib_module_args = ['--scanmap',job['scanmap'],'-o',job['outputdir'],'--forceRewrite','--catalog',job['catalog']] + modargs
+        calib_module_name = f'HGCal{job["calibclass"]}'
         calib_module = importlib.import_module(calib_module_name)
         print(f'Launching {calib_module_name} with cmdargs={calib_module_args}')
-        calib_impl = getattr(calib_module,calib_module_name)(calib_module_args,runtype=runtype) # run
+        calib_impl = getattr(calib_module,calib_module_name)(calib_module_args,runtype=job['runtype']) # run
 
         # convert JSON from calib_impl.jsonurl to YAML
         waferCellMap = os.path.expandvars("$CMSSW_DATA_PATH/data-Geometry-HGCalMapping/V00-01-00/Geometry/HGCalMapping/data/CellMaps/WaferCellMapTraces.txt")
-        DPGjsonToROCYaml(CalibJson=calib_impl.jsonurl, ChannelMapFile=waferCellMap, ParamMapFile=f'data/{calib_module_name}.json', OutPath=outputdir)
+        DPGjsonToROCYaml(CalibJson=calib_impl.jsonurl, ChannelMapFile=waferCellMap, ParamMapFile=f'data/{calib_module_name}.json', OutPath=job['outputdir'])
+        return calib_impl.jsonurl
+
+
+    @staticmethod
+    def selectReferences(df : pd.DataFrame, references : list, runs : list) -> list:
+        """Returns the references given explicitly or containing any of the runs/run ranges (e.g. '1700-1750'), ordered by first run."""
+        selected = set(str(r) for r in references)
+        runlist = set()
+        for token in ','.join(runs).split(','):
+            if not token: continue
+            if '-' in token:
+                first, last = token.split('-')
+                runlist.update(range(int(first),int(last)+1))
+            else:
+                runlist.add(int(token))
+        if len(runlist)>0:
+            selected.update( df[df['Run'].astype(int).isin(runlist)]['Reference'].unique() )
+        firstrun = df[df['Reference'].isin(selected)].groupby('Reference')['Run'].min().to_dict()
+        missing = selected - set(firstrun.keys())
+        if len(missing)>0:
+            print(f'[WARNING] References {sorted(missing)} are not in the registry, skipping them!')
+        return sorted(firstrun.keys(), key=lambda r: int(firstrun[r]))
+
+
+    @staticmethod
+    def buildDependencyGraph(jobs : list):
+        """
+        Each job depends on the last job of the closest previous calibration stage (pedestal -> trim_inv -> vref)
+        taken before it. Jobs in the same stage are independent of each other.
+        The references each job depends on are stored in job['deps'].
+        """
+        for job in jobs:
+            job['deps'] = []
+            stage = calibstage_dict[job['runtype']]
+            for prevstage in range(stage-1,-1,-1):
+                previous = [ j for j in jobs if calibstage_dict[j['runtype']]==prevstage and j['runs'][0]<job['runs'][0] ]
+                if len(previous)==0: continue
+                job['deps'].append( max(previous, key=lambda j: j['runs'][0])['reference'] )
+                break
+            print(f"{job['runtype']:>16} Relay{job['reference']} runs {job['runs'][0]}-{job['runs'][-1]} depends on {job['deps']}")
+
+
+    def runBatch(self, jobs : list, maxCores : int, threadsPerJob : int) -> dict:
+        """
+        Runs each job in a separate process as soon as its dependencies are done, keeping the
+        total number of threads of the running calibrations within maxCores. Dependents of failed jobs are skipped.
+        A summary is stored in {output}/batch_summary.json.
+        """
+        modargs = self.cmdargs.modargs.split(' ') if self.cmdargs.modargs else []
+        if not '--maxThreads' in modargs:
+            modargs += ['--maxThreads', str(min(threadsPerJob,maxCores))]
+        ncores = int(modargs[modargs.index('--maxThreads')+1])
+
+        status  = { job['reference'] : 'pending' for job in jobs }
+        pending = list(jobs)
+        running = { } # process sentinel : (job, process)
+        while len(pending)>0 or len(running)>0:
+            
+            # skip jobs whose dependencies failed, launch those whose dependencies are done within the core budget
+            for job in list(pending):
+                depstatus = [ status[d] for d in job['deps'] ]
+                if any(s in ['failed','skipped'] for s in depstatus):
+                    print(f"[WARNING] Skipping Relay{job['reference']}: dependencies {job['deps']} did not succeed")
+                    status[job['reference']] = 'skipped'
+                    pending.remove(job)
+                elif all(s=='done' for s in depstatus) and (len(running)==0 or (len(running)+1)*ncores<=maxCores):
+                    proc = mp.Process(target=HGCalCalibrationManager.runCalibration, args=(job,modargs), name=f"Relay{job['reference']}")
+                    proc.start()
+                    print(f"Started {job['runtype']} Relay{job['reference']} (pid={proc.pid}), {len(running)+1} running")
+                    status[job['reference']] = 'running'
+                    running[proc.sentinel] = (job, proc)
+                    pending.remove(job)
+            if len(running)==0:
+                continue
+            
+            # wait for any of the running jobs to finish
+            for sentinel in wait(list(running.keys())):
+                job, proc = running.pop(sentinel)
+                proc.join()
+                status[job['reference']] = 'done' if proc.exitcode==0 else 'failed'
+                print(f"Finished {job['runtype']} Relay{job['reference']} with status {status[job['reference']]} (exit code {proc.exitcode})")
+
+        # summarize
+        summary = { job['reference'] : { 'runtype':job['runtype'], 'runs':job['runs'], 'deps':job['deps'],
+                                         'outputdir':job['outputdir'], 'status':status[job['reference']] } for job in jobs }
+        os.makedirs(self.cmdargs.output, exist_ok=True)
+        saveAsJson(f'{self.cmdargs.output}/batch_summary.json', summary)
+        for reference, entry in summary.items():
+            print(f"{entry['runtype']:>16} Relay{reference} : {entry['status']}")
+        return summary
 
 
     def parseScanPointInfo(self, runtype : str, scan_point : dict):
@@ -132,7 +273,7 @@ class HGCalCalibrationManager:
               if mask.sum()==0: continue
               nanodir = group['Output'].iloc[-1]
 
-            alljobreports = glob.glob(f'{nanodir}/reports/job*{run}*.json')
+            alljobreports = self.catalog.glob(f'{nanodir}/reports/job*{run}*.json')
             if len(alljobreports)==0: continue
             jobreport = alljobreports[0]
             
@@ -147,7 +288,7 @@ class HGCalCalibrationManager:
             
             scan_inputs[str(run)] = {
                 'idx' : scan_idx,
-                'input' : glob.glob(f'{nanodir}/NANO*{run}*.root'),
+                'input' : self.catalog.glob(f'{nanodir}/NANO*{run}*.root'),
                 'params' : self.parseScanPointInfo(runtype,scan_point_dict)
             }
         
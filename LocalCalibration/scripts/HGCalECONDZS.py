@@ -1,3 +1,4 @@
+import os
 import sys
 import argparse
 import json
@@ -29,129 +30,205 @@ def fillECONDconfig(path_to_config : str, CE : float, mip_sf : float, mip_sf_m1
     * kappa_corr: per channel                                                                                                                                                                                                                                                                                                                                                       
     * betam1_corr: per channel
     """
-    #the configuration registry map
-    config_regmap = {}
+    return registersToDict( buildECONDRegisters(path_to_config, CE, mip_sf, mip_sf_m1, onlyPedestals=onlyPedestals,
+                                                P_CM_correction=P_CM_correction, P_CM_BXm1_correction=P_CM_BXm1_correction,
+                                                factor=factor) )
+
+
+#global registers, registers per eRx and per channel (block, field) of the ZS processor
+GLOBAL_REGISTERS = ['ZSCommon_Global_zs_ce', 'ELinkProcessors_Global_cm_erx_route_00', 'ELinkProcessors_Global_cm_erx_route_01']
+ERX_REGISTERS = ['ELinkProcessors_Global_cm_selection_x_{erx:02d}']
+CHANNEL_REGISTERS = [('ZS','zs_lambda'), ('ZS','zs_kappa'), ('ZS','zs_c_i'), ('ZSmOne','zs_c_i_m'), ('ZSmOne','zs_beta_m'),
+                     ('ZS','zs_mask_i'), ('ZSmOne','zs_mask_i')]
+MASK_REGISTERS = 2 # the last channel registers are the masks, only written on demand
+MAX_ERX = 12
+NCH_ERX = 37
+
+
+def registerNames(maxErx : int = MAX_ERX, globalRegs : list = GLOBAL_REGISTERS, erxRegs : list = ERX_REGISTERS, channelRegs : list = CHANNEL_REGISTERS) -> np.ndarray:
+    """
+    Table of the names of the ZS registers: the index in this table is used as the register address in the register images.
+    The table is ordered as globals, then for each eRx its CM selection followed by the registers of its channels.
+    """
+    names = list(globalRegs)
+    for erx in range(maxErx):
+        names += [r.format(erx=erx) for r in erxRegs]
+        names += [f'{block}_{erx:02d}_{field}_{ch:02d}' for ch in range(NCH_ERX) for block, field in channelRegs]
+    return np.array(names)
+
+
+def registerAddress(erx, ch=None, ireg : int = 0):
+    """Address (index in the register names table) of an eRx register or, if ch is given, of a channel register."""
+    erx = np.asarray(erx)
+    base = len(GLOBAL_REGISTERS) + erx*(len(ERX_REGISTERS)+NCH_ERX*len(CHANNEL_REGISTERS))
+    if ch is None:
+        return base + ireg
+    return base + len(ERX_REGISTERS) + np.asarray(ch)*len(CHANNEL_REGISTERS) + ireg
+
+
+def digitizeVals(a_vals, dyn_range, nbits):
+    """digitize the floating point numbers, see Tables 23 and 24 of the ECON-D specification document"""
+    max_digi = 2**nbits-1
+    lsb = dyn_range / max_digi
+    return np.clip(np.asarray(a_vals)/lsb, a_min=0, a_max=max_digi).astype(np.int64)
+
+
+def buildECONDRegisters(path_to_config : str, CE : float, mip_sf : float, mip_sf_m1 : float, onlyPedestals : bool = False, P_CM_correction : bool = False, P_CM_BXm1_correction : bool = False , factor : int = 1, maskInvalid : bool = False) -> dict:
+    """
+    Same as fillECONDconfig but the registers of all the channels of a module are computed at once with arrays.
+    Returns the register image as {'names': register names table, 'modules': {typecode: (addresses, values)}}
+    where the addresses are indices in the names table (see registerNames).
+    If maskInvalid is set, the channels which are not valid in the calibration are masked in both ZS processors.
+    """
     #read the pedestals json and iterate over modules
     input_json = json.loads('{"ped":"'+path_to_config+'"}')
     config = buildLevel0CalibParams(input_json)
 
+    modules = {}
+    maxErx = MAX_ERX
     for typecode_key, c_dict in config.items():
         # read offline calibration constants
         P_i = np.array(c_dict["ADC_ped"])
         P_cm = np.array(c_dict[f"CM_ped"])
+        mip_scale = np.array(c_dict["MIPS_scale"])
+        noise = np.array(c_dict["Noise"])
+        nch = len(P_i)
 
         #if only pedestals+noise
         if onlyPedestals:
-           beta_corr = np.zeros(len(c_dict[f"CM_slope"])) #beta = 0
-           kappa_corr = np.zeros(len(c_dict["BXm1_slope"])) #kappa = 0
-           noise = np.array(c_dict["Noise"])
-
+           beta_corr = np.zeros(nch) #beta = 0
+           kappa_corr = np.zeros(nch) #kappa = 0
            T = factor * noise
         elif P_CM_correction:
-           beta_corr = np.array(c_dict[f"CM_slope"]) 
-           kappa_corr = np.zeros(len(c_dict["BXm1_slope"])) #kappa = 0
-           noise = np.array(c_dict["Noise"])
-
-           T = np.array(c_dict["MIPS_scale"]) * mip_sf + factor * noise
+           beta_corr = np.array(c_dict[f"CM_slope"])
+           kappa_corr = np.zeros(nch) #kappa = 0
+           T = mip_scale * mip_sf + factor * noise
         elif P_CM_BXm1_correction:
-           beta_corr = np.ones(len(c_dict[f"CM_slope"])) #beta = 1
-           kappa_corr = factor * np.ones(len(c_dict["BXm1_slope"])) #kappa = scan
-           noise = np.array(c_dict["Noise"])
-           T = np.ones(len(np.array(c_dict["MIPS_scale"])))
+           beta_corr = np.ones(nch) #beta = 1
+           kappa_corr = factor * np.ones(nch) #kappa = scan
+           T = np.ones(nch)
         else:
            kappa_corr = np.array(c_dict["BXm1_slope"])
            beta_corr = np.array(c_dict[f"CM_slope"])
-           T = np.array(c_dict["MIPS_scale"]) * mip_sf
+           T = mip_scale * mip_sf
 
         #convert to ECOND ZS parameters
         lamb = beta_corr * (1 - kappa_corr)
         C_i = T + (1 - kappa_corr) * P_i + lamb * P_cm
+        betam1_corr = beta_corr
         if onlyPedestals: #set to 0
-           Tm1 = np.zeros(len(c_dict["MIPS_scale"]))
-           betam1_corr = beta_corr.copy()
-           Cm1_i = np.zeros(len( P_i))
+           Cm1_i = np.zeros(nch)
         else:
-           Tm1 = np.array(c_dict["MIPS_scale"]) * mip_sf_m1 / 8. # threshold in steps of 1/8
-           betam1_corr = beta_corr.copy()
+           Tm1 = mip_scale * mip_sf_m1 / 8. # threshold in steps of 1/8
            Cm1_i = Tm1 + P_i + beta_corr * P_cm
 
-        #digitize the floating point numbers
-        #see Tables 23 and 24 of the ECON-D specification document
-        def _digitizeVals(a_vals,dyn_range, nbits):
-            max_digi = 2**nbits-1
-            lsb = dyn_range / max_digi
-            #to list is used to force native python int
-            digivals = np.clip(a_vals/lsb, a_min=0, a_max=max_digi).astype(int).tolist()
-            return digivals
-        CE_int = _digitizeVals(CE, 1023, 10)
-        lamb_int = _digitizeVals(lamb, 3.96875, 7)
-        kappa_corr_int = _digitizeVals(kappa_corr, 1.96875, 6)
-        C_i_int = _digitizeVals(C_i, 255, 8)
-        Cm1_i_int = _digitizeVals(Cm1_i,120, 4)
-        betam1_corr_int = _digitizeVals(betam1_corr, 3.96875, 7 ) 
-
-        #build the register map
-        c_regmap = {'ZSCommon_Global_zs_ce' : CE_int}
-        
+        #per channel registers (same order as CHANNEL_REGISTERS), masks are set for invalid channels
+        masked = (np.array(c_dict["Valid"])==0).astype(np.int64)
+        chvals = np.stack([ digitizeVals(lamb, 3.96875, 7),
+                            digitizeVals(kappa_corr, 1.96875, 6),
+                            digitizeVals(C_i, 255, 8),
+                            digitizeVals(Cm1_i, 120, 4),
+                            digitizeVals(betam1_corr, 3.96875, 7),
+                            masked, masked ], axis=1)
+        nreg = len(CHANNEL_REGISTERS) - (0 if maskInvalid else MASK_REGISTERS)
+
         if "MH" in typecode_key:
             cmtype = "4"
         elif "ML" in typecode_key:
             cmtype = "2"
- 
+        else:
+            cmtype = None
+
         #default routing of eRx's into CM processor
         route_erx = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
         if cmtype == '2':
             #for CM2, change selection so that eRx 0 and 1 use CM_ROC0, etc
             #WARNING: CM2 will not work for neRx>6
             route_erx = [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
-        #convert routing array into register
+        #convert routing array into register: 32 bits LSB in 00, 16 bits MSB in 01
         route_value = int(sum([(r << (4*j)) for j, r in enumerate(route_erx[::-1])]))
-        # 32 bits LSB in 00
-        c_regmap["ELinkProcessors_Global_cm_erx_route_00"] = (route_value & 0xffffffff)
-        # 16 bits MSB in 01
-        c_regmap["ELinkProcessors_Global_cm_erx_route_01"] = (route_value >> 32) & 0xffff
-
-        for channel in c_dict["Channel"]:
- 
-            #each eRx handles data from 1 half of an HGCROC (37 sensor channels, 2 common mode channels)
-            ch = channel % 37
-            erx = int(channel / 37)
-            #configure CM
-            #default routing of eRx's into CM processor
-            route_erx = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-            if cmtype == '4':
-                #for CM4, change selection so that eRx 0 and 1 use CM_ROC0, eRx 1 and 2 use CM_ROC1, etc.
-                c_regmap[f"ELinkProcessors_Global_cm_selection_x_{erx:02d}"] = int(erx/2)    
-            elif cmtype == '2':
-                #for CM2, change selection so that eRx 0 uses CM_ROC0, eRx 1 uses CM_ROC1, etc
-                #for eRx > 5, will use CM_MOD
-                c_regmap[f"ELinkProcessors_Global_cm_selection_x_{erx:02d}"] = int(erx) if erx <= 5 else 6
-            else:
-                #default value, indicates usage of CM_MOD
-                c_regmap[f"ELinkProcessors_Global_cm_selection_x_{erx:02d}"] = 6
-
-            #configure ZS
-            c_regmap[f"ZS_{erx:02d}_zs_lambda_{ch:02d}"] = lamb_int[channel]
-            c_regmap[f"ZS_{erx:02d}_zs_kappa_{ch:02d}"] = kappa_corr_int[channel]
-            c_regmap[f"ZS_{erx:02d}_zs_c_i_{ch:02d}"] = C_i_int[channel]
-            c_regmap[f"ZSmOne_{erx:02d}_zs_c_i_m_{ch:02d}"] = Cm1_i_int[channel]
-            c_regmap[f"ZSmOne_{erx:02d}_zs_beta_m_{ch:02d}"] = betam1_corr_int[channel]
-            
-            # TODO : masks - should one use the Valid flags in the calibration json being processed?
-            # TODO: set as input if channel is masked, masking takes priority over passing                                                                                                                                                                                                                                                                                             
-            # mask: if set, nothing is readout for that channel (unless in pass through mode)                                                                                                                                                                                                                                                                                          
-            # pass: forces the ADC/TOT to be readout for the channel, does not affect TOA to be transmitted                                                                                                                                                                                                                                                                            
-            # c_regmap[f"ZS_{erx:02d}_zs_mask_i_{ch:02d}"] = 0                                                                                                                                                                                                                                                                                                                         
-            # c_regmap[f"ZS_{erx:02d}_zs_pass_i_{ch:02d}"] = 0                                                                                                                                                                                                                                                                                                                         
-
-            # TODO: determine if channel is masked                                                                                                                                                                                                                                                                                                                                     
-            # passm1: forces ADC[-1] to be readout for the channel, does not affect TOA to be transmitted                                                                                                                                                                                                                                                                              
-            # c_regmap[f"ZSmOne_{erx:02d}_zs_pass_i_{ch:02d}"] = 0                                                                                                                                                                                                                                                                                                                     
-            # c_regmap[f"ZSmOne_{erx:02d}_zs_mask_i_{ch:02d}"] = 0                                                                                                                                                                                                                                                                                                                     
-
-        config_regmap[typecode_key] = c_regmap
-
-    return config_regmap
+        glob_vals = [int(digitizeVals(CE, 1023, 10)), route_value & 0xffffffff, (route_value >> 32) & 0xffff]
+
+        #each eRx handles data from 1 half of an HGCROC (37 sensor channels, 2 common mode channels)
+        channel = np.asarray(c_dict["Channel"])
+        ch = channel % NCH_ERX
+        erx = channel // NCH_ERX
+        erxs = np.unique(erx)
+        maxErx = max(maxErx, int(erxs.max())+1)
+        if cmtype == '4':
+            #for CM4, change selection so that eRx 0 and 1 use CM_ROC0, eRx 1 and 2 use CM_ROC1, etc.
+            cm_selection = erxs // 2
+        elif cmtype == '2':
+            #for CM2, change selection so that eRx 0 uses CM_ROC0, eRx 1 uses CM_ROC1, etc
+            #for eRx > 5, will use CM_MOD
+            cm_selection = np.where(erxs <= 5, erxs, 6)
+        else:
+            #default value, indicates usage of CM_MOD
+            cm_selection = np.full(len(erxs), 6)
+
+        # masks of the invalid channels are written with --maskInvalid (masking takes priority over passing)
+        # TODO: the pass/passm1 registers are not written yet
+        # mask: if set, nothing is readout for that channel (unless in pass through mode)
+        # pass: forces the ADC/TOT to be readout for the channel, does not affect TOA to be transmitted
+        # passm1: forces ADC[-1] to be readout for the channel, does not affect TOA to be transmitted
+
+        #addresses and values (sorted by address, i.e. in the order of the names table)
+        addr = np.concatenate([ np.arange(len(GLOBAL_REGISTERS)),
+                                registerAddress(erxs),
+                                registerAddress(erx[:,None], ch[:,None], np.arange(nreg)[None,:]).ravel() ])
+        vals = np.concatenate([ glob_vals, cm_selection, chvals[channel,:nreg].ravel() ])
+        order = np.argsort(addr, kind='stable')
+        modules[typecode_key] = (addr[order].astype(np.uint16), vals[order].astype(np.uint32))
+
+    return {'maxErx': maxErx, 'names': registerNames(maxErx), 'modules': modules}
+
+
+def registersToDict(image : dict) -> dict:
+    """converts a register image to the {typecode: {register name: value}} dict (bulk conversion of the arrays)"""
+    names = image['names']
+    return { typecode : dict(zip(names[addr].tolist(), vals.tolist())) for typecode, (addr, vals) in image['modules'].items() }
+
+
+def saveRegisterImage(url : str, image : dict):
+    """
+    stores a register image as a compact binary (npz) file with the layout of the names table (see registerNames)
+    and, for all modules concatenated, the uint16 addresses and uint32 values; offsets[i]:offsets[i+1] are the registers of typecodes[i]
+    """
+    typecodes = list(image['modules'].keys())
+    sizes = [len(image['modules'][t][0]) for t in typecodes]
+    with open(url, 'wb') as fout:
+        np.savez(fout,
+                 maxErx=image['maxErx'],
+                 globalRegs=np.array(GLOBAL_REGISTERS),
+                 erxRegs=np.array(ERX_REGISTERS),
+                 channelRegs=np.array(CHANNEL_REGISTERS),
+                 typecodes=np.array(typecodes),
+                 offsets=np.concatenate([[0], np.cumsum(sizes)]).astype(np.uint32),
+                 addr=np.concatenate([image['modules'][t][0] for t in typecodes]) if len(typecodes) else np.zeros(0, np.uint16),
+                 value=np.concatenate([image['modules'][t][1] for t in typecodes]) if len(typecodes) else np.zeros(0, np.uint32))
+
+
+def loadRegisterImage(url : str) -> dict:
+    """reads a register image stored with saveRegisterImage"""
+    with np.load(url) as data:
+        offsets = data['offsets']
+        modules = { str(t) : (data['addr'][offsets[i]:offsets[i+1]], data['value'][offsets[i]:offsets[i+1]])
+                    for i, t in enumerate(data['typecodes']) }
+        maxErx = int(data['maxErx'])
+        names = registerNames(maxErx, data['globalRegs'].tolist(), data['erxRegs'].tolist(), data['channelRegs'].tolist())
+        return {'maxErx': maxErx, 'names': names, 'modules': modules}
+
+
+def saveRegisterConfig(url : str, image : dict):
+    """writes the registers as json or yaml (from the file extension)"""
+    regmap = registersToDict(image)
+    with open(url, "w") as fout:
+        if url.endswith('.yaml') or url.endswith('.yml'):
+            import yaml
+            dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+            yaml.dump(regmap, fout, Dumper=dumper, sort_keys=False, default_flow_style=False)
+        else:
+            json.dump(regmap, fout,  indent = 4)
 
 
 def main():
@@ -171,8 +248,14 @@ def main():
                         help='global offset %(default)s',
                         default=0, type=float)
     parser.add_argument("-o", "--output",
-                        help='output file (if not given, the input will be appended with "_econdzsreg") %(default)s',
+                        help='output json or yaml file (if not given, the input will be appended with "_econdzsreg") %(default)s',
+                        default='', type=str)
+    parser.add_argument("--image",
+                        help='output binary register image (if not given, the output with .npz extension) %(default)s',
                         default='', type=str)
+    parser.add_argument("--maskInvalid",
+                        help='mask the channels which are not valid in the pedestals',
+                        action='store_true')
     parser.add_argument("-oP", "--onlyPedestals",
                         help='correct only using Pedestal + noise',
                         default=False, type=bool)
@@ -188,22 +271,27 @@ def main():
     args = parser.parse_args()
     
     #build input for ECON-D configuration of the ZS processor
-    econd_cfg = fillECONDconfig(path_to_config=args.input, 
-                                CE = args.CE,
-                                mip_sf=args.mipSF,
-                                mip_sf_m1=args.mipSFm1,
-                                onlyPedestals = args.onlyPedestals,
-                                P_CM_BXm1_correction = args.P_CM_BXm1_correction,
-                                P_CM_correction = args.P_CM_correction,
-                                factor = args.factor)
+    econd_image = buildECONDRegisters(path_to_config=args.input,
+                                      CE = args.CE,
+                                      mip_sf=args.mipSF,
+                                      mip_sf_m1=args.mipSFm1,
+                                      onlyPedestals = args.onlyPedestals,
+                                      P_CM_BXm1_correction = args.P_CM_BXm1_correction,
+                                      P_CM_correction = args.P_CM_correction,
+                                      factor = args.factor,
+                                      maskInvalid = args.maskInvalid)
 
     #save to file
     outurl = args.output
     if len(outurl)==0:
         outurl = args.input.replace('.json','_econzsreg.json')
-    with open(outurl, "w") as fout:
-        json.dump(econd_cfg, fout,  indent = 4)
+    saveRegisterConfig(outurl, econd_image)
     print(f'ECON-D ZS register configuration has been stored in {outurl}')
+    imageurl = args.image
+    if len(imageurl)==0:
+        imageurl = os.path.splitext(outurl)[0] + '.npz'
+    saveRegisterImage(imageurl, econd_image)
+    print(f'ECON-D ZS register image has been stored in {imageurl}')
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -11,9 +11,15 @@ import ROOT
 
 try:
   from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+  from HGCalCommissioning.LocalCalibration.HelperLibrary import loadHelpers
+  from HGCalCommissioning.LocalCalibration.NeighborTable import declareNeighborTable, DEFAULT_CELLMAP
+  from HGCalCommissioning.LocalCalibration.MIPFitter import fitMIPSpectra
 except ImportError:
   sys.path.append('./python/')
   from JSONEncoder import *
+  from HelperLibrary import loadHelpers
+  from NeighborTable import declareNeighborTable, DEFAULT_CELLMAP
+  from MIPFitter import fitMIPSpectra
 
 class HGCalMIPScaleAnalysis(HGCalCalibration):
 
@@ -32,7 +38,7 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
     def __init__(self):
         self.histofiller = self.mipHistoFiller
         ROOT.gROOT.SetBatch(True)
-        ROOT.gInterpreter.Declare('#include "interface/fit_models.h"')
+        loadHelpers('interface/fit_models.h')
         ROOT.shushRooFit()
         super().__init__()
 
@@ -57,6 +63,16 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
                 .Define('deltaADC',      'HGCDigi_adc[maskhit]-HGCDigi_adcm1[maskhit]') \
                 .Filter('HGCMetaData_trigType==1') \
                 .Filter('HGCMetaData_trigSubType==2') 
+
+        #select isolated hits using the energy in the neighboring cells
+        if cmdargs.maxNeighborEn>=0:
+            loadHelpers('interface/helpers.h')
+            nbtable = declareNeighborTable(module, cmdargs.cellMap)
+            rdf = rdf.Define('nben',     f'neighborSum(neighborTable("{nbtable}"),ch,en)') \
+                     .Define('isolated', f'nben<{cmdargs.maxNeighborEn}') \
+                     .Redefine('ch',       'ch[isolated]') \
+                     .Redefine('en',       'en[isolated]') \
+                     .Redefine('deltaADC', 'deltaADC[isolated]')
         
 
 
@@ -97,6 +113,18 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
         parser.add_argument("--rebinForFit",
                             default='-1', type=int,
                             help='Rebin for fit=%(default)s')
+        parser.add_argument("--maxNeighborEn",
+                            default=-1, type=float,
+                            help='keep only hits with less energy in the neighboring cells (disabled if <0)=%(default)s')
+        parser.add_argument("--cellMap",
+                            default=DEFAULT_CELLMAP, type=str,
+                            help='cell map used to build the neighbor tables=%(default)s')
+        parser.add_argument("--fastMIPFit",
+                            action='store_true',
+                            help='fit the MIP spectra with the NumPy Landau (x) Gauss fitter instead of RooFit')
+        parser.add_argument("--fitBatchSize",
+                            default=64, type=int,
+                            help='number of channels fitted together by the NumPy fitter=%(default)s')
         '''parser.add_argument("--doHexPlots",
                             action='store_true',
                             help='save hexplots for the pedestals')'''
@@ -118,14 +146,18 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
         if ttimeran[1]<0 : ttimeran[1]=moderan[1]
 
         #run mip fits
-        mipfitreport = HGCalMIPScaleAnalysis.runMIPFits(en,*ttimeran,cmdargs.rebinForFit)
+        if cmdargs.fastMIPFit:
+            mipfitreport = HGCalMIPScaleAnalysis.runFastMIPFits(en,*ttimeran,cmdargs.rebinForFit,cmdargs.fitBatchSize)
+        else:
+            mipfitreport = HGCalMIPScaleAnalysis.runMIPFits(en,*ttimeran,cmdargs.rebinForFit)
         mipfitreport['Typecode'] = typecode
 
-        #save histograms to ROOT file
+        #save histograms to ROOT file here: only the compact fit report is sent back to the main process
         rooturl = f'{cmdargs.output}/mipfits_{typecode}.root'
         fOut=ROOT.TFile.Open(rooturl,'RECREATE')
-        for h in mipfitreport['Histos']:
+        for h in mipfitreport.pop('Histos'):
             h.Write()
+            h.Close()
         fOut.Close()
         
         #all done
@@ -134,16 +166,16 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
         
         return mipfitreport
 
+    def mergeResult(self, result):
+        """ adds the MIP fits of a module to the correctors as soon as they are available """
+        typecode = result.pop('Typecode')
+        self.correctors[typecode]=result
+
     def createCorrectionsFile(self, results):        
         """ final tweaks of the analysis results to export as a json file for CMSSW """
     
-        correctors={}
-        for r in results:
-            typecode = r.pop('Typecode')
-            histos = r.pop('Histos')
-            correctors[typecode]=r
         jsonurl = f'{self.cmdargs.output}/mipfits.json'
-        saveAsJson(jsonurl, correctors)
+        saveAsJson(jsonurl, self.correctors)
 
         if self.cmdargs.doHexPlots:
             rooturl = f'{self.cmdargs.output}/mipfits_hexplots.root'
@@ -283,6 +315,52 @@ class HGCalMIPScaleAnalysis(HGCalCalibration):
 
         return mipfitsreport
 
+    @staticmethod
+    def runFastMIPFits(h,minttime,maxttime,rebinFact : int,batchSize : int = 64):
+        """same as runMIPFits but all the channels are projected at once and fit with the NumPy
+        Landau (x) Gauss model (see MIPFitter.py) in batches of channels
+        the report has the same format as the one of runMIPFits
+        """
+
+        #project the energy spectra of all channels in the slice of (minttime,maxttime)
+        nx,nz=h.GetNbinsX(),h.GetNbinsZ()
+        ybinmin,ybinmax=h.GetYaxis().FindBin(minttime),h.GetYaxis().FindBin(maxttime)
+        counts = DAU.histToArray(h)[:,ybinmin-1:ybinmax,:].sum(axis=1).T
+        centers = np.array([h.GetZaxis().GetBinCenter(i) for i in range(1,nz+1)])
+        if rebinFact>1:
+            nzr = nz//rebinFact
+            counts = counts[:,:nzr*rebinFact].reshape(nx,nzr,rebinFact).sum(axis=2)
+            centers = centers[:nzr*rebinFact].reshape(nzr,rebinFact).mean(axis=1)
+
+        #run the fits
+        fr = fitMIPSpectra(centers, counts, batchSize=batchSize)
+
+        #fill the report
+        mipfitsreport = {
+            'Histos':[],
+            'Chi2':fr['chi2'].tolist(),
+            'NDOF':fr['ndof'].tolist(),
+            'Status':fr['status'].tolist(),
+        }
+        for i,k in enumerate(fr['parNames']):
+            mipfitsreport[k] = fr['parVals'][:,i].tolist()
+            mipfitsreport[k+'Unc'] = fr['parUncs'][:,i].tolist()
+        for xbin in range(nx):
+            hpz=h.ProjectionZ(f"en_{xbin}",xbin+1,xbin+1,ybinmin,ybinmax)
+            if rebinFact>1:
+                hpz=hpz.Rebin(rebinFact)
+            gr=ROOT.TGraph(len(centers),centers.astype(float),fr['model'][xbin].astype(float))
+            gr.SetName(f"model_{xbin}")
+            gr.SetLineColor(ROOT.kBlue)
+            gr.SetLineWidth(2)
+            cnv=ROOT.TCanvas(f'ch{xbin}',f'Channel {xbin} {minttime:3.0f}<t_{{trig}}<{maxttime:3.0f}',500,500)
+            hpz.Draw('E')
+            gr.Draw('L')
+            ROOT.SetOwnership(gr,False)
+            mipfitsreport['Histos'].append(cnv)
+
+        return mipfitsreport
+
 
 if __name__ == '__main__':
     
@@ -24,15 +24,17 @@ class HGCalPedestals(HGCalCalibration):
         outdir, module, task_spec, cmdargs = args
 
         rfile = None
-        if cmdargs.fromNZSsampling or cmdargs.scan:
+        if cmdargs.fromNZSsampling:
+            # single pass filling per-channel moment accumulators (no ADC distributions)
+            filter_conds = {
+                'zs':'HGCMetaData_trigType==4',
+                'nzs':'HGCMetaData_trigType==16'
+            }
+            rfile = DAU.momentsHistoFiller(outdir, module, task_spec, filter_conds)
+        elif cmdargs.scan:
             filter_conds = {'rnd':cmdargs.pedTrigger}
-            if cmdargs.fromNZSsampling:
-                filter_conds = {
-                    'zs':'HGCMetaData_trigType==4',
-                    'nzs':'HGCMetaData_trigType==16'
-                }
             # TODO: replace energyScanHistoFiller with simpler adcScanHistoFiller ?
-            rfile = DAU.energyScanHistoFiller(outdir, module, task_spec, filter_conds)
+            rfile = DAU.energyScanHistoFiller(outdir, module, task_spec, filter_conds, adaptiveBinning=cmdargs.adaptiveBinning)
         else:
             filter_cond = cmdargs.pedTrigger
             rfile = DAU.analyzeSimplePedestal(outdir, module, task_spec, filter_cond)
@@ -50,6 +52,9 @@ class HGCalPedestals(HGCalCalibration):
         parser.add_argument("--pedTrigger",
                             default='HGCMetaData_trigType==4',
                             help='trigger type to use')
+        parser.add_argument("--adaptiveBinning",
+                            action='store_true',
+                            help='in scans, book the ADC only in its occupied window per scan point (extra pass over the data)')
 
     @staticmethod
     def analyze(args):
@@ -65,8 +70,28 @@ class HGCalPedestals(HGCalCalibration):
 
     @staticmethod
     def analyzeNZSsamplingResults(args):
+        """derives pedestals, noise and common mode slopes/intercepts from the moments accumulated in NZS events"""
+
         typecode, url, cmdargs = args
+        moments = DAU.profileMoments(url,'nzs')
+        return HGCalPedestals.pedestalsFromMoments(typecode, moments)
+
+    @staticmethod
+    def pedestalsFromMoments(typecode, moments):
+        """builds the pedestals dict of a module from the per-channel moments (see DigiAnalysisUtils.momentsFromSums)"""
+
         pedestals_dict = {'Typecode':typecode}
+        for x in ['adcm1','cm2','cm4','cmall']:
+            pedestals_dict[x+'_ped'] = moments[x+'_mean'].tolist()
+            pedestals_dict[x+'_rms'] = moments[x+'_rms'].tolist()
+            pedestals_dict[x+'_slope'] = moments[x+'_slope'].tolist()
+            pedestals_dict[x+'_intercept'] = moments[x+'_intercept'].tolist()
+        isvalid = (moments['N']>1) & (moments['cm2_rms']>1e-3)
+        pedestals_dict['ADC_ped'] = moments['ADC_mean'].tolist()
+        pedestals_dict['ADC_rms'] = moments['ADC_rms'].tolist()
+        pedestals_dict['Valid'] = isvalid.astype(int).tolist()
+        pedestals_dict['Channel'] = [i for i in range(len(moments['N']))]
+
         return pedestals_dict
 
     @staticmethod
@@ -103,16 +128,18 @@ class HGCalPedestals(HGCalCalibration):
         return pedestals_dict
 
     
+    def mergeResult(self, result):
+        """ adds the pedestals of a module to the correctors as soon as they are available """
+        if not 'Typecode' in result : return
+        typecode = result.pop('Typecode')
+        self.correctors[typecode]=result
+        
+    
     def createCorrectionsFile(self, results):
         
         """ final tweaks of the analysis results to export as a json file for CMSSW """
-        correctors={}
-        for r in results:
-            if not 'Typecode' in r : continue
-            typecode = r.pop('Typecode')
-            correctors[typecode]=r
         jsonurl = f'{self.cmdargs.output}/pedestals.json'
-        saveAsJson(jsonurl, correctors)
+        saveAsJson(jsonurl, self.correctors)
 
         if self.cmdargs.doHexPlots:
             rooturl = f'{self.cmdargs.output}/pedestals_hexplots.root'
@@ -6,13 +6,18 @@ import HexPlotUtils as HPU
 import numpy as np
 import json
 import ROOT
+try:
+  from HGCalCommissioning.LocalCalibration.HelperLibrary import loadHelpers
+except ImportError:
+  sys.path.append('./python/')
+  from HelperLibrary import loadHelpers
 
 class HGCalPedestalsClosure(HGCalCalibration):
 
     def __init__(self, raw_args=None):
         
         self.histofiller = self.histoFillerForClosure
-        ROOT.gInterpreter.Declare('#include "interface/helpers.h"')
+        loadHelpers('interface/helpers.h')
         super().__init__(raw_args)
 
     @staticmethod
@@ -30,10 +35,11 @@ class HGCalPedestalsClosure(HGCalCalibration):
                 .Define('maskhit',       'good_rechit & target_module') \
                 .Define('ch',            'HGCDigi_channel[maskhit]') \
                 .Define('en',            'HGCHit_energy[maskhit]') \
-                .Define('rocidx',        f'sumOverRoc(ch,en,0)') \
-                .Define('nchperroc',     f'sumOverRoc(ch,en,1)') \
-                .Define('dsen',          f'sumOverRoc(ch,en,2)') \
-                .Define('asen',          f'sumOverRoc(ch,en,3)') \
+                .Define('rocsums',       'rocSums(ch,en)') \
+                .Define('rocidx',        'rocsums.view(rocsums.idx)') \
+                .Define('nchperroc',     'rocsums.view(rocsums.n)') \
+                .Define('dsen',          'rocsums.view(rocsums.ds)') \
+                .Define('asen',          'rocsums.view(rocsums.as)') \
                 .Define('modulecm',      'HGCDigi_cm[maskhit]') \
                 .Define('cm2',           'commonMode(modulecm,2)')
 
@@ -53,8 +59,8 @@ class HGCalPedestalsClosure(HGCalCalibration):
             nch = nerx*37
             nrocs = int(nerx/2)
             
-        #adjust binning from the extremes
-        minirdf = HGCalPedestalsClosure.definePedestalsClosureRDF(task_spec)
+        #adjust binning from the extremes (on the full dataset, so that shards have the same binning)
+        minirdf = HGCalPedestalsClosure.definePedestalsClosureRDF(DAU.getUnshardedSpec(task_spec))
         minirdf = minirdf.Range(1000)
         obslist = ['en', 'cm2', 'dsen', 'asen']
         obsbounds  = [minirdf.Min(x) for x in obslist]
@@ -156,6 +162,13 @@ class HGCalPedestalsClosure(HGCalCalibration):
         return results
 
 
+    def mergeResult(self, result):
+        """ keeps the closure information of a module as soon as it is available """
+        if not 'Typecode' in result : return
+        typecode = result.pop('Typecode').replace('-','_')
+        self.correctors[typecode]=result
+        
+    
     def createCorrectionsFile(self, results):
         
         """ final tweaks of the analysis results to export as a json file for CMSSW """
@@ -163,9 +176,7 @@ class HGCalPedestalsClosure(HGCalCalibration):
         #load original pedestals file and add the closure information to it
         with open(self.cmdargs.pedestals,'r') as stream:
             pedestals = json.load(stream)            
-        for r in results:
-            if not 'Typecode' in r : continue
-            typecode = r.pop('Typecode').replace('-','_')
+        for typecode, r in self.correctors.items():
             pedestals[typecode].update(r)
 
         jsonurl = self.cmdargs.pedestals.replace('.json','_with_closure.json')
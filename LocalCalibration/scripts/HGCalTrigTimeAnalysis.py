@@ -2,11 +2,12 @@
 # Instructions:
 #   python3 scripts/HGCalTrigTimeAnalysis.py -r 1727204018 -i /eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/SepTB2024/
 #   python3 scripts/HGCalTrigTimeAnalysis.py -r 1727204018 -i /eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/SepTB2024/ --skipHistoFiller
-#   for r in 1727206292 1727204018; do for k in 3 4 5; do python3 scripts/HGCalTrigTimeAnalysis.py -r $r -i /eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/SepTB2024/ --skipHistoFiller --krms $k; done; done
+#   for r in 1727206292 1727204018; do python3 scripts/HGCalTrigTimeAnalysis.py -r $r -i /eos/cms/store/group/dpg_hgcal/tb_hgcal/2024/hgcalrd/SepTB2024/ --skipHistoFiller --krms 3 4 5; done
 import os, sys
 sys.path.append("./")
 import re
 from HGCalMIPScaleAnalysis import HGCalMIPScaleAnalysis
+import DigiAnalysisUtils as DAU
 from plotTrigTime import makeTrigTimeWindow
 from HGCalCommissioning.LocalCalibration.plot.wafer import fill_wafer_hist
 from HGCalCommissioning.LocalCalibration.plot.utils import setstyle, makehist, makegraph, copytdir, makeHistComparisonCanvas
@@ -117,8 +118,8 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         #                    help='only merge output ROOT files')
         parser.add_argument("--postfix",type=str,default="_krms$RKMS",
                             help='postfix for output files, default=%(default)')
-        parser.add_argument("--krms",type=float,default=4,
-                            help='number of RMS to define E_min threshold, default=%(default)')
+        parser.add_argument("--krms",type=float,nargs='+',default=[4],
+                            help='number(s) of RMS to define E_min threshold, all analyzed in one pass, default=%(default)')
     
     def mergeROOTFiles(self, results):        
         """Merge ROOT files for convenience."""
@@ -143,9 +144,14 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         return rooturl
     
     @staticmethod
-    def getpostfix(cmdargs):
-        strkrms = str(cmdargs.krms).rstrip('0').rstrip('.') # remove trailing 0
-        postfix = cmdargs.postfix
+    def getstrkrms(krms):
+        return str(krms).rstrip('0').rstrip('.') # remove trailing 0
+    
+    @staticmethod
+    def getpostfix(cmdargs, krms=None):
+        """postfix for the given krms value, or for all the krms values analyzed (joined by '-')"""
+        krmsvals = cmdargs.krms if krms is None else [krms]
+        strkrms = '-'.join(HGCalTrigTimeAnalysis.getstrkrms(k) for k in krmsvals)
         postfix = cmdargs.postfix.replace('$RKMS',strkrms)
         return postfix
     
@@ -154,29 +160,26 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         """analyzes a 3D histogram of channel vs trig time vs observable
         for each channel determines the RMS from the inclusive distribution of the observable
         a threshold is then defined loc + krms*RMS
-        the algorithm then profiles the observable (for observable > threshold) 
+        the algorithm then profiles the observable (for observable > threshold)
         as function of trigtime and finds it's maximum
         the proposed trig time range (by which it drops at most by maxDrop) is returned per channel
+        all the krms values are analyzed in one pass over the histogram and stored in the same output file
+        (in one subdirectory per krms value if more than one is given)
         """
         typecode, url, cmdargs = args
-        krms = cmdargs.krms # defines E_min threshold as number or pedestal noise (RMS)
+        krmsvals = cmdargs.krms # define E_min thresholds as number or pedestal noise (RMS)
         maxDrop = 0.90 # defines lower cut for trigtime
-        
+
         # open the ROOT file and read the histograms of interest
         infile = ROOT.TFile.Open(url,'READ')
         hist3d = infile.Get('en') # energy vs. trigphase vs. channel
-        outhists = [ hist3d ] # histograms to write
-        outgraphs = [ ] # graphs to write
-        outhists_ch = { } # channel-level histograms to write
-        
+        outhists = [ hist3d ] # threshold-independent histograms to write
+
         # get general info
         xtitle = hist3d.GetXaxis().GetTitle() # channel
-        ytitle = hist3d.GetYaxis().GetTitle() # trigphase
-        ztitle = hist3d.GetZaxis().GetTitle() # RecHit energy (after pedestal & CM subtraction)
         nx, xmin, xmax = hist3d.GetNbinsX(), hist3d.GetXaxis().GetXmin(), hist3d.GetXaxis().GetXmax()
-        ny, ymin, ymax = hist3d.GetNbinsY(), hist3d.GetYaxis().GetXmin(), hist3d.GetYaxis().GetXmax()
-        nz, zmin, zmax = hist3d.GetNbinsZ(), hist3d.GetZaxis().GetXmin(), hist3d.GetZaxis().GetXmax()
-        
+        ny = hist3d.GetNbinsY()
+
         # maximum trigphase
         h_tp = hist3d.Project3D('y') # project all channels & energy
         h_tp.SetName('tp')
@@ -191,7 +194,7 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         if ny_max<nx:
             ny_max += 2 # for some margin
         #print(f">>> Module {typecode}: ny_max={ny_max}")
-        
+
         # project 3D onto 2D along x=channels or y=trigphase axis
         # https://root.cern.ch/doc/master/classTH3.html#a65ed465ab42638e18ba9ee50b14fa4ad
         h_E_vs_ch = hist3d.Project3D('zx') # project all y=trigphase
@@ -200,6 +203,105 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         h_E_vs_tp.SetName('E_vs_trigphase')
         h_E_vs_ch.SetTitle("Energy vs. channel (all trigphase)")
         h_E_vs_tp.SetTitle("Energy vs. trigphase (all channels)")
+        h_loc_vs_ch = makehist('loc_vs_channel', f"Mean energy vs. channel;{xtitle};Mean Energy",nx,xmin,xmax,ymin=-2,ymax=5)
+        h_rms_vs_ch = makehist('rms_vs_channel', f"Energy RMS vs. trigphase;{xtitle};Energy RMS",nx,xmin,xmax,ymin=-2,ymax=5)
+        outhists += [ h_E_vs_ch, h_E_vs_tp, h_loc_vs_ch, h_rms_vs_ch ]
+
+        # read all the bins once, indexed as [zbin-1][ybin-1][xbin-1], the slices are shared by all the thresholds
+        content = DAU.histToArray(hist3d)
+        zvals = np.array([hist3d.GetZaxis().GetBinCenter(i) for i in range(1,hist3d.GetNbinsZ()+1)])
+
+        # max energy to compute unbiased noise threshold
+        loc_all = hist3d.GetMean(3) # mean energy for the whole module
+        rms_all = hist3d.GetRMS(3)
+        Emax    = max(7.5,loc_all+4.2*rms_all)
+        zbinmax = hist3d.GetZaxis().FindBin(Emax)
+        print(f">>> Module {typecode}: ped={loc_all:+6.3f}, rms={rms_all:4.2f} => Emax={Emax:4.2f}")
+
+        # determine a noise threshold from the inclusive distribution of the observable of each channel
+        # apply E<Emax limit to unbias the mean/rms computation
+        w = content[:zbinmax].sum(axis=1) # energy vs. channel
+        z = zvals[:zbinmax,None]
+        sumw = w.sum(axis=0)
+        locs = np.divide((w*z).sum(axis=0), sumw, out=np.zeros(nx), where=sumw>0)
+        rmss = np.divide((w*z*z).sum(axis=0), sumw, out=np.zeros(nx), where=sumw>0)
+        rmss = np.sqrt(np.abs(rmss-locs**2))
+        for xbin in range(1,nx+1):
+            h_loc_vs_ch.SetBinContent(xbin,locs[xbin-1])
+            h_loc_vs_ch.SetBinError(xbin,rmss[xbin-1])
+            h_rms_vs_ch.SetBinContent(xbin,rmss[xbin-1])
+
+        # create ROOT file
+        rooturl = os.path.join(cmdargs.output,f'trigstudy_{typecode}.root')
+        outfile = ROOT.TFile.Open(rooturl,'RECREATE')
+        print(f">>> Writing {len(outhists)} histograms to {rooturl}...")
+        for hist in outhists:
+            hist.Write()
+
+        # analyze each threshold, keeping the histograms in the output directory of the threshold
+        for krms in krmsvals:
+            strkrms = HGCalTrigTimeAnalysis.getstrkrms(krms)
+            tdir = outfile if len(krmsvals)==1 else outfile.mkdir(f'krms{strkrms}')
+            tdir.cd()
+            krmshists, outhists_ch, coi_trigtime = HGCalTrigTimeAnalysis.analyzeThreshold(typecode,hist3d,content,locs,rmss,krms,maxDrop,ny_max)
+
+            # return the mode of the range limits found
+            minran = stats.mode( [ran[0] for _, ran in coi_trigtime.items()], nan_policy='raise', keepdims=False)
+            maxran = stats.mode( [ran[1] for _, ran in coi_trigtime.items()], nan_policy='raise', keepdims=False)
+            moderan = (minran.mode,maxran.mode)
+            print(f">>> Automatically recognized window for trigger phase of {typecode!r} (krms={strkrms}): {moderan}")
+
+            # write general histograms
+            tdir.cd()
+            print(f">>> Writing {len(krmshists)} histograms to {tdir.GetPath()}...")
+            for hist in krmshists:
+                hist.Write()
+
+            # write channel-level histograms
+            if outhists_ch:
+                chdir = tdir.mkdir('channels')
+                chdir.cd()
+                nhists = sum(len(h) for h in outhists_ch.values())
+                print(f">>> Writing {nhists} channel-level histograms to {chdir.GetPath()}...")
+                for channel in sorted(outhists_ch.keys()):
+                    if channel=='all':
+                        continue
+                    for hist in outhists_ch[channel]:
+                        hist.Write()
+
+            # PLOT
+            if cmdargs.doHexPlots:
+                plotdir = os.path.join(cmdargs.output,"plots")
+                os.makedirs(plotdir,exist_ok=True)
+                postfix = HGCalTrigTimeAnalysis.getpostfix(cmdargs,krms)
+                pdir = tdir.mkdir('plots')
+                pdir.cd()
+                plots = HGCalTrigTimeAnalysis.plotHex(typecode,outhists+krmshists,tdir=pdir,outdir=plotdir,postfix=postfix)
+
+        # all done
+        outfile.Close()
+        infile.Close()
+
+        return rooturl
+
+    @staticmethod
+    def analyzeThreshold(typecode, hist3d, content, locs, rmss, krms, maxDrop, ny_max):
+        """profiles the energy vs. trigphase above the threshold loc + krms*RMS of each channel
+        and finds the trigphase windows per channel, eRx and ROC
+        content is the array of bins of hist3d (see analyze), locs and rmss the mean and RMS of each channel
+        returns the list of histograms, the channel-level histograms and the window per channel
+        """
+        outhists = [ ] # histograms to write
+        outhists_ch = { } # channel-level histograms to write
+
+        # get general info
+        xtitle = hist3d.GetXaxis().GetTitle() # channel
+        ytitle = hist3d.GetYaxis().GetTitle() # trigphase
+        ztitle = hist3d.GetZaxis().GetTitle() # RecHit energy (after pedestal & CM subtraction)
+        nx, xmin, xmax = hist3d.GetNbinsX(), hist3d.GetXaxis().GetXmin(), hist3d.GetXaxis().GetXmax()
+        ny, ymin, ymax = hist3d.GetNbinsY(), hist3d.GetYaxis().GetXmin(), hist3d.GetYaxis().GetXmax()
+        nz, zmin, zmax = hist3d.GetNbinsZ(), hist3d.GetZaxis().GetXmin(), hist3d.GetZaxis().GetXmax()
+
         h_E_vs_ch_Ecut     = ROOT.TH2F('E_vs_channel_Ecut',   f"Energy vs. channel (all trigphase, E > E_{{min}});{xtitle};{ztitle}", nx,xmin,xmax,nz,zmin,zmax)
         h_E_vs_tp_Ecut     = ROOT.TH2F('E_vs_trigphase_Ecut', f"Energy vs. trigphase (all channels, E > E_{{min}});{ytitle};{ztitle}",ny,ymin,ymax,nz,zmin,zmax)
         h_E_vs_ch_tpcut    = ROOT.TH2F('E_vs_channel_tpcut',  f"Energy vs. channel (all trigphase, E > E_{{min}}, window);{xtitle};{ztitle}", nx,xmin,xmax,nz,zmin,zmax)
@@ -208,17 +310,15 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         h_Etot_vs_ch_tpcut = makehist('Etot_vs_channel_tpcut',f"Integrated energy (E > E_{{min}}, window);{xtitle};Integrated energy",nx,xmin,xmax)
         h_error_vs_ch      = makehist('err_vs_channel',       f"Error: 1/2=empty, 3=no mean, 4=no window;{xtitle};Error code",nx,xmin,xmax) #,ymin=0,ymax=2)
         outhists += [ # histograms to write
-          h_E_vs_ch, h_E_vs_ch_Ecut, h_E_vs_ch_tpcut,
+          h_E_vs_ch_Ecut, h_E_vs_ch_tpcut,
           h_error_vs_ch,
           h_Etot_vs_ch_Ecut, h_Etot_vs_ch_tpcut,
-          h_E_vs_tp, h_E_vs_tp_Ecut, h_E_vs_tp_tpcut,
+          h_E_vs_tp_Ecut, h_E_vs_tp_tpcut,
         ]
-        
+
         # prepare other 1D & 2D histograms
-        strkrms = str(krms).rstrip('0').rstrip('.')
+        strkrms = HGCalTrigTimeAnalysis.getstrkrms(krms)
         etitle = f"Threshold E_{{min}} = <E> + {strkrms}*RMS"
-        h_loc_vs_ch    = makehist( 'loc_vs_channel',    f"Mean energy vs. channel;{xtitle};Mean Energy",nx,xmin,xmax,ymin=-2,ymax=5)
-        h_rms_vs_ch    = makehist( 'rms_vs_channel',    f"Energy RMS vs. trigphase;{xtitle};Energy RMS",nx,xmin,xmax,ymin=-2,ymax=5)
         h_Emin_vs_ch   = makehist( 'Emin_vs_channel',   f"Threshold above noise (E > E_{{min}}, krms={strkrms});{xtitle};{etitle}",nx,xmin,xmax,ymin=0,ymax=zmax)
         h_Emin_vs_tp   = ROOT.TH2F('Emin_vs_trigphase', f"Threshold above noise (E > E_{{min}}, krms={strkrms});{ytitle};{etitle}",ny,ymin,ymax,nz,zmin,zmax)
         h_Emean_vs_ch  = ROOT.TH2F('Emean_vs_channel',  f"Mean energy vs. channel (E > E_{{min}});{xtitle};Mean energy",  nx,xmin,xmax,nz,zmin,zmax)
@@ -231,26 +331,25 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
         h_tpmax_vs_ch  = makehist( 'tpmax_vs_channel',  f"Trig phase window maximum vs. channel (krms={strkrms}, drop={maxDrop});{xtitle};{ytitle} window maximum",nx,xmin,xmax,ymin=30,ymax=85)
         g_tpmid_vs_ch  = makegraph('tpmid_vs_channel',  f"Trig phase of maximum <E> vs. channel (krms={strkrms}, drop={maxDrop});{xtitle};{ytitle} of maximum <E>",nx,ymin=30,ymax=85,errors=True)
         outhists += [
-            h_loc_vs_ch,   h_rms_vs_ch,
             h_Emin_vs_ch,  h_Emin_vs_tp,
             h_Emean_vs_ch, h_Eprof_vs_ch,
             h_Emean_vs_tp, h_Eprof_vs_tp,
             h_Emax_vs_ch,  h_Emax_vs_tp,
             h_tpmin_vs_ch, h_tpmax_vs_ch, g_tpmid_vs_ch
         ]
-        
+
         # settings for eRx/ROCs
         nchans = { }
         nchans['erx'] = 37 # 37 per half-ROC (eRx)
         nchans['roc'] = 2*nchans['erx'] # 74 per half-ROC (eRx)
         if nx%nchans['roc']!=0:
             print(f">>> Warning! nx%nchans['roc'] = {nx}%{nchans['roc']} !=0 for module {typecode}!")
-        
+
         # prepare histograms for each eRx/ROC
         modhists = { k: { } for k in ['Emean','Eprof','Emax','tpmin','tpmax','tpmid'] }
         Etot_vs_tp, nhits_vs_tp = { }, { } # arrays to compute means
         for modkey, modtitle in reversed([('erx',"eRx"),('roc',"ROC")]):
-            
+
             # prepare histograms vs. triggerphase
             nmods = int(math.ceil(float(nx)/nchans[modkey])) # number of eRx/ROC bins
             for histkey, hold in [('Emean',h_Emean_vs_tp),('Eprof',h_Eprof_vs_tp),('Emax',h_Emax_vs_tp)]:
@@ -261,7 +360,7 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
                     hnew.GetYaxis().SetRangeUser(0,zmax) # for plotting
                     modhists[histkey][modkey].append(hnew)
                 outhists = insertlist(outhists,modhists[histkey][modkey],hold)
-            
+
             # prepare histogram vs. channel
             info = f"{modtitle} (krms={strkrms}, drop={maxDrop});{xtitle};{ytitle}"
             modhists['tpmin'][modkey] = makehist( f'tpmin_vs_{modkey}',f"Trig phase window minimum vs. {info} window minimum",nmods,xmin,xmax,ymin=40,ymax=90)
@@ -271,74 +370,58 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
             nhits_vs_tp[modkey] = np.zeros(ny)
             newlists = [ modhists['tpmin'][modkey], modhists['tpmax'][modkey], modhists['tpmid'][modkey] ]
             outhists = insertlist(outhists,newlists,g_tpmid_vs_ch)
-        
+
         # set default style for viewing in browser
         for hist in [h_Emin_vs_tp,h_Emean_vs_ch,h_Emean_vs_tp]:
             hist.GetYaxis().SetRangeUser(0,zmax) # for plotting
         for hist in outhists:
             if isinstance(hist,ROOT.TH1F):
                 setstyle(hist)
-        
-        # y=triggerphase axis
+
+        # y=triggerphase & z=energy axes
         yaxis  = hist3d.GetYaxis()
+        zaxis  = hist3d.GetZaxis()
         tpvals = np.array([yaxis.GetBinCenter(i) for i in range(1,ny+1)])
-        
-        # max energy to compute unbiased noise threshold
-        loc_all = hist3d.GetMean(3) # mean energy for the whole module
-        rms_all = hist3d.GetRMS(3)
-        Emax    = max(7.5,loc_all+4.2*rms_all)
-        zbinmax = hist3d.GetZaxis().FindBin(Emax)
-        
+
         # profile energy vs. trigphase per channel
         coi_trigtime = { } # final return value
-        hyz = ROOT.TH2F('pyz','',ny,ymin,ymax,nz,zmin,zmax)
-        print(f">>> Module {typecode}: ped={loc_all:+6.3f}, rms={rms_all:4.2f} => Emax={Emax:4.2f}")
         for xbin in range(1,nx+1): # loop over x=channels
             x = int(hist3d.GetXaxis().GetBinCenter(xbin)) # channel index
             ierx = x//nchans['erx'] # eRx index (37)
             iroc = x//nchans['roc'] # ROC index (2*37)
             #nexterx = (x+1)//nchans['erx']
             #nextroc = (x+1)//nchans['roc']
-            
-            # make yz slice for channel x
-            hyz.Reset('ICE')
-            for ybin, zbin in itertools.product(range(1,ny+1),range(1,nz+1)):
-                nevts = hist3d.GetBinContent(xbin,ybin,zbin)
-                hyz.SetBinContent(ybin,zbin,nevts)
-            
-            # determine a noise threshold from the inclusive distribution of the observable
-            hyz.GetYaxis().SetRange(1,zbinmax) # apply E<Emax limit to unbias the mean/rms computation
-            #print(f">>> Emax={Emax:5.2f} in bin={zbinmax:2d}: loc={loc_all:6.4f} -> {hyz.GetMean(2):7.4f}, rms={rms_all:5.2f} -> {hyz.GetRMS(2):6.2f}")
-            loc  = hyz.GetMean(2)
-            rms  = hyz.GetRMS(2)
+
+            # yz slice for channel x, indexed as [zbin-1][ybin-1]
+            hyz = content[:,:,xbin-1]
+
+            # noise threshold from the inclusive distribution of the observable
+            loc  = locs[xbin-1]
+            rms  = rmss[xbin-1]
             Emin = loc+krms*rms # theshold above noise
-            hyz.GetYaxis().SetRange(0,0) # reset range
-            h_loc_vs_ch.SetBinContent(xbin,loc)
-            h_loc_vs_ch.SetBinError(xbin,rms)
-            h_rms_vs_ch.SetBinContent(xbin,rms)
             h_Emin_vs_ch.SetBinContent(xbin,Emin) # theshold above noise
             if rms<1e-6: # set defaults & skip
                 h_error_vs_ch.SetBinContent(xbin,1) # 1=empty
                 g_tpmid_vs_ch.SetPoint(xbin-1,x,0)
                 continue
-            
+
             # bin to start integrating from
-            zbinmin = hist3d.GetZaxis().FindBin(Emin)+1
-            
+            zbinmin = zaxis.FindBin(Emin)+1
+
             # if bin not valid, set mean to 0 and skip
             Emean_vs_tp = np.zeros(ny) # array with default zeroes
             isempty = (zbinmin<=1 or zbinmin>nz)
             if isempty:
                 h_error_vs_ch.SetBinContent(xbin,2) # 2=empty
-            
+
             # profile the observable in trigtime for values above the noise (E > Emin)
             else:
-                for ybin in range(2,ny_max+1): # loop over y=trigphase (exclude tp<1, bin 1)
+                for ybin in range(2,min(ny_max,ny)+1): # loop over y=trigphase (exclude tp<1, bin 1)
                     y = yaxis.GetBinCenter(ybin) # trigphase
                     nhits, Etot = 0., 0.
                     for zbin in range(zbinmin,nz+1): # loop over z=energy
-                        z = hyz.GetYaxis().GetBinCenter(zbin)
-                        w = hyz.GetBinContent(ybin,zbin)
+                        z = zaxis.GetBinCenter(zbin)
+                        w = hyz[zbin-1,ybin-1]
                         nhits += w # number of hits
                         Etot  += z*w # energy weighted by number of hits
                         h_E_vs_ch_Ecut.Fill(x,z,w) # count hits with energy above threshold
@@ -355,9 +438,7 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
                         for key in Etot_vs_tp:
                             Etot_vs_tp[key][ybin-1] += Etot
                             nhits_vs_tp[key][ybin-1] += nhits
-                
-                hyz.GetYaxis().SetRange(0,0) # reset range
-            
+
             # determine the acceptable trigtime window
             tpmin, tpmax = 0, 0
             tpwindow = findTrigPhaseWindow(tpvals,Emean_vs_tp,maxDrop,xbin,h_Emax_vs_ch,h_Eprof_vs_ch,h_error_vs_ch)
@@ -366,7 +447,7 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
                 coi_trigtime[xbin] = tpwindow
                 addTrigPhaseWindow(xbin,x,tpwindow,h_tpmin_vs_ch,h_tpmax_vs_ch,g_tpmid_vs_ch)
             hasValidWindow = (tpmin<tpmax)
-            
+
             # determine the acceptable trigtime window if this is the last channel of the eRx/ROC
             for key in modhists['tpmin']: # loop over key = 'erx', 'mod'
                 imod, inext = x//nchans[key], (x+1)//nchans[key]
@@ -379,45 +460,20 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
                         addTrigPhaseWindow(modbin,xmod,tpwindow,modhists['tpmin'][key],modhists['tpmax'][key],modhists['tpmid'][key],nchans[key])
                     Etot_vs_tp[key][:] = 0 # reset for next eRx
                     nhits_vs_tp[key][:] = 0
-            
+
             # profile again, but with trigger window cuts (E > Emin, in trigphase window)
             if not isempty and hasValidWindow:
                 ybin_min, ybin_max = yaxis.FindBin(tpmin), yaxis.FindBin(tpmax)
                 for ybin in range(ybin_min,ybin_max+1): # loop loop over y=trigphase
                     y = yaxis.GetBinCenter(ybin) # trigphase
                     for zbin in range(zbinmin,nz+1): # loop over z=energy
-                        z     = hyz.GetYaxis().GetBinCenter(zbin) # energy
-                        nhits = hyz.GetBinContent(ybin,zbin)
+                        z     = zaxis.GetBinCenter(zbin) # energy
+                        nhits = hyz[zbin-1,ybin-1]
                         Etot  = z*nhits
                         h_E_vs_ch_tpcut.Fill(x,z,nhits) # count hits with energy above threshold
                         h_E_vs_tp_tpcut.Fill(y,z,nhits) # count hits with energy above threshold
                         h_Etot_vs_ch_tpcut.Fill(x,Etot) # integrate energy above threshold
-            
-            #### store slice for this channel
-            ###htitle = "Energy vs. trigphase (all channels)"
-            ###E_vs_tp_ch = hyz.Clone(f"E_vs_trigphase_ch{x:03d}")
-            ###E_vs_tp_ch.SetTitle(f"{htitle};{ytitle};{ztitle})
-            ###outhists_ch[x] = [ E_vs_tp_ch ]
-            ###if not isempty:
-            ###    E_vs_tp_ch_Ecut = E_vs_tp_ch.Clone(f"E_vs_trigphase_ch{x:03d}_Ecut")
-            ###    E_vs_tp_ch_Ecut.SetTitle(htitle.replace(')',"E > E_{min})"))
-            ###    outhists_ch[x].append(E_vs_tp_ch_Ecut)
-            ###    for zbin in range(0,zbinmin): # loop over z=energy
-            ###        for ybin in range(1,ny_max+1): # loop over y=trigphase
-            ###            E_vs_tp_ch_Ecut.SetBinContent(ybin,zbin,0.0) # remove
-            ###    if hasValidWindow:
-            ###        E_vs_tp_ch_tpcut = E_vs_tp_ch_Ecut.Clone(f"E_vs_trigphase_ch{x:03d}_tpcut")
-            ###        E_vs_tp_ch_tpcut.SetTitle(htitle.replace(')',"E > E_{min}, window)"))
-            ###        outhists_ch[x].append(E_vs_tp_ch_tpcut)
-            ###        for zbin in range(zbinmin,nz+1): # loop over z=energy
-            ###            for ybin in range(1,ny_max+1): # loop over y=trigphase
-            ###                y = yaxis.GetBinCenter(ybin) # trigphase
-            ###                if tpmin<y<tpmax:
-            ###                    continue
-            ###                E_vs_tp_ch_tpcut.SetBinContent(ybin,zbin,0.0) # remove
-        
-        hyz.Delete()
-        
+
         # get maximum mean energy vs. trigphase
         # by scanning h_Emax_vs_tp from top for each bin of y=trigphase
         profile(h_Emean_vs_tp,h_Eprof_vs_tp,h_Emax_vs_tp)
@@ -425,48 +481,8 @@ class HGCalTrigTimeAnalysis(HGCalMIPScaleAnalysis):
             nmods = len(modhists['Emean'][key])
             for imod in range(nmods):
                 profile(modhists['Emean'][key][imod],modhists['Eprof'][key][imod],modhists['Emax'][key][imod])
-        
-        # return the mode of the range limits found
-        minran = stats.mode( [ran[0] for _, ran in coi_trigtime.items()], nan_policy='raise', keepdims=False)
-        maxran = stats.mode( [ran[1] for _, ran in coi_trigtime.items()], nan_policy='raise', keepdims=False)
-        moderan = (minran.mode,maxran.mode)
-        print(f">>> Automatically recognized window for trigger phase of {typecode!r}: {moderan}")
-        
-        # create ROOT file
-        postfix = HGCalTrigTimeAnalysis.getpostfix(cmdargs)
-        rooturl = os.path.join(cmdargs.output,f'trigstudy_{typecode}.root')
-        
-        # write general histograms
-        outfile = ROOT.TFile.Open(rooturl,'RECREATE')
-        print(f">>> Writing {len(outhists)} histograms to {rooturl}...")
-        for hist in outhists:
-            hist.Write()
-        
-        # write channel-level histograms
-        if outhists_ch:
-            chdir = outfile.mkdir('channels')
-            chdir.cd()
-            nhists = sum(len(h) for h in outhists_ch.values())
-            print(f">>> Writing {nhists} channel-level histograms to {chdir.GetPath()}...")
-            for channel in sorted(outhists_ch.keys()):
-                if channel=='all':
-                    continue
-                for hist in outhists_ch[channel]:
-                    hist.Write()
-        
-        # PLOT
-        if cmdargs.doHexPlots:
-            plotdir = os.path.join(cmdargs.output,"plots")
-            os.makedirs(plotdir,exist_ok=True)
-            tdir = outfile.mkdir('plots')
-            tdir.cd()
-            plots = HGCalTrigTimeAnalysis.plotHex(typecode,outhists,tdir=tdir,outdir=plotdir,postfix=postfix)
-        
-        # all done
-        outfile.Close()
-        infile.Close()
-        
-        return rooturl
+
+        return outhists, outhists_ch, coi_trigtime
     
     @staticmethod
     def plotHex(typecode, hists, tdir=None, outdir=None, postfix=""):        
@@ -6,7 +6,7 @@ import numpy as np
 import os
 import ROOT
 import pandas as pd
-from scipy.optimize import curve_fit
+from scipy.stats import chi2 as chi2dist
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import mplhep as hep
@@ -31,6 +31,8 @@ class HGCalTrimInvScan(HGCalCalibration):
     def addCommandLineOptions(self, parser):
         """Add specific command line options for the VRef scan"""
         super().addCommandLineOptions(parser)
+        parser.add_argument("--saturationADC", type=float, default=1000,
+                            help="scan points with <ADC> above this value are not used in the fits=%(default)s")
     
     @staticmethod
     def analyze(args):
@@ -48,103 +50,77 @@ class HGCalTrimInvScan(HGCalCalibration):
           pdf_url = url.replace('.root','_fits.pdf')
           pdf = PdfPages(pdf_url)
         
-        # model for <adc> vs <trim_inv> in each channel
-        trim_inv_model = lambda x,a,b : a*x+b
-        
-        # loop over channels and fit
+        # read <adc> vs <trim_inv> for all channels at once as (channel x scan point) arrays
         fIn = ROOT.TFile.Open(url)
-        
-        chTypeprofile = fIn.Get('chType')
-        scaninfo = fIn.Get('scaninfo')
-        npts = scaninfo.GetNbinsX()
-        x = np.array([scaninfo.GetBinContent(ipt+1,2) for ipt in range(npts)]) 
-
+        x = DAU.histToArray(fIn.Get('scaninfo'))[1]
+        chTypes, _ = DAU.profileToArrays(fIn.Get('chType')) # 0: calibration, 1: channel, 2: common mode
         adcprofile = fIn.Get('adcprofile')
         adcprofile.SetErrorOption('s')
-        nch = adcprofile.GetNbinsY()
-
+        adc, adcerr = DAU.profileToArrays(adcprofile)
         modulecmprofile = fIn.Get('modulecmprofile')
         modulecmprofile.SetErrorOption('s')
-
+        cm, cmerr = DAU.profileToArrays(modulecmprofile)
+        fIn.Close()
+        
+        # one row per eRx for the common mode followed by the 37 channels of the eRx
+        nch = adc.shape[0]
         nerx = int(nch/37)
-        fit_results = []
-        for ierx in range(nerx):
-          
-          choffset = ierx*37+1
-          
-          if doPlots:
-            fig, ax = plt.subplots(7,6,figsize=(18,28),sharex=True,sharey=True)
-          
-          for ich in range(-1, 37):
-            chType = 2 if (ich == -1) else chTypeprofile.GetBinContent(ich+choffset) # 0: calibration, 1: channel, 2: common mode
-            profile = modulecmprofile if ich == -1 else adcprofile
-            y = np.array([profile.GetBinContent(ipt+1,ich+choffset) for ipt in range(npts)])
-            yerr = np.array([profile.GetBinError(ipt+1,ich+choffset) for ipt in range(npts)])
-            
-            # fit the model
-            try:
-                popt, pcov = curve_fit(trim_inv_model, x, y, sigma=yerr)
-                popt_unc = np.sqrt(np.diag(pcov))
-                yexp = trim_inv_model(x,*popt)
-                chi2 = (((y-yexp)/yerr)**2).sum()
-                ndof = len(x)-len(popt)
-                fit_results.append( [ierx, ich+choffset-1, popt[0], popt_unc[0], popt[1], popt_unc[1], chi2/ndof, True, chType] )
-            except Exception as e:
-                print(e)
-                fit_results.append( [ierx, ich+choffset-1] + [-1]*5 + [False]+ [chType] )
-            
-            # show the fit result
-            if not doPlots: continue
-            #ix = ich%ax.shape[0]
-            #iy = int(ich/ax.shape[0])
-            if ich == -1:
-                ix, iy = ax.shape[0] - 1, ax.shape[1] - 1
-            else:
-                ix = ich % ax.shape[0]
-                iy = int(ich / ax.shape[0])
-            ax[ix,iy].grid()
-            ax[ix,iy].errorbar(x,y,yerr=yerr,marker='o',elinewidth=1,capsize=1,color='k',ls='none')
-            txtargs = { 'transform':ax[ix,iy].transAxes, 'fontsize':12 }
-            if fit_results[-1][-2]:
-                ax[ix,iy].plot(x,yexp,ls='-')
-                channel_name = "CM channel" if ich == -1 else f'Channel {ich+choffset}'
-                ax[ix,iy].text(0.1,0.90, channel_name, **txtargs)
-                #ax[ix,iy].text(0.1,0.9,f'Channel {ich+choffset}', **txtargs)
-                ax[ix,iy].text(0.1,0.85,rf'Slope= ${popt[0]:3.2f} \pm {popt_unc[0]:3.2f}$', **txtargs)
-                ax[ix,iy].text(0.1,0.80,rf'Offset = ${popt[1]:3.2f} \pm {popt_unc[1]:3.2f}$', **txtargs)
-                ax[ix,iy].text(0.1,0.75,rf'$\chi^2/dof={chi2:3.2f}/{ndof}$', **txtargs)
-            else:
-                ax[ix,iy].text(0.1,0.90,f'Channel {ich+choffset} fit failed', **txtargs, bbox={'facecolor':'red', 'alpha':0.5})
-          
-          # finalize page
-          if doPlots:
-              plt.subplots_adjust(wspace=0, hspace=0)
-              pdf.attach_note(f'Fits to channels in e-Rx {ierx+1}')
-              pdf.savefig()
-              plt.close()
+        ierx = np.repeat(np.arange(nerx), 38)
+        iseq = np.tile(np.arange(-1,37), nerx)
+        iscm = (iseq==-1)
+        ich = ierx*37 + iseq
+        ichdata = np.where(iscm, ierx*37, ich) # the CM profile is the same for all the channels of the eRx
+        y = np.where(iscm[:,None], cm[ichdata], adc[ichdata])
+        yerr = np.where(iscm[:,None], cmerr[ichdata], adcerr[ichdata])
+        chType = np.where(iscm, 2, chTypes[ichdata])
         
-        # convert to a pandas for further manipulation
-        fit_results = pd.DataFrame(
-          fit_results,
-          columns = ['ierx','ich','slope','slope_unc','offset','offset_unc','reduced_chi2','valid','chType']
-        )
+        # linear model fit in all channels, using only the points which are not empty nor saturated
+        mask = (yerr>0) & (y<cmdargs.saturationADC)
+        linfit = DAU.weightedLinearFit(x, y, yerr, mask)
+        valid = linfit['valid']
+        reduced_chi2 = linfit['chi2']/linfit['ndof']
+        fit_results = pd.DataFrame({
+          'ierx':ierx, 'ich':ich,
+          'slope':linfit['slope'], 'slope_unc':linfit['slope_unc'],
+          'offset':linfit['offset'], 'offset_unc':linfit['offset_unc'],
+          'reduced_chi2':reduced_chi2, 'valid':valid, 'chType':chType,
+          'npts':linfit['npts'], 'ndof':linfit['ndof'], 'pvalue':chi2dist.sf(linfit['chi2'],linfit['ndof'])
+        })
+        fit_results.loc[~valid, ['slope','slope_unc','offset','offset_unc','reduced_chi2','pvalue']] = -1
         
-        # determine the max offset per erx
-        # start by determining the median and the standard deviation (s.d.)
-        # determine max offset from fit which are within 2-s.d. of the median
+        # determine the best trim_inv per channel
+        fit_results['max_offset'], fit_results['trim_inv_optim'] = HGCalTrimInvScan.solveOptimalTrim(fit_results)
         mask_valid = (fit_results['valid']==True)
-        criteria = fit_results[mask_valid].groupby('ierx')['offset'].agg(['median','std']).to_dict()
-        median_offset = fit_results['ierx'].map(criteria['median'])
-        std_offset = fit_results['ierx'].map(criteria['std'])
-        fit_matches_criteria = (np.abs(fit_results['offset']-median_offset)<2*std_offset)        
-        maxoffset_per_erx = fit_results[mask_valid & fit_matches_criteria].groupby('ierx')['offset'].agg('max').to_dict()
-        fit_results['max_offset'] = fit_results['ierx'].map(maxoffset_per_erx)
         
-        # determine the best trim_inv per channel (clip to 6b DAC = [0,64[ and round to integer)
-        fit_results['trim_inv_optim'] = np.rint( np.clip(
-          (fit_results['max_offset']-fit_results['offset'])/fit_results['slope'],
-          0, 64
-        ) )
+        # show the fit results
+        if doPlots:
+          for e in range(nerx):
+            fig, ax = plt.subplots(7,6,figsize=(18,28),sharex=True,sharey=True)
+            for i in np.nonzero(ierx==e)[0]:
+              if iscm[i]:
+                  ix, iy = ax.shape[0] - 1, ax.shape[1] - 1
+              else:
+                  ix = iseq[i] % ax.shape[0]
+                  iy = int(iseq[i] / ax.shape[0])
+              fitres = fit_results.iloc[i]
+              ax[ix,iy].grid()
+              ax[ix,iy].errorbar(x,y[i],yerr=yerr[i],marker='o',elinewidth=1,capsize=1,color='k',ls='none')
+              txtargs = { 'transform':ax[ix,iy].transAxes, 'fontsize':12 }
+              if fitres['valid']:
+                  ax[ix,iy].plot(x,fitres['slope']*x+fitres['offset'],ls='-')
+                  channel_name = "CM channel" if iscm[i] else f'Channel {ich[i]+1}'
+                  ax[ix,iy].text(0.1,0.90, channel_name, **txtargs)
+                  ax[ix,iy].text(0.1,0.85,rf'Slope= ${fitres["slope"]:3.2f} \pm {fitres["slope_unc"]:3.2f}$', **txtargs)
+                  ax[ix,iy].text(0.1,0.80,rf'Offset = ${fitres["offset"]:3.2f} \pm {fitres["offset_unc"]:3.2f}$', **txtargs)
+                  ax[ix,iy].text(0.1,0.75,rf'$\chi^2/dof={fitres["reduced_chi2"]*fitres["ndof"]:3.2f}/{fitres["ndof"]}$', **txtargs)
+              else:
+                  ax[ix,iy].text(0.1,0.90,f'Channel {ich[i]+1} fit failed', **txtargs, bbox={'facecolor':'red', 'alpha':0.5})
+            
+            # finalize page
+            plt.subplots_adjust(wspace=0, hspace=0)
+            pdf.attach_note(f'Fits to channels in e-Rx {e+1}')
+            pdf.savefig()
+            plt.close()
         
         # do some histogramming as summary
         if doPlots:
@@ -181,28 +157,63 @@ class HGCalTrimInvScan(HGCalCalibration):
             print(f'Fit results pictures stored in {pdf_url}')
         
         # all done here
-        fIn.Close()
         return {'Typecode':typecode,'Fits':fit_results}
         
     
+    @staticmethod
+    def solveOptimalTrim(fit_results : pd.DataFrame, nsigma : float = 2., dacmax : int = 63) -> tuple:
+        """
+        Determines the max offset per eRx and the trim_inv which aligns each channel to it.
+        The max offset is taken from the valid fits which are within nsigma s.d. of the median offset of the eRx.
+        The trim_inv is clipped to the 6b DAC range [0,dacmax] and rounded (0 for invalid fits).
+        Returns (max_offset, trim_inv_optim) as arrays aligned with fit_results.
+        """
+        ierx = fit_results['ierx'].to_numpy()
+        offset = fit_results['offset'].to_numpy()
+        slope = fit_results['slope'].to_numpy()
+        valid = fit_results['valid'].to_numpy(dtype=bool)
+        
+        # median and standard deviation (s.d.) of the valid offsets per eRx
+        criteria = fit_results[valid].groupby('ierx')['offset'].agg(['median','std'])
+        nerx = int(ierx.max())+1 if len(ierx)>0 else 0
+        median_offset = np.full(nerx, np.nan)
+        std_offset = np.full(nerx, np.nan)
+        median_offset[criteria.index] = criteria['median']
+        std_offset[criteria.index] = criteria['std']
+        matches_criteria = valid & (np.abs(offset-median_offset[ierx])<nsigma*std_offset[ierx])
+        
+        # max offset per eRx from the fits matching the criteria
+        max_offset = np.full(nerx, -np.inf)
+        np.maximum.at(max_offset, ierx[matches_criteria], offset[matches_criteria])
+        max_offset = np.where(np.isfinite(max_offset), max_offset, np.nan)[ierx]
+        
+        # best trim_inv per channel
+        trim = np.divide(max_offset-offset, slope, out=np.full(len(offset), np.nan), where=valid & (slope!=0))
+        trim = np.rint(np.clip(trim, 0, dacmax))
+        trim = np.where(np.isfinite(trim), trim, 0).astype(int)
+        return max_offset, trim
+        
+    
     @staticmethod
     def producePlots(typecode, url, cmdargs, fileIn, df_fitres):
         """Produce control plots."""
         pass
     
+    def mergeResult(self, result):
+        """Converts the fits of a module to its trim_inv settings as soon as they are available."""
+        typecode, fits = result['Typecode'], result['Fits']
+        fits_cm = fits[fits['chType'] == 2].reset_index()
+        fits_cm['trim_inv'] = fits_cm['trim_inv_optim']
+        self.correctors[typecode] = {'ierx': fits_cm['ierx'].tolist(), 'trim_inv_cm': fits_cm['trim_inv'].tolist()}
+        fits_ch = fits[fits['chType'] != 2].reset_index()
+        fits_ch['trim_inv'] = fits_ch['trim_inv_optim']
+        self.correctors[typecode].update({'Channel': fits_ch['ich'].tolist(), 'trim_inv': fits_ch['trim_inv'].tolist()})
+        
+    
     def createCorrectionsFile(self, results):
         """Final tweaks of the analysis results to export as json."""
-        corr_dict = {}
-        for entry in results:
-            typecode, fits = entry['Typecode'], entry['Fits']
-            fits_cm = fits[fits['chType'] == 2].reset_index()
-            fits_cm['trim_inv'] = fits_cm['trim_inv_optim'].fillna(0).astype('int').clip(upper=63)
-            corr_dict[typecode] = {'ierx': fits_cm['ierx'].tolist(), 'trim_inv_cm': fits_cm['trim_inv'].tolist()}
-            fits_ch = fits[fits['chType'] != 2].reset_index()
-            fits_ch['trim_inv'] = fits_ch['trim_inv_optim'].fillna(0).astype('int').clip(upper=63)
-            corr_dict[typecode].update({'Channel': fits_ch['ich'].tolist(), 'trim_inv': fits_ch['trim_inv'].tolist()})
         jsonurl = f'{self.cmdargs.output}/config_params_triminv.json'
-        saveAsJson(jsonurl, corr_dict)
+        saveAsJson(jsonurl, self.correctors)
         return jsonurl
         
 
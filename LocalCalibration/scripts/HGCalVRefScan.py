@@ -7,7 +7,7 @@ import re, glob
 import ROOT
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 from matplotlib.patches import Rectangle
@@ -57,36 +57,20 @@ class HGCalVRefScan(HGCalCalibration):
         # get scan info
         fileIn = ROOT.TFile.Open(url)
         scaninfo = fileIn.Get('scaninfo')
-        npts = scaninfo.GetNbinsX()
-        x = np.array([scaninfo.GetBinContent(ipt+1,2) for ipt in range(npts)])
+        x = DAU.histToArray(scaninfo)[1] # 2nd parameter vs. scan point
         
-        # get <ADC> data
+        # get <ADC> data for all channels and scan points at once: (channel x scan point) arrays
         adcprofile = fileIn.Get('adcprofile')
         adcprofile.SetErrorOption('s')
+        y, ye = DAU.profileToArrays(adcprofile)
         
-        # convert FE channel index to channel readout sequence
-        chTypeprofile = fileIn.Get('chType') # 0: calibration, 1: channel, 2: common mode
-        injChansMap   = fileIn.Get('injChansMap') # 0: calibration, 1: channel, 2: common mode
-        nchans = chTypeprofile.GetXaxis().GetNbins() #adcprofile.GetYaxis().GetNbins()
-        nerx   = int(nchans/37)
-        
-        # loop over eRx (half-ROC)
-        fitresults = [ ]
-        for ierx in range(nerx):
-            fitres = [ ]
-            
-            # loop over channels in eRx
-            for ich in range(0,37):     # index in this eRx
-                ich_ros = ierx*37 + ich # index of readout sequence in this module: 0-221 for LD, 0-441 for HD
-                isInjChan = (injChansMap.GetBinContent(1,ich_ros+1)==1)
-                
-                # fit if "injected" (HZ_noinv=1)
-                if isInjChan:
-                    info   = f"{typecode}, ierx={ierx:2}, ich={ich_ros:3}"
-                    y      = np.array([adcprofile.GetBinContent(ip+1,ich_ros+1) for ip in range(npts)])
-                    ye     = np.array([adcprofile.GetBinError(ip+1,ich_ros+1) for ip in range(npts)])
-                    fitres = HGCalVRefScan.fit(x, y, ye, cmdargs.targetadc, info=info, verb=cmdargs.verbosity)
-                    fitresults.append([ierx,ich_ros,*fitres])
+        # fit the "injected" channels (HZ_noinv=1) all at once
+        injChansMap = fileIn.Get('injChansMap')
+        ich_ros = np.nonzero(DAU.histToArray(injChansMap)[:,0]==1)[0] # index of readout sequence: 0-221 for LD, 0-441 for HD
+        ierx = ich_ros//37
+        info = [f"{typecode}, ierx={e:2}, ich={c:3}" for e, c in zip(ierx, ich_ros)]
+        fitres = HGCalVRefScan.fitBatch(x, y[ich_ros], ye[ich_ros], cmdargs.targetadc, info=info, verb=cmdargs.verbosity)
+        fitresults = [[e,c,*r] for e, c, r in zip(ierx, ich_ros, fitres)]
         
         # convert to a pandas for further manipulation
         optparam  = cmdargs.scanparam #+"_optim"
@@ -106,83 +90,95 @@ class HGCalVRefScan(HGCalCalibration):
                 print(f">>> HGCalVRefScan.analyze: Warning! ALL fits were invalid for {typecode}... Using default {xopt_ave} !")
             df_fitres.loc[~df_fitres['valid'],optparam] = x_ave # overwrite
         
-        # produce control plots
-        if cmdargs.doControlPlots:
-            HGCalVRefScan.producePlots(typecode, url, cmdargs, fileIn, df_fitres)
+        # control plots are produced in parallel after the analysis (see producePlotsInParallel)
+        xlabel = scaninfo.GetYaxis().GetBinLabel(2)
         fileIn.Close() # close to delete profile from memory
         
         # all done here
-        return { 'Typecode': typecode, 'Fits': df_fitres }
+        result = { 'Typecode': typecode, 'Fits': df_fitres }
+        if cmdargs.doControlPlots:
+            result['PlotData'] = { 'url': url, 'x': x, 'y': y, 'ye': ye, 'xlabel': xlabel }
+        return result
         
     
     @staticmethod
     def fit(x, y, yerr, target, info="unkown", verb=0):
-        """Fit VRef scan data for given channel.
-        Find linear regime, fit it, and find intersection with target ADC."""
+        """Fit VRef scan data for given channel (see fitBatch)."""
+        return HGCalVRefScan.fitBatch(x, np.array([y]), np.array([yerr]), target, info=[info], verb=verb)[0]
         
-        # find linear regime
-        ymin = np.min(y)
-        ymax = np.max(y)
-        yspan = ymax-ymin
-        ids_below = np.where(y<ymin+0.05*yspan)[0] # indices below 5% of min.
-        ids_above = np.where(y>ymin+0.95*yspan)[0] # indices above 5% of max.
-        ileft, iright = 0, len(y)-1 # default
-        if len(ids_above)==0 or len(ids_below)==0:
-            print(f">>> HGCalVRefScan.fit: Warning! Could not find linear region for {info}..."
-                  f" y={y}, ids_above={ids_above}, ids_below={ids_below}")
-        elif ids_below[-1]<ids_above[0]: # rising
-            ileft, iright = ids_below[-1], ids_above[0]
-        elif ids_above[-1]<ids_below[0]: # descending
-            ileft, iright = ids_above[-1], ids_below[0]
-        else: # mixed, noisy ?
-            print(f">>> HGCalVRefScan.fit: Warning! Could not find linear region for {info}...")
-        xfit = x[ileft:iright]
-        yfit = y[ileft:iright]
-        yerr = np.where(yerr<=0,1e-4,yerr)[ileft:iright] # avoid division by 0
+    
+    @staticmethod
+    def fitBatch(x, y, yerr, target, info=None, verb=0):
+        """Fit VRef scan data for all channels at once: y, yerr are (channel x scan point) arrays.
+        For each channel find the linear regime, fit it with weighted least squares,
+        and find the intersection with target ADC.
+        Returns a list of [xopt, slope, slope_unc, offset, offset_unc, reduced_chi2, xmin, xmax, valid] per channel."""
         
-        # fit the model
-        fitresult = [-1, -1, -1, -1, -1, -1, -1, -1, False] # default
-        if len(xfit)>2: # not enough points to accurately fit ?
-            try:
-                model = lambda x,a,b : a*x+b # linear fit function
-                popt, pcov = curve_fit(model, xfit, yfit, sigma=yerr)
-                popt_unc = np.sqrt(np.diag(pcov))
-                alpha, beta = popt[0], popt[1] # slope, offset
-                yexp = model(xfit,alpha,beta)
-                chi2 = (((yfit-yexp)/yerr)**2).sum()
-                ndof = len(xfit)-len(popt)
-                if alpha!=0: # find optimal value as intersection with target y
-                    xopt = int(round((target-beta)/alpha))
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        nch, npts = y.shape
+        if info is None:
+            info = [f"ich={i}" for i in range(nch)]
+        
+        # find linear regime: between the last point below 5% and the first above 95% of the span (or vice-versa)
+        ymin = y.min(axis=1, keepdims=True)
+        yspan = y.max(axis=1, keepdims=True)-ymin
+        below = y<ymin+0.05*yspan # indices below 5% of min.
+        above = y>ymin+0.95*yspan # indices above 5% of max.
+        first = lambda m : np.argmax(m, axis=1)
+        last = lambda m : npts-1-np.argmax(m[:,::-1], axis=1)
+        hasboth = below.any(axis=1) & above.any(axis=1)
+        rising = hasboth & (last(below)<first(above))
+        descending = hasboth & ~rising & (last(above)<first(below))
+        ileft = np.where(rising, last(below), np.where(descending, last(above), 0))
+        iright = np.where(rising, first(above), np.where(descending, first(below), npts-1))
+        for i in np.nonzero(~(rising | descending))[0]:
+            print(f">>> HGCalVRefScan.fit: Warning! Could not find linear region for {info[i]}... y={y[i]}")
+        
+        # weighted linear least squares in the linear regime of each channel
+        ipt = np.arange(npts)
+        infit = (ipt>=ileft[:,None]) & (ipt<iright[:,None])
+        yerr = np.where(yerr<=0,1e-4,yerr) # avoid division by 0
+        linfit = DAU.weightedLinearFit(x, y, yerr, infit)
+        isfit = linfit['valid'] # not enough points to accurately fit ?
+        alpha, alpha_unc = linfit['slope'], linfit['slope_unc']
+        beta, beta_unc = linfit['offset'], linfit['offset_unc']
+        chi2, ndof = linfit['chi2'], linfit['ndof']
+        
+        # find optimal value as intersection with target y
+        fitresults = [ ]
+        for i in range(nch):
+            fitresult = [-1, -1, -1, -1, -1, -1, -1, -1, False] # default
+            if isfit[i]:
+                if alpha[i]!=0:
+                    xopt = int(round((target-beta[i])/alpha[i]))
                     valid = bool(x[0]<=xopt<=x[-1]) # inside scan range
                 else:
                     xopt = -1
                     valid = False
-                fitresult = [ xopt, alpha, popt_unc[0], beta, popt_unc[1], chi2/ndof,
+                xfit = x[infit[i]]
+                fitresult = [ xopt, alpha[i], alpha_unc[i], beta[i], beta_unc[i], chi2[i]/ndof[i],
                               xfit[0], xfit[-1], valid]
-            except Exception as e:
-                print(e)
-        if verb>=1:
-            print(f">>> HGCalVRefScan.fit: {info}: xopt={fitresult[0]}, a={fitresult[1]:<5.3g}+-{fitresult[2]:<6.2g}"
-                  f", b={fitresult[3]:<4.3g}+-{fitresult[4]:<4.2g}, chi2/ndof={fitresult[5]:<4.3g}, valid={fitresult[8]:1}"
-                  f"in lin. region (x,y)[{ileft}]=({xfit[0]},{yfit[0]:.4g}) -> [{iright}]=({xfit[-1]},{yfit[-1]:.4g})")
-        return fitresult
+            if verb>=1:
+                print(f">>> HGCalVRefScan.fit: {info[i]}: xopt={fitresult[0]}, a={fitresult[1]:<5.3g}+-{fitresult[2]:<6.2g}"
+                      f", b={fitresult[3]:<4.3g}+-{fitresult[4]:<4.2g}, chi2/ndof={fitresult[5]:<4.3g}, valid={fitresult[8]:1}"
+                      f" in lin. region [{ileft[i]}] -> [{iright[i]}]")
+            fitresults.append(fitresult)
+        return fitresults
         
     
     @staticmethod
-    def producePlots(typecode, url, cmdargs, fileIn, df_fitres):
-        """Produce control plots."""
+    def producePlots(typecode, cmdargs, plotdata, df_fitres):
+        """Produce control plots from the (channel x scan point) arrays of <ADC> in plotdata."""
         
         # get scan info
         scanparam = cmdargs.scanparam
         targetadc = cmdargs.targetadc
-        scaninfo = fileIn.Get('scaninfo')
-        npts = scaninfo.GetNbinsX()
-        x = np.array([scaninfo.GetBinContent(ipt+1,2) for ipt in range(npts)])
-        
-        # get <ADC> data
-        adcprofile = fileIn.Get('adcprofile')
-        adcprofile.SetErrorOption('s')
-        nchans = adcprofile.GetNbinsY()
+        url    = plotdata['url']
+        x      = plotdata['x']
+        adc    = plotdata['y']
+        adcerr = plotdata['ye']
+        nchans = adc.shape[0]
         nerx   = int(nchans/37)
         
         # prepare PDF
@@ -194,7 +190,6 @@ class HGCalVRefScan(HGCalCalibration):
         fitgraphs = { } # for summary plots
         
         # loop over eRx (half-ROC)
-        x = np.array([scaninfo.GetBinContent(ipt+1,2) for ipt in range(npts)])
         xmin, xmax = np.min(x), np.max(x)
         for ierx in range(nerx):
             
@@ -215,8 +210,8 @@ class HGCalVRefScan(HGCalCalibration):
                 label   = f"{ich_erx+1}" # index in this HGCROC, counting from 1
                 
                 # prepare <ADC> data
-                y  = np.array([adcprofile.GetBinContent(ip+1,ich_rs+1) for ip in range(npts)])
-                ye = np.array([adcprofile.GetBinError(ip+1,ich_rs+1) for ip in range(npts)])
+                y  = adc[ich_rs]
+                ye = adcerr[ich_rs]
                 ymax = max(ymax,np.max(y))
                 
                 # plot <ADC> vs. VRef as line and markers with error bars
@@ -237,7 +232,7 @@ class HGCalVRefScan(HGCalCalibration):
             fitres = df_fitres[df_fitres['ierx']==ierx].iloc[0]
             alpha  = fitres['slope']
             beta   = fitres['offset']
-            y      = np.array([adcprofile.GetBinContent(ip+1,int(fitres['ich'])+1) for ip in range(npts)])
+            y      = adc[int(fitres['ich'])]
             if alpha!=-1 and beta!=-1: # valid fit
                 f_lin  = lambda x: alpha*x+beta # linear function
                 x0, x1 = fitres['xmin'], fitres['xmax'] # linear region
@@ -262,7 +257,7 @@ class HGCalVRefScan(HGCalCalibration):
             if icol==0: # left-most column
                 subax.set_ylabel(r"$\langle\mathrm{ADC}\rangle$")
             if irow==(nrows-1) : # bottom row
-                subax.set_xlabel(scaninfo.GetYaxis().GetBinLabel(2))
+                subax.set_xlabel(plotdata['xlabel'])
         
         # finish all eRx subplots
         #for subax in ax.flat: # set again to force
@@ -372,20 +367,38 @@ class HGCalVRefScan(HGCalCalibration):
         pdf.close()
         
     
+    def mergeResult(self, result):
+        """Adds the fitted settings of the module to the correctors and keeps its plot data for producePlotsInParallel."""
+        plotdata = result.pop('PlotData', None)
+        if plotdata is not None:
+            if not hasattr(self, 'plotjobs'):
+                self.plotjobs = [ ]
+            self.plotjobs.append( (result['Typecode'], self.cmdargs, plotdata, result['Fits']) )
+        params = ['ierx',self.scanparam] # parameters to store
+        self.correctors[result['Typecode']] = { param: list(result['Fits'][param]) for param in params }
+        
+    
+    def producePlotsInParallel(self):
+        """Produces the control plots of all modules once the analysis pool is closed (no fork while its threads run)."""
+        if not hasattr(self, 'plotjobs'):
+            return
+        plotter = ProcessPoolExecutor(max_workers=min(4,self.cmdargs.maxThreads))
+        try:
+            jobs = [ plotter.submit(HGCalVRefScan.producePlots, *args) for args in self.plotjobs ]
+            for job in jobs:
+                try:
+                    job.result()
+                except Exception as e:
+                    print(f'>>> HGCalVRefScan: Warning! Control plots failed : {e}')
+        finally:
+            plotter.shutdown()
+        
+    
     def createCorrectionsFile(self, results):
         """Final tweaks of the analysis results to export as JSON."""
-        corr_dict = { }
-        params    = ['ierx',self.scanparam] # parameters to store
-        for res in results:
-            typecode  = res.pop('Typecode')
-            df_fitres = res.pop('Fits')
-            sub_dict  = { }
-            for param in params:
-                parvals = list(df_fitres[param])
-                sub_dict[param] = parvals
-            corr_dict[typecode] = sub_dict
+        self.producePlotsInParallel()
         jsonurl = f'{self.cmdargs.output}/config_params_vref.json'
-        saveAsJson(jsonurl, corr_dict)
+        saveAsJson(jsonurl, self.correctors)
         return jsonurl
         
 
@@ -1,12 +1,14 @@
-import os, re
+import os, re, sys
 import json
 from argparse import ArgumentParser, RawTextHelpFormatter
 
 try:
   from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+  from HGCalCommissioning.LocalCalibration.CalibStore import writeCalibStore
 except ImportError:
   sys.path.append('./python/')
   from JSONEncoder import *
+  from CalibStore import writeCalibStore
 
 def getCalibTemplate(nch) :
   """ builds the default template for the level-0 calibration json file"""
@@ -123,6 +125,9 @@ def main():
   parser.add_argument("-p", "--ped",      default=None, help="Pedestal file default=%(default)r")
   parser.add_argument("-c", "--calpulse", default=None, help="Calpulse file default=%(default)r")
   parser.add_argument("-m", "--mip", default=None, help="MIP file default=%(default)r")
+  parser.add_argument("-s", "--store", default=None, help="also write a sharded store (one file per module) in this directory default=%(default)r")
+  parser.add_argument("--era", default=None, help="era of the calibration (stored in the index of the store) default=%(default)r")
+  parser.add_argument("--runRange", type=int, nargs=2, default=None, help="first and last run of validity (stored in the index of the store) default=%(default)r")
   args = parser.parse_args()
 
   #parse arguments
@@ -138,6 +143,8 @@ def main():
   #build calib dict and save
   level0_calib = buildLevel0CalibParams(input_json)
   saveAsJson(args.output, level0_calib)
+  if not args.store is None:
+    writeCalibStore(level0_calib, args.store, era=args.era, runRange=args.runRange, source=args.output)
   
 if __name__=='__main__':
   main()
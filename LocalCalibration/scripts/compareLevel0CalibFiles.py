@@ -5,6 +5,7 @@
 # Run with
 # python3 compareLevel0CalibFiles.py
 
+import sys
 import json
 import numpy as np
 from scipy import stats
@@ -12,9 +13,14 @@ import re
 import glob
 try:
   from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+  from HGCalCommissioning.LocalCalibration.CalibStore import loadCalib
 except ImportError:
   sys.path.append('./python/')
   from JSONEncoder import *
+  from CalibStore import loadCalib
+
+# parameters used to compare calibration files (only these are read from sharded stores)
+COMPARED_PARAMS = ['ADC_ped','Noise','CM_ped','CM_slope']
 
 
 def PedestalComparison(pedestal1, sigma1, pedestal2, sigma2, useError=False, p_threshold=0.1):
@@ -41,7 +47,7 @@ def loadJson(url : str) -> dict:
     
 def runEraDefinition(calibdir : str, calibfilename : str, pedestal_p_threshold : float = 0.1, outjson : str = 'era_defs.json'):
 
-    # bulid run dictionary {relaynumber : calibration file}
+    # bulid run dictionary {relaynumber : calibration file or store}
     run_dict={}
     for url in glob.glob(f'{calibdir}/*/{calibfilename}'):
         try:
@@ -61,8 +67,8 @@ def runEraDefinition(calibdir : str, calibfilename : str, pedestal_p_threshold :
         #print(f'processing file {new_file}')
         #print(f'referencing {ref_file}')
 
-        ref = loadJson(ref_file)
-        new = loadJson(new_file)
+        ref = loadCalib(ref_file, params=COMPARED_PARAMS)
+        new = loadCalib(new_file, params=COMPARED_PARAMS)
 
         if len(new)==0:
             print(f'Invalid reference candidate {new_file}')
@@ -142,7 +148,7 @@ if __name__ == '__main__':
                         help='output json file=%(default)s',
                         default='era_defs.json', type=str)
     parser.add_argument("-c", "--calibfilename",
-                        help='calibration file name=%(default)s',
+                        help='calibration file (or sharded store) name=%(default)s',
                         default='level0_calib_params.json', type=str)
     parser.add_argument("-p", "--minPval",
                         help='min p-val allowed to consider files equivalent=%(default)s',
@@ -0,0 +1,94 @@
+# Merges the per lumi section pedestal moments written by the online DQM (HGCalSysValDigisHarvester, PedestalSnapshotDir)
+# into a level-0 pedestals json with the same format as the one produced by HGCalPedestals.py --fromNZSsampling.
+# The snapshots only contain sums so they can be merged in any order and for any subset of lumi sections.
+# Run with
+# python3 scripts/mergeDQMPedestalSnapshots.py -i /path/to/snapshots -r RUN -o pedestals.json
+import os
+import sys
+import re
+import glob
+import numpy as np
+import ROOT
+import DigiAnalysisUtils as DAU
+from HGCalPedestals import HGCalPedestals
+try:
+  from HGCalCommissioning.LocalCalibration.JSONEncoder import *
+except ImportError:
+  sys.path.append('./python/')
+  from JSONEncoder import *
+
+
+def listSnapshots(inputs : list, run : int = None, lumiRange : list = None) -> list:
+    """lists the snapshot files in the inputs (files or directories), optionally restricted to a run and a lumi section range"""
+
+    urls = []
+    for i in inputs:
+        urls += sorted(glob.glob(f'{i}/pedestal_moments_run*_ls*.root')) if os.path.isdir(i) else [i]
+
+    selected = []
+    for url in urls:
+        m = re.findall(r'pedestal_moments_run(\d+)_ls(\d+).root', os.path.basename(url))
+        if len(m)==0: continue
+        irun, ilumi = int(m[0][0]), int(m[0][1])
+        if run is not None and irun!=run: continue
+        if lumiRange is not None and (ilumi<lumiRange[0] or ilumi>lumiRange[1]): continue
+        selected.append(url)
+    return selected
+
+
+def mergeSnapshots(urls : list) -> dict:
+    """sums the moments of each module over the snapshots as {typecode: {term: array of channels}}"""
+
+    merged = {}
+    for url in urls:
+        fIn = ROOT.TFile.Open(url)
+        for key in fIn.GetListOfKeys():
+            h = key.ReadObj()
+            if not h.InheritsFrom('TH2'): continue
+            # the typecodes are kept with _ (as in the DQM object names) which is how the pedestals files are keyed
+            typecode = h.GetName()
+            terms = [h.GetYaxis().GetBinLabel(i+1) for i in range(h.GetNbinsY())]
+            sums = DAU.histToArray(h)
+            if not typecode in merged:
+                merged[typecode] = { term : np.zeros(sums.shape[1]) for term in terms }
+            for term, s in zip(terms, sums):
+                merged[typecode][term] += s
+        fIn.Close()
+    return merged
+
+
+def createPedestalsFile(merged : dict, jsonurl : str) -> str:
+    """derives the pedestals from the merged moments and stores them as in HGCalPedestals"""
+
+    correctors = {}
+    for typecode, sums in merged.items():
+        n = sums.pop('n')
+        moments = DAU.momentsFromSums(n, sums)
+        pedestals_dict = HGCalPedestals.pedestalsFromMoments(typecode, moments)
+        correctors[pedestals_dict.pop('Typecode')] = pedestals_dict
+    saveAsJson(jsonurl, correctors)
+    return jsonurl
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", nargs='+', required=True,
+                        help='snapshot files or directories with the snapshots=%(default)s')
+    parser.add_argument("-r", "--run", type=int, default=None,
+                        help='only use snapshots of this run=%(default)s')
+    parser.add_argument("--lumiRange", type=int, nargs=2, default=None,
+                        help='first and last lumi section to use=%(default)s')
+    parser.add_argument("-o", "--output", default='pedestals.json',
+                        help='output json file=%(default)s')
+    args = parser.parse_args()
+
+    urls = listSnapshots(args.input, args.run, args.lumiRange)
+    if len(urls)==0:
+        print(f'No pedestal snapshots found in {args.input}')
+        sys.exit(-1)
+
+    merged = mergeSnapshots(urls)
+    jsonurl = createPedestalsFile(merged, args.output)
+    print(f'Pedestals of {len(merged)} modules from {len(urls)} snapshots stored in {jsonurl}')
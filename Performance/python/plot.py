@@ -10,6 +10,7 @@ np.finfo(np.dtype('float32')) # stop warnings
 np.finfo(np.dtype('float64'))
 import matplotlib.pyplot as plt
 from datetime import datetime
+from HGCalCommissioning.Performance.throughput import parselog
 
 # GLOBAL SETTINGS
 lsize  = 20
@@ -31,35 +32,8 @@ rlabel = "Throughput [evts/s]"
 
 def parsefile(fname):
   """Parse comma-separated columns from ThroughputService."""
-  nevts = [ ]
-  timestamps = [ ]
-  dts = [ ]
-  location = 'header'
-  with open(fname,'r') as file:
-    for line in file:
-      if 'ThroughputService' in line:
-        location = 'middle'
-        continue
-      elif not location=='middle':
-        continue
-      columns = line.strip().split(', ')
-      if len(columns)!=2:
-        location = 'tail'
-        break
-      nevts_str, timestamp = columns
-      nevts.append(int(nevts_str))
-      timestamps.append(datetime.strptime(timestamp,'%d-%b-%Y %H:%M:%S.%f %Z'))
-  
-  if len(nevts)==0:
-    print(f">>> WARNING! No data found in {fname}! (location={location}!r)")
-  else:
-    # convert timestamps to time differences (dt) relative to the first timestamp
-    ts0 = timestamps[0]
-    dts = [(ts-ts0).total_seconds() for ts in timestamps]
-  
-  #print(nevts)
-  #print(dt)
-  return (dts,nevts)
+  dts, nevts = parselog(fname)
+  return (dts.tolist(),nevts.tolist())
   
 
 def getrate(x,y):
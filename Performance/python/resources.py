@@ -0,0 +1,176 @@
+# Sources:
+#   https://twiki.cern.ch/twiki/bin/viewauth/CMS/FastTimerService
+#   HLTrigger/Timer/plugins/FastTimerService.cc (writeSummaryJSON)
+# Instructions:
+#   from HGCalCommissioning.Performance.resources import *
+#   modules = loadresources("resources_RECO_scale1_nthread4_fullchain_try1.json")
+#   printranking(rankmodules(modules,'time_real'))
+import os, re
+import json
+import glob
+
+metrics = { # resources written by FastTimerService, converted to per-event quantities
+  'time_real':   "Real time [ms/evt]",
+  'time_thread': "CPU time [ms/evt]",
+  'mem_alloc':   "Allocated memory [kB/evt]",
+  'mem_free':    "Freed memory [kB/evt]",
+}
+
+
+def loadresources(fname):
+  """Load the per-module resources from a FastTimerService JSON summary.
+  Returns a dict of label -> { type, events, <metric>, <metric>_per_evt }, including the 'total' of the job."""
+  with open(fname,'r') as infile:
+    data = json.load(infile)
+  modules = { }
+  entries = list(data.get('modules',[ ]))
+  if 'total' in data:
+    entries.append(dict(data['total'],label='total',type=data['total'].get('type','Job')))
+  for entry in entries:
+    label  = entry.get('label',entry.get('type','unknown'))
+    events = entry.get('events',0) or data.get('total',{ }).get('events',0)
+    module = { 'label': label, 'type': entry.get('type',''), 'events': events }
+    for m in metrics:
+      value = float(entry.get(m,0.))
+      module[m] = value
+      module[f"{m}_per_evt"] = value/events if events>0 else 0.
+    if label in modules: # same label (e.g. different processes): sum
+      for m in metrics:
+        modules[label][m] += module[m]
+        modules[label][f"{m}_per_evt"] += module[f"{m}_per_evt"]
+    else:
+      modules[label] = module
+  return modules
+
+
+def rankmodules(modules,metric='time_real',ntop=None,skiptotal=True):
+  """Rank modules by a per-event metric, adding the fraction of the job total."""
+  total = modules.get('total',{ }).get(f"{metric}_per_evt",0.)
+  ranked = [ ]
+  for label, module in modules.items():
+    if skiptotal and label=='total':
+      continue
+    value = module[f"{metric}_per_evt"]
+    ranked.append(dict(module,metric=metric,value=value,fraction=(value/total if total>0 else 0.)))
+  ranked.sort(key=lambda r: -r['value'])
+  return ranked[:ntop] if ntop else ranked
+
+
+def loadpluginpackages(basedirs=None):
+  """Map plugin (C++ type) names to the library (Subsystem+Package) that defines them,
+  using the .edmplugincache files of the local area and the release."""
+  if basedirs is None:
+    arch = os.environ.get('SCRAM_ARCH','*')
+    basedirs = [os.path.join(os.environ[v],'lib',arch) for v in ['CMSSW_BASE','CMSSW_RELEASE_BASE'] if v in os.environ]
+  rexp_lib = re.compile(r"^(?:plugin)?(\w+?)(?:Plugins?|_\w+)?\.so$")
+  packages = { }
+  for basedir in basedirs[::-1]: # local area overrides release
+    for cache in glob.glob(os.path.join(basedir,'.edmplugincache')):
+      with open(cache,'r') as infile:
+        for line in infile:
+          cells = line.split()
+          if len(cells)<2: continue
+          match = rexp_lib.match(cells[0])
+          packages[cells[1]] = match.group(1) if match else cells[0]
+  return packages
+
+
+def loadgroups(fname):
+  """Load user groups (e.g. sequences or packages) as JSON { group: [ regexp matching label or type, ... ] }."""
+  with open(fname,'r') as infile:
+    groups = json.load(infile)
+  return [ (group,[re.compile(p) for p in patterns]) for group, patterns in groups.items() ]
+
+
+def getgroup(module,groups=None,packages=None):
+  """Get the group of a module: first matching user group, then plugin package, then the module type."""
+  for group, patterns in (groups or [ ]):
+    if any(p.search(module['label']) or p.search(module['type']) for p in patterns):
+      return group
+  if packages and module['type'] in packages:
+    return packages[module['type']]
+  return module['type'] or module['label']
+
+
+def aggregate(modules,groups=None,packages=None):
+  """Aggregate per-event resources by group (package, sequence, ...)."""
+  aggr = { }
+  for label, module in modules.items():
+    if label=='total':
+      continue
+    group = getgroup(module,groups=groups,packages=packages)
+    entry = aggr.setdefault(group,dict({ 'label': group, 'type': 'group', 'events': module['events'], 'nmodules': 0 },
+                                       **{ f"{m}_per_evt": 0. for m in metrics },**{ m: 0. for m in metrics }))
+    entry['nmodules'] += 1
+    for m in metrics:
+      entry[m] += module[m]
+      entry[f"{m}_per_evt"] += module[f"{m}_per_evt"]
+  if 'total' in modules:
+    aggr['total'] = modules['total']
+  return aggr
+
+
+def diffresources(refmods,newmods,metric='time_real',threshold=0.1,minabs=0.01):
+  """Compare per-event resources of two reports per module (or group).
+  A module is flagged as regression if it grows by more than the relative threshold
+  and by more than minabs (in ms/evt or kB/evt)."""
+  diffs = [ ]
+  key = f"{metric}_per_evt"
+  for label in sorted(set(refmods)|set(newmods)):
+    ref = refmods.get(label,{ }).get(key,None)
+    new = newmods.get(label,{ }).get(key,None)
+    delta = (new or 0.)-(ref or 0.)
+    ratio = new/ref if (ref and new is not None) else float('nan')
+    if ref is None:
+      status = 'new'
+    elif new is None:
+      status = 'removed'
+    elif delta>minabs and (ref<=0 or delta/ref>threshold):
+      status = 'regression'
+    elif -delta>minabs and ref>0 and -delta/ref>threshold:
+      status = 'improvement'
+    else:
+      status = 'ok'
+    diffs.append({ 'label': label, 'type': (newmods.get(label) or refmods.get(label))['type'], 'metric': metric,
+                   'ref': ref, 'new': new, 'delta': delta, 'ratio': ratio, 'status': status })
+  diffs.sort(key=lambda d: -d['delta'])
+  return diffs
+
+
+def printranking(ranked,ntop=None):
+  """Print ranking table."""
+  if not ranked:
+    return
+  metric = ranked[0]['metric']
+  print(f">>> {'label':<40} {'type':<36} {metrics[metric]:>26} {'fraction':>9}")
+  for r in ranked[:ntop] if ntop else ranked:
+    print(f">>> {r['label']:<40} {r['type']:<36} {r['value']:26.3f} {100*r['fraction']:8.2f}%")
+
+
+def printdiff(diffs,onlyflagged=False):
+  """Print diff table."""
+  if not diffs:
+    return
+  metric = diffs[0]['metric']
+  print(f">>> {'label':<40} {'reference':>12} {'new':>12} {'delta':>10} {'ratio':>7}  {'status'}  ({metrics[metric]})")
+  for d in diffs:
+    if onlyflagged and d['status'] in ['ok']:
+      continue
+    ref = f"{d['ref']:12.3f}" if d['ref'] is not None else f"{'-':>12}"
+    new = f"{d['new']:12.3f}" if d['new'] is not None else f"{'-':>12}"
+    print(f">>> {d['label']:<40} {ref} {new} {d['delta']:10.3f} {d['ratio']:7.3f}  {d['status']}")
+
+
+def writecsv(rows,fname):
+  """Write list of dicts as CSV table."""
+  import csv
+  if not rows:
+    return fname
+  columns = list(rows[0].keys())
+  with open(fname,'w',newline='') as outfile:
+    writer = csv.DictWriter(outfile,fieldnames=columns,extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+  print(f">>> Created {fname}")
+  return fname
+
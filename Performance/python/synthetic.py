@@ -0,0 +1,276 @@
+# Sources:
+#   SystemTestEventFilters/interface/HGCalSlinkFromRaw/*.h (record, S-link and capture block headers)
+#   EventFilter/HGCalRawToDigi/src/HGCalUnpacker.cc (ECON-D packet parsing)
+# Instructions:
+#   from HGCalCommissioning.Performance.synthetic import *
+#   layout = buildlayout(nmodules=60,hdfrac=0.2)
+#   writesyntheticrun(layout,"synthetic/",nevents=10000,occupancy=0.05,model='shower')
+# Synthetic S-link data for stress-testing the unpacker with realistic occupancy variations.
+# ECON-D packets are written in characterization mode (32 bits per channel: TcTp, ADC, TOT, TOA),
+# with zero-suppression applied through the eRx channel map, so the payload size varies per event.
+import os
+import json
+import numpy as np
+
+# RECORD HEADER (see RecordHeader.h, FsmState.h)
+REC_STATEDATA = 0x33 # pattern expected in all the record headers (see RecordHeader::validPattern)
+FSM_RUNNING   = 5
+FSM_STARTING  = 10
+FSM_STOPPING  = 13
+MAXRECORDLEN  = 0xfff # maximum payload length of a record in 64-bit words
+
+# MARKERS
+SLINK_BOE  = 0x55
+SLINK_EOE  = 0xaa
+CB_MARKER  = 0x7f
+ECOND_MARKER = 0x154
+ECOND_NORMAL   = 0b000
+ECOND_INACTIVE = 0b111
+
+# MODULE TYPES: number of eRx per module and typecode prefix
+NCHPERERX = 37
+MAXECONDPERCB = 12
+MAXCBPERFED = 10
+moduletypes = {
+  'LD': { 'nerx': 6,  'prefix': 'ML-F3PT-SY' },
+  'HD': { 'nerx': 12, 'prefix': 'MH-F3PT-SY' },
+}
+
+
+def buildlayout(nmodules,hdfrac=0.,econdspercb=3,cbsperfed=4,modsperplane=None,firstfed=0,seed=42):
+  """Distribute nmodules (randomly LD or HD) over capture blocks and FEDs.
+  Returns a list of dicts, one per module, in the readout order of each FED."""
+  if not 1<=econdspercb<=MAXECONDPERCB:
+    raise ValueError(f"econdspercb={econdspercb} must be in [1,{MAXECONDPERCB}]")
+  if not 1<=cbsperfed<MAXCBPERFED: # keep one capture block for padding
+    raise ValueError(f"cbsperfed={cbsperfed} must be in [1,{MAXCBPERFED-1}]")
+  rng = np.random.default_rng(seed)
+  ishd = rng.random(nmodules)<hdfrac
+  modsperfed = econdspercb*cbsperfed
+  if modsperplane is None:
+    modsperplane = modsperfed
+  layout = [ ]
+  for imod in range(nmodules):
+    mtype = 'HD' if ishd[imod] else 'LD'
+    ifed, islot = divmod(imod,modsperfed)
+    icb, iecond = divmod(islot,econdspercb)
+    iplane, ipos = divmod(imod,modsperplane)
+    layout.append({
+      'typecode': f"{moduletypes[mtype]['prefix']}{imod:04d}",
+      'type':     mtype,
+      'nerx':     moduletypes[mtype]['nerx'],
+      'fedid':    firstfed+ifed,
+      'captureblock': icb,
+      'econdidx': iecond,
+      'plane':    iplane+1,
+      'u':        ipos//8,
+      'v':        ipos%8,
+      'irot':     0,
+      'zside':    1,
+    })
+  return layout
+
+
+def writemodulelocator(layout,fname):
+  """Write module locator in the format of Configuration/data/ModuleMaps (see also utils.scaleModMap)."""
+  with open(fname,'w') as outfile:
+    outfile.write("plane u v irot typecode econdidx captureblock captureblockidx slinkidx fedid zside\n")
+    for mod in layout:
+      outfile.write(f"{mod['plane']} {mod['u']} {mod['v']} {mod['irot']} {mod['typecode']} {mod['econdidx']}"
+                    f" {mod['captureblock']} {mod['captureblock']} {mod['fedid']} {mod['fedid']} {mod['zside']}\n")
+  return fname
+
+
+def writefedconfig(layout,fname):
+  """Write FED configuration JSON for HGCalConfigurationESProducer (see LocalCalibration/data/explanations)."""
+  config = { }
+  for mod in layout:
+    fed = config.setdefault(str(mod['fedid']),{
+      "mismatchPassthroughMode": 0,
+      "cbHeaderMarker":    hex(CB_MARKER),
+      "slinkHeaderMarker": hex(SLINK_BOE),
+      "econds": [ ],
+    })
+    fed['econds'].append(mod['typecode'])
+  with open(fname,'w') as outfile:
+    json.dump(config,outfile,indent=2)
+  return fname
+
+
+def writemodconfig(layout,fname):
+  """Write ECON-D configuration JSON for HGCalConfigurationESProducer (see LocalCalibration/data/explanations)."""
+  config = { }
+  for mod in layout:
+    config[mod['typecode']] = {
+      "headerMarker":  hex(ECOND_MARKER),
+      "passthroughMode": 0,
+      "Gain":          [1]*mod['nerx'],
+      "characMode":    1,
+      "CalibrationSC": [0]*mod['nerx'],
+    }
+  with open(fname,'w') as outfile:
+    json.dump(config,outfile,indent=2)
+  return fname
+
+
+def recordheader(identifier,state,length,utc):
+  """64-bit record header."""
+  return (identifier<<56) | (state<<48) | ((length&MAXRECORDLEN)<<32) | (utc&0xffffffff)
+
+
+def getoccupancies(layout,nplanes,rng,occupancy=0.05,model='fixed',showerocc=0.5,showerwidth=2.):
+  """Per-module channel occupancy of one event.
+  'fixed':   same occupancy for all modules and events,
+  'gamma':   event-by-event fluctuation of the occupancy per module (gamma distribution with mean occupancy),
+  'shower':  noise floor plus a longitudinal shower profile around a random depth."""
+  nmods = len(layout)
+  if model=='fixed':
+    occ = np.full(nmods,occupancy)
+  elif model=='gamma':
+    occ = rng.gamma(4.,occupancy/4.,size=nmods)
+  elif model=='shower':
+    planes = np.array([m['plane'] for m in layout],dtype=float)
+    tmax = rng.uniform(1,nplanes)
+    occ  = occupancy+showerocc*rng.uniform(0.2,1.)*np.exp(-0.5*((planes-tmax)/showerwidth)**2)
+  else:
+    raise ValueError(f"Unknown occupancy model {model!r}")
+  return np.clip(occ,0.,1.)
+
+
+def buildchannelwords(nchans,rng,ped=100.,noise=3.,mip=40.,totfrac=0.05,toafrac=0.5):
+  """Characterization-mode 32-bit channel words (TcTp[31:30], ADC[29:20], TOT[19:10], TOA[9:0]).
+  A fraction totfrac of the hits is in TOT mode (TcTp=0b11), the others carry an ADC signal."""
+  istot = rng.random(nchans)<totfrac
+  adc   = ped+noise*rng.standard_normal(nchans)+rng.lognormal(np.log(mip),0.5,size=nchans)
+  adc   = np.clip(np.rint(adc),0,1023).astype(np.uint32)
+  adc[istot] = np.clip(np.rint(ped+noise*rng.standard_normal(istot.sum())),0,1023).astype(np.uint32)
+  tot   = np.where(istot,rng.integers(50,1024,size=nchans),0).astype(np.uint32)
+  toa   = np.where(istot | (rng.random(nchans)<toafrac),rng.integers(1,1024,size=nchans),0).astype(np.uint32)
+  tctp  = np.where(istot,0b11,0b00).astype(np.uint32)
+  return (tctp<<30) | (adc<<20) | (tot<<10) | toa
+
+
+def buildecond(nerx,hits,words,cms,bx,ev,orbit):
+  """Build one ECON-D packet as 32-bit words: 2 header words, per eRx 2 header words and the channel words
+  of the channels set in the channel map, and a trailing CRC word."""
+  payload = [ ]
+  for ierx in range(nerx):
+    chmap = int(np.dot(hits[ierx].astype(np.uint64),np.uint64(1)<<np.arange(NCHPERERX,dtype=np.uint64)))
+    cm0, cm1 = int(cms[ierx,0]), int(cms[ierx,1])
+    payload.append(np.array([ (cm0<<15) | (cm1<<5) | (chmap>>32), chmap&0xffffffff ],dtype=np.uint32))
+    payload.append(words[ierx][hits[ierx]])
+  payload.append(np.zeros(1,dtype=np.uint32)) # CRC
+  payload = np.concatenate(payload)
+  length = len(payload)
+  if length>0x1ff:
+    raise ValueError(f"ECON-D payload of {length} words exceeds the 9-bit length field")
+  header = np.array([
+    (ECOND_MARKER<<23) | (length<<14),
+    ((bx&0xfff)<<20) | ((ev&0x3f)<<14) | ((orbit&0x7)<<11),
+  ],dtype=np.uint32)
+  return np.concatenate([header,payload])
+
+
+def pack64(words32):
+  """Pack 32-bit words into 64-bit words, the first 32-bit word in the most significant half (padding to 64 bits)."""
+  if len(words32)%2==1:
+    words32 = np.append(words32,np.uint32(0))
+  pairs = words32.reshape(-1,2).astype(np.uint64)
+  return (pairs[:,0]<<np.uint64(32)) | pairs[:,1]
+
+
+def buildfedevent(fedmods,fedid,evtid,bx,orbit,occ,rng,**kwargs):
+  """Build the payload of a RecordRunning for a FED: S-link BOE, capture blocks with ECON-D packets, S-link EOE."""
+  ev = evtid&0x3f
+  blocks = [ ]
+  cbs = { }
+  for imod, mod in enumerate(fedmods):
+    cbs.setdefault(mod['captureblock'],[ ]).append((imod,mod))
+  for icb in sorted(cbs):
+    status = 0
+    for iecond in range(MAXECONDPERCB):
+      status |= ECOND_INACTIVE<<(3*iecond)
+    packets = [ ]
+    for imod, mod in sorted(cbs[icb],key=lambda x: x[1]['econdidx']):
+      status &= ~(0x7<<(3*mod['econdidx']))
+      status |= ECOND_NORMAL<<(3*mod['econdidx'])
+      nerx  = mod['nerx']
+      hits  = rng.random((nerx,NCHPERERX))<occ[imod]
+      words = buildchannelwords(nerx*NCHPERERX,rng,**kwargs).reshape(nerx,NCHPERERX)
+      cms   = np.clip(np.rint(kwargs.get('ped',100.)+2*rng.standard_normal((nerx,2))),0,1023).astype(np.uint32)
+      packets.append(pack64(buildecond(nerx,hits,words,cms,bx,ev,orbit)))
+    cbheader = (CB_MARKER<<57) | ((bx&0xfff)<<45) | (ev<<39) | ((orbit&0x7)<<36) | status
+    blocks.append(np.array([cbheader],dtype=np.uint64))
+    blocks.extend(packets)
+  body = np.concatenate(blocks) if blocks else np.zeros(0,dtype=np.uint64)
+  if len(body)%2==1: # 128-bit structure: pad with an empty capture block (all ECON-Ds inactive)
+    empty = (CB_MARKER<<57) | ((bx&0xfff)<<45) | (ev<<39) | ((orbit&0x7)<<36)
+    for iecond in range(MAXECONDPERCB):
+      empty |= ECOND_INACTIVE<<(3*iecond)
+    body = np.append(body,np.uint64(empty))
+  length = len(body)+4
+  boe = np.array([ (1<<32) | fedid, (SLINK_BOE<<56) | (3<<52) | evtid ],dtype=np.uint64)
+  eoe = np.array([ ((orbit&0xffffffff)<<32), (SLINK_EOE<<56) | ((length//2)<<12) | (bx&0xfff) ],dtype=np.uint64)
+  payload = np.concatenate([boe,body,eoe])
+  if len(payload)>MAXRECORDLEN:
+    raise ValueError(f"Event of FED {fedid} has {len(payload)} 64-bit words > {MAXRECORDLEN}:"
+                     f" reduce the number of modules per FED or the occupancy")
+  return payload
+
+
+def writesyntheticrun(layout,outdir,run=1,nevents=1000,occupancy=0.05,model='fixed',seed=42,verb=0,**kwargs):
+  """Write one S-link .bin file per FED (RecordStarting, RecordRunning per event, RecordStopping),
+  the matching module locator, FED and ECON-D configuration, and a JSON manifest with all the outputs."""
+  os.makedirs(outdir,exist_ok=True)
+  feds = sorted(set(m['fedid'] for m in layout))
+  nplanes = max(m['plane'] for m in layout)
+  fedmods = { f: [m for m in layout if m['fedid']==f] for f in feds }
+  fedimod = { f: np.array([i for i, m in enumerate(layout) if m['fedid']==f]) for f in feds }
+  fnames = { f: os.path.join(outdir,f"Run{run}_Link{f}_File0000000000.bin") for f in feds }
+  outfiles = { f: open(fnames[f],'wb') for f in feds }
+  rng = np.random.default_rng(seed)
+  utc = run&0xffffffff
+  nwords = { f: 0 for f in feds }
+  try:
+    for f in feds: # RecordStarting
+      start = np.array([ recordheader(REC_STATEDATA,FSM_STARTING,2,utc), (nevents<<32) | run, 0 ],dtype=np.uint64)
+      outfiles[f].write(start.astype('<u8').tobytes())
+    orbit = 0
+    for ievt in range(nevents): # RecordRunning
+      evtid = ievt+1
+      orbit += int(rng.integers(1,5)) # E/B/O counters must be identical for all FEDs
+      bx = int(rng.integers(1,3565))
+      occ = getoccupancies(layout,nplanes,rng,occupancy=occupancy,model=model)
+      for f in feds:
+        payload = buildfedevent(fedmods[f],f,evtid,bx,orbit,occ[fedimod[f]],rng,**kwargs)
+        header  = np.array([recordheader(REC_STATEDATA,FSM_RUNNING,len(payload),utc+ievt)],dtype=np.uint64)
+        outfiles[f].write(np.concatenate([header,payload]).astype('<u8').tobytes())
+        nwords[f] += len(payload)
+      if verb>=1 and evtid%1000==0:
+        print(f">>> writesyntheticrun: {evtid}/{nevents} events written")
+    for f in feds: # RecordStopping
+      stop = np.array([ recordheader(REC_STATEDATA,FSM_STOPPING,3,utc+nevents), (nevents<<32) | run, 0,
+                        0xdeaddead00000000 ],dtype=np.uint64)
+      outfiles[f].write(stop.astype('<u8').tobytes())
+  finally:
+    for outfile in outfiles.values():
+      outfile.close()
+  manifest = {
+    'run':       run,
+    'nevents':   nevents,
+    'fedIds':    feds,
+    'files':     [fnames[f] for f in feds],
+    'modules':   writemodulelocator(layout,os.path.join(outdir,"modulelocator_synthetic.txt")),
+    'fedconfig': writefedconfig(layout,os.path.join(outdir,"config_feds_synthetic.json")),
+    'modconfig': writemodconfig(layout,os.path.join(outdir,"config_econds_synthetic.json")),
+    'occupancy': occupancy,
+    'model':     model,
+    'avgEventSize': { str(f): 8.*nwords[f]/max(nevents,1) for f in feds }, # in bytes
+  }
+  mfname = os.path.join(outdir,"manifest.json")
+  with open(mfname,'w') as outfile:
+    json.dump(manifest,outfile,indent=2)
+  if verb>=1:
+    print(f">>> writesyntheticrun: Written {len(feds)} FEDs x {nevents} events to {outdir}")
+  return mfname
+
@@ -0,0 +1,213 @@
+# Sources:
+#   HLTrigger/Timer/plugins/ThroughputService.cc
+#   HLTrigger/Timer/plugins/FastTimerService.cc
+# Instructions:
+#   from HGCalCommissioning.Performance.throughput import *
+#   result = analyzelog("ThroughputService_RECO_scale30_nthread4_try1.log",nthreads=4,scale=30)
+import os, re
+import json
+import numpy as np
+import xml.etree.ElementTree as ET
+
+rexp_fname = re.compile(r"ThroughputService_(?P<proc>.*)_scale(?P<scale>.*)_nthreads?(?P<nthread>\d+)(?P<label>.*).log$")
+rexp_line  = re.compile(r"^\s*(\d+), (\d{1,2})-(\w{3})-(\d{4}) (\d{2}:\d{2}:\d{2}(?:\.\d+)?)(?: \w+)?\s*$",re.MULTILINE)
+months = { m: f"{i+1:02d}" for i, m in enumerate(['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']) }
+columns = [ # columns of the summary table
+  'fname','proc','scale','nthreads','label','nevts','runtime',
+  'tstart','tstop','nevts_steady','rate','rate_lo','rate_hi','ms_per_evt',
+  'cputime','cpueff','scaleff_threads','scaleff_feds',
+]
+
+
+def parselog(fname):
+  """Parse comma-separated "nevts, timestamp" columns from ThroughputService in one go.
+  Returns numpy arrays with the time since the first timestamp [s] and the number of events."""
+  with open(fname,'r') as file:
+    text = file.read()
+  ipos = text.find('ThroughputService')
+  if ipos>=0: # skip header
+    text = text[text.find('\n',ipos)+1:]
+  rows = rexp_line.findall(text)
+  if len(rows)==0:
+    print(f">>> parselog: WARNING! No data found in {fname}!")
+    return np.zeros(0), np.zeros(0,dtype=np.int64)
+  rows = np.array(rows) # shape (N,5): nevts, day, month, year, time
+  nevts = rows[:,0].astype(np.int64)
+  isots = np.char.add(np.char.add(np.char.add(rows[:,3],'-'),np.vectorize(months.get)(rows[:,2])),'-')
+  isots = np.char.add(np.char.add(np.char.add(isots,np.char.zfill(rows[:,1],2)),'T'),rows[:,4])
+  times = isots.astype('datetime64[us]')
+  dts = (times-times[0]).astype(np.float64)*1e-6
+  return dts, nevts
+
+
+def parsefname(fname):
+  """Parse process, scale, number of threads and label from the ThroughputService log file name."""
+  match = rexp_fname.match(os.path.basename(fname))
+  if not match:
+    return { }
+  return {
+    'proc':     match.group('proc'),
+    'scale':    int(match.group('scale')),
+    'nthreads': int(match.group('nthread')),
+    'label':    match.group('label'),
+  }
+
+
+def findsteadystate(dts,nevts,frac=0.9,nsmooth=5):
+  """Find the steady-state window [imin,imax] by excluding the warm-up and tail regions:
+  the (smoothed) instantaneous rate must be within frac of the median rate of the central part."""
+  npts = len(dts)
+  if npts<=3:
+    return 0, max(npts-1,0)
+  dt = np.diff(dts)
+  dn = np.diff(nevts).astype(np.float64)
+  dt[dt<=0] = np.nan
+  rates = dn/dt
+  if nsmooth>=2 and len(rates)>=nsmooth: # running average to suppress jitter of single intervals
+    kernel = np.ones(nsmooth)/nsmooth
+    valid  = np.isfinite(rates)
+    rates  = np.convolve(np.where(valid,rates,0),kernel,'same')/np.maximum(np.convolve(valid,kernel,'same'),1e-9)
+  nint = len(rates)
+  central = rates[nint//4:max(nint*3//4,nint//4+1)]
+  ref = np.nanmedian(central)
+  if not np.isfinite(ref) or ref<=0:
+    return 0, npts-1
+  good = np.where(rates>=frac*ref)[0]
+  if len(good)==0:
+    return 0, npts-1
+  return int(good[0]), int(good[-1])+1 # point indices bounding the intervals
+
+
+def bootstraprate(dts,nevts,imin=0,imax=None,nboot=1000,cl=0.68,seed=42):
+  """Compute the rate in the window [imin,imax] and a bootstrap confidence interval,
+  resampling the time intervals between the ThroughputService snapshots."""
+  if imax is None:
+    imax = len(dts)-1
+  dt = np.diff(dts[imin:imax+1])
+  dn = np.diff(nevts[imin:imax+1]).astype(np.float64)
+  if len(dt)==0 or dt.sum()<=0:
+    return np.nan, np.nan, np.nan
+  rate = dn.sum()/dt.sum()
+  if len(dt)==1 or nboot<=0:
+    return rate, rate, rate
+  rng  = np.random.default_rng(seed)
+  idx  = rng.integers(0,len(dt),size=(nboot,len(dt)))
+  boot = dn[idx].sum(axis=1)/dt[idx].sum(axis=1)
+  alpha = (1.-cl)/2.
+  lo, hi = np.quantile(boot,[alpha,1.-alpha])
+  return rate, lo, hi
+
+
+def getcputime(fname):
+  """Get (CPU time, wallclock time) in seconds from a FastTimerService resources JSON,
+  a FrameworkJobReport XML or a job report JSON built by jobReportBuilder.py.
+  FastTimerService only provides the CPU time: its total time_real is summed over events,
+  i.e. ~ wallclock x nthreads in multi-threaded jobs, so the wallclock time is returned as NaN."""
+  if fname is None or not os.path.isfile(fname):
+    return np.nan, np.nan
+  if fname.endswith('.xml'):
+    metrics = { }
+    try:
+      for event, elem in ET.iterparse(fname):
+        if elem.tag=='Metric' and elem.get('Name') in ['TotalJobCPU','TotalJobTime']:
+          metrics[elem.get('Name')] = float(elem.get('Value'))
+    except ET.ParseError as e:
+      print(f">>> getcputime: WARNING! Could not parse {fname}: {e}")
+    return metrics.get('TotalJobCPU',np.nan), metrics.get('TotalJobTime',np.nan)
+  with open(fname,'r') as file:
+    data = json.load(file)
+  if 'total' in data: # FastTimerService (in ms)
+    total = data['total']
+    return total.get('time_thread',np.nan)*1e-3, np.nan
+  if 'JobReport' in data: # jobReportBuilder (sum over steps)
+    report = data['JobReport']
+    return sum(float(x) for x in report['TotalJobCPU']), sum(float(x) for x in report['TotalJobTime'])
+  return np.nan, np.nan
+
+
+def analyzelog(fname,nthreads=None,scale=None,cpufname=None,frac=0.9,nboot=1000,cl=0.68,verb=0):
+  """Analyze single ThroughputService log: steady-state rate with confidence interval
+  and CPU efficiency per thread (if a CPU time source is given)."""
+  result = dict.fromkeys(columns,np.nan)
+  result.update({ 'fname': fname, 'proc': '', 'label': '' })
+  result.update(parsefname(fname))
+  if nthreads is not None:
+    result['nthreads'] = nthreads
+  if scale is not None:
+    result['scale'] = scale
+  dts, nevts = parselog(fname)
+  if len(dts)<2:
+    return result
+  imin, imax = findsteadystate(dts,nevts,frac=frac)
+  rate, lo, hi = bootstraprate(dts,nevts,imin,imax,nboot=nboot,cl=cl)
+  result.update({
+    'nevts':        int(nevts[-1]),
+    'runtime':      dts[-1],
+    'tstart':       dts[imin],
+    'tstop':        dts[imax],
+    'nevts_steady': int(nevts[imax]-nevts[imin]),
+    'rate':         rate,
+    'rate_lo':      lo,
+    'rate_hi':      hi,
+    'ms_per_evt':   1e3/rate if rate>0 else np.nan,
+  })
+  cputime, walltime = getcputime(cpufname)
+  if np.isfinite(cputime):
+    if not np.isfinite(walltime) or walltime<=0:
+      walltime = dts[-1]
+    result['cputime'] = cputime
+    result['cpueff']  = cputime/(walltime*max(result['nthreads'],1)) if np.isfinite(result['nthreads']) else np.nan
+  if verb>=1:
+    print(f">>> analyzelog: {fname}: {rate:.1f} [{lo:.1f},{hi:.1f}] evts/s in t=[{dts[imin]:.1f},{dts[imax]:.1f}] s")
+  return result
+
+
+def addscaling(results):
+  """Add scaling efficiencies w.r.t. the configuration with the fewest threads (same proc, label and scale),
+  and w.r.t. the smallest FED scale (same proc, label and nthreads).
+  The FED scaling efficiency compares the data throughput, i.e. rate x scale."""
+  def _group(keys):
+    groups = { }
+    for res in results:
+      groups.setdefault(tuple(res[k] for k in keys),[ ]).append(res)
+    return groups.values()
+  for group in _group(['proc','label','scale']):
+    ref = min(group,key=lambda r: r['nthreads'])
+    for res in group:
+      if ref['rate']>0 and ref['nthreads']>0:
+        res['scaleff_threads'] = (res['rate']/ref['rate'])/(res['nthreads']/ref['nthreads'])
+  for group in _group(['proc','label','nthreads']):
+    ref = min(group,key=lambda r: r['scale'])
+    for res in group:
+      if ref['rate']>0 and ref['scale']>0:
+        res['scaleff_feds'] = (res['rate']*res['scale'])/(ref['rate']*ref['scale'])
+  return results
+
+
+def writetable(results,fname):
+  """Export results as table: CSV, JSON or feather (if pandas is available) based on the extension."""
+  if fname.endswith('.json'):
+    table = { c: [r[c] for r in results] for c in columns }
+    with open(fname,'w') as file:
+      json.dump(table,file,indent=2,default=float)
+  elif fname.endswith('.feather'):
+    import pandas as pd
+    pd.DataFrame(results,columns=columns).to_feather(fname)
+  else:
+    import csv
+    with open(fname,'w',newline='') as file:
+      writer = csv.DictWriter(file,fieldnames=columns,extrasaction='ignore')
+      writer.writeheader()
+      writer.writerows(results)
+  print(f">>> Created {fname}")
+  return fname
+
+
+def printtable(results):
+  """Print summary table."""
+  print(f">>> {'proc':<12} {'scale':>5} {'nthr':>4} {'label':<16} {'rate [evts/s]':>24} {'ms/evt':>8} {'CPU eff':>7} {'eff(thr)':>8} {'eff(FED)':>8}")
+  for r in sorted(results,key=lambda r: (r['proc'],r['label'],r['scale'],r['nthreads'])):
+    ratestr = f"{r['rate']:.1f} [{r['rate_lo']:.1f},{r['rate_hi']:.1f}]"
+    print(f">>> {r['proc']:<12} {r['scale']:>5} {r['nthreads']:>4} {r['label']:<16} {ratestr:>24} {r['ms_per_evt']:8.2f}"
+          f" {r['cpueff']:7.2f} {r['scaleff_threads']:8.2f} {r['scaleff_feds']:8.2f}")
+
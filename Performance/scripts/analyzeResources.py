@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+# Instructions
+#   analyzeResources.py resources_RECO_scale1_nthread4_fullchain_try1.json -n 20
+#   analyzeResources.py resources_RECO_scale1_nthread4_fullchain_try1.json --group package
+#   analyzeResources.py resources_new.json --ref resources_old.json --threshold 0.1 -o diff.csv
+import sys
+from HGCalCommissioning.Performance.resources import *
+
+
+def main(args):
+  groups   = loadgroups(args.groups) if args.groups else None
+  packages = loadpluginpackages() if args.group=='package' else None
+  def _load(fname):
+    modules = loadresources(fname)
+    if args.group!='module':
+      modules = aggregate(modules,groups=groups,packages=packages)
+    return modules
+
+  # RANK
+  newmods = _load(args.fname)
+  for metric in args.metrics:
+    print(f">>> Ranking of {args.fname} by {metrics[metric]}:")
+    ranked = rankmodules(newmods,metric,ntop=args.ntop)
+    printranking(ranked)
+    if args.outfname and not args.ref:
+      writecsv(rankmodules(newmods,metric),args.outfname.replace('$METRIC',metric))
+
+  # DIFF
+  nflagged = 0
+  if args.ref:
+    refmods = _load(args.ref)
+    for metric in args.metrics:
+      print(f">>> Comparing {args.fname} to reference {args.ref} by {metrics[metric]}:")
+      diffs = diffresources(refmods,newmods,metric,threshold=args.threshold,minabs=args.minabs)
+      printdiff(diffs,onlyflagged=args.onlyflagged)
+      regressions = [d['label'] for d in diffs if d['status']=='regression']
+      if regressions:
+        print(f">>> WARNING! {len(regressions)} regressions in {metric}: {', '.join(regressions)}")
+      nflagged += len(regressions)
+      if args.outfname:
+        writecsv(diffs,args.outfname.replace('$METRIC',metric))
+  return nflagged
+
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  description = '''This script ranks and compares modules in FastTimerService JSON summaries.'''
+  parser = ArgumentParser(description=description,epilog="Good luck!")
+  parser.add_argument('fname',              help="FastTimerService JSON summary (resources$LOGTAG.json)")
+  parser.add_argument('-r', '--ref',        default=None,
+                                            help="reference JSON summary to compare to, default=%(default)r")
+  parser.add_argument('-m', '--metrics',    nargs='+', default=['time_real','time_thread','mem_alloc'], choices=list(metrics),
+                                            help="metrics to rank/compare, default=%(default)r")
+  parser.add_argument('-g', '--group',      default='module', choices=['module','type','package'],
+                                            help="aggregate modules by C++ type or plugin package, default=%(default)r")
+  parser.add_argument('--groups',           default=None,
+                                            help="JSON with user groups (e.g. sequences) { group: [regexp, ...] }, default=%(default)r")
+  parser.add_argument('-n', '--ntop',       type=int, default=20,
+                                            help="number of modules to show in ranking, default=%(default)r")
+  parser.add_argument('-t', '--threshold',  type=float, default=0.1,
+                                            help="relative increase to flag a regression, default=%(default)r")
+  parser.add_argument('--minabs',           type=float, default=0.01,
+                                            help="minimal absolute increase per event to flag a regression, default=%(default)r")
+  parser.add_argument('--onlyflagged',      action='store_true',
+                                            help="only print flagged modules in the comparison, default=%(default)r")
+  parser.add_argument('-o', '--outfname',   default=None,
+                                            help="output CSV ($METRIC is replaced by the metric), default=%(default)r")
+  args = parser.parse_args()
+  if args.groups and args.group=='module':
+    args.group = 'type' # user groups first, then fall back to type
+  nflagged = main(args)
+  print(">>> Done.")
+  sys.exit(1 if nflagged>0 else 0)
+
@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+# Instructions
+#   analyzeThroughput.py ThroughputService_RECO_scale*_nthread?_fullchain_try1.log -o throughput.csv
+#   analyzeThroughput.py ThroughputService_*.log --cpu 'resources$TAG.json'
+import os
+from HGCalCommissioning.Performance.throughput import *
+
+
+def main(args):
+  verbosity = args.verbosity
+  results = [ ]
+  for fname in args.fnames:
+    print(f">>> Processing {fname}...")
+    cpufname = None
+    if args.cpu is not None: # e.g. resources$TAG.json for ThroughputService$TAG.log
+      tag = os.path.basename(fname).replace('ThroughputService','').replace('.log','')
+      cpufname = os.path.join(os.path.dirname(fname),args.cpu.replace('$TAG',tag))
+      if not os.path.isfile(cpufname):
+        print(f">>> WARNING! CPU time file {cpufname} does not exist! Ignoring...")
+        cpufname = None
+    result = analyzelog(fname,cpufname=cpufname,frac=args.frac,nboot=args.nboot,cl=args.cl,verb=verbosity)
+    results.append(result)
+  addscaling(results)
+  printtable(results)
+  if args.outfname:
+    writetable(results,args.outfname)
+
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  description = '''This script computes steady-state throughput and scaling efficiencies from ThroughputService logs.'''
+  parser = ArgumentParser(description=description,epilog="Good luck!")
+  parser.add_argument('fnames', nargs='+', help="Input file with comma-separated event table from ThroughputService")
+  parser.add_argument('-o', '--outfname', default="throughput.csv",
+                                          help="output table (.csv, .json or .feather), default=%(default)r")
+  parser.add_argument('--cpu',            default=None,
+                                          help="CPU time source per log (FastTimerService JSON or FrameworkJobReport),"
+                                               " $TAG is replaced by the log tag, e.g. 'resources$TAG.json', default=%(default)r")
+  parser.add_argument('--frac',           type=float, default=0.9,
+                                          help="fraction of the median rate defining the steady state, default=%(default)r")
+  parser.add_argument('--nboot',          type=int, default=1000,
+                                          help="number of bootstrap samples, default=%(default)r")
+  parser.add_argument('--cl',             type=float, default=0.68,
+                                          help="confidence level of the rate interval, default=%(default)r")
+  parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0,
+                                          help="set verbosity level, default=%(default)r" )
+  args = parser.parse_args()
+  main(args)
+  print(">>> Done.")
+
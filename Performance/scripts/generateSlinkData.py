@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+# Instructions
+#   generateSlinkData.py -n 120 --hdfrac 0.3 --nevents 10000 --occupancy 0.05 --model shower -o synthetic/
+#   cmsRun $CMSSW_BASE/src/HGCalCommissioning/Performance/test/step_RAW2DIGI.py run=1 lumi=1 era=SepTB2024/v3 synthetic=synthetic/manifest.json output=RAW2DIGI_synthetic.root
+from HGCalCommissioning.Performance.synthetic import *
+
+
+def main(args):
+  layout = buildlayout(args.nmodules,hdfrac=args.hdfrac,econdspercb=args.econdspercb,cbsperfed=args.cbsperfed,
+                       modsperplane=args.modsperplane,firstfed=args.firstfed,seed=args.seed)
+  nfeds = len(set(m['fedid'] for m in layout))
+  print(f">>> Generating {args.nevents} events for {args.nmodules} modules in {nfeds} FEDs"
+        f" with occupancy model {args.model!r} (occupancy={args.occupancy}, TOT fraction={args.totfrac})...")
+  manifest = writesyntheticrun(layout,args.output,run=args.run,nevents=args.nevents,occupancy=args.occupancy,
+                               model=args.model,seed=args.seed,verb=args.verbosity,
+                               ped=args.ped,noise=args.noise,mip=args.mip,totfrac=args.totfrac)
+  print(f">>> Created {manifest}")
+
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  description = '''This script generates synthetic S-link binary files with a matching module locator and FED/ECON-D configuration.'''
+  parser = ArgumentParser(description=description,epilog="Good luck!")
+  parser.add_argument('-o', '--output',     default="synthetic",
+                                            help="output directory, default=%(default)r")
+  parser.add_argument('-r', '--run',        type=int, default=1,
+                                            help="run number, default=%(default)r")
+  parser.add_argument('-n', '--nmodules',   type=int, default=9,
+                                            help="number of modules, default=%(default)r")
+  parser.add_argument('--hdfrac',           type=float, default=0.,
+                                            help="fraction of HD modules, default=%(default)r")
+  parser.add_argument('--econdspercb',      type=int, default=3,
+                                            help="ECON-Ds per capture block, default=%(default)r")
+  parser.add_argument('--cbsperfed',        type=int, default=4,
+                                            help="capture blocks per FED, default=%(default)r")
+  parser.add_argument('--modsperplane',     type=int, default=None,
+                                            help="modules per plane (for the shower model), default=modules per FED")
+  parser.add_argument('--firstfed',         type=int, default=0,
+                                            help="first FED id, default=%(default)r")
+  parser.add_argument('--nevents',          type=int, default=1000,
+                                            help="number of events, default=%(default)r")
+  parser.add_argument('--occupancy',        type=float, default=0.05,
+                                            help="(mean/noise floor) channel occupancy, default=%(default)r")
+  parser.add_argument('--model',            default='fixed', choices=['fixed','gamma','shower'],
+                                            help="occupancy model, default=%(default)r")
+  parser.add_argument('--totfrac',          type=float, default=0.05,
+                                            help="fraction of hits in TOT mode, default=%(default)r")
+  parser.add_argument('--ped',              type=float, default=100.,
+                                            help="pedestal [ADC], default=%(default)r")
+  parser.add_argument('--noise',            type=float, default=3.,
+                                            help="noise [ADC], default=%(default)r")
+  parser.add_argument('--mip',              type=float, default=40.,
+                                            help="most probable signal of a hit [ADC], default=%(default)r")
+  parser.add_argument('--seed',             type=int, default=42,
+                                            help="random seed, default=%(default)r")
+  parser.add_argument('-v', '--verbose',    dest='verbosity', type=int, nargs='?', const=1, default=0,
+                                            help="set verbosity level, default=%(default)r" )
+  args = parser.parse_args()
+  main(args)
+  print(">>> Done.")
+
@@ -0,0 +1,205 @@
+#! /usr/bin/env python3
+# Instructions
+#   runBenchmarkMatrix.py $CMSSW_BASE/src/HGCalCommissioning/Performance/test/benchmark_matrix.json -o benchmarks/
+#   runBenchmarkMatrix.py benchmark_matrix.json -o benchmarks/ --resume       # skip configurations already done
+#   runBenchmarkMatrix.py benchmark_matrix.json -o benchmarks/ --export benchmarks.csv
+# The matrix is a JSON with common cmsRun arguments, a list of steps and the scale x nthreads x repetitions grid,
+# which can be overwritten per step. Argument values may use the placeholders $SCALE, $NTHREADS, $LOGTAG and $REP.
+import os, sys
+import glob
+import json
+import time
+import sqlite3
+import socket
+import subprocess
+from itertools import product
+from HGCalCommissioning.Performance.throughput import analyzelog, getcputime
+
+dbcolumns = [ # columns of the results database
+  ('key','TEXT PRIMARY KEY'),('matrix','TEXT'),('step','TEXT'),('scale','INTEGER'),('nthreads','INTEGER'),
+  ('logtag','TEXT'),('rep','INTEGER'),('cpuset','TEXT'),('host','TEXT'),('cmssw','TEXT'),('cmd','TEXT'),
+  ('status','TEXT'),('returncode','INTEGER'),('tstart','REAL'),('tstop','REAL'),
+  ('throughputlog','TEXT'),('resources','TEXT'),('jobreport','TEXT'),
+  ('nevts','INTEGER'),('rate','REAL'),('rate_lo','REAL'),('rate_hi','REAL'),('ms_per_evt','REAL'),
+  ('cputime','REAL'),('walltime','REAL'),('cpueff','REAL'),
+]
+
+
+def opendb(fname):
+  """Open (or create) the sqlite results database."""
+  db = sqlite3.connect(fname)
+  db.execute(f"CREATE TABLE IF NOT EXISTS results ({', '.join(f'{c} {t}' for c, t in dbcolumns)})")
+  db.commit()
+  return db
+
+
+def expandmatrix(matrix):
+  """Expand the declarative matrix into a list of configurations (one per cmsRun job).
+  The order follows the steps, so later steps may consume the output of earlier ones."""
+  common = matrix.get('common',{ })
+  configs = [ ]
+  for step in matrix['steps']:
+    scales   = step.get('scale',matrix.get('scale',[1]))
+    nthreads = step.get('nthreads',matrix.get('nthreads',[1]))
+    logtags  = step.get('logtags',matrix.get('logtags',['']))
+    nreps    = step.get('repetitions',matrix.get('repetitions',1))
+    for scale, logtag, nthread, rep in product(scales,logtags,nthreads,range(1,nreps+1)):
+      fulltag = f"{logtag}_try{rep}"
+      key = f"{step['name']}_scale{scale}_nthread{nthread}{fulltag}"
+      args = dict(common)
+      args.update(step.get('args',{ }))
+      args.update({ 'scaleFEDs': scale, 'nthreads': nthread, 'logtag': fulltag })
+      for k, v in args.items():
+        if isinstance(v,str):
+          v = v.replace('$SCALE',str(scale)).replace('$NTHREADS',str(nthread))
+          args[k] = v.replace('$LOGTAG',logtag).replace('$REP',str(rep))
+      configs.append({
+        'key': key, 'step': step['name'], 'cfg': step['cfg'], 'scale': scale, 'nthreads': nthread,
+        'logtag': fulltag, 'rep': rep, 'args': args,
+      })
+  return configs
+
+
+def getcpuset(nthreads,offset=0,cpus=None):
+  """Pin a job with nthreads to a contiguous block of cores starting at offset."""
+  if cpus is None:
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os,'sched_getaffinity') else list(range(os.cpu_count() or 1))
+  if offset+nthreads>len(cpus):
+    print(f">>> getcpuset: WARNING! Requested {nthreads} cores at offset {offset}, but only {len(cpus)} available!")
+    return ','.join(str(c) for c in cpus)
+  return ','.join(str(c) for c in cpus[offset:offset+nthreads])
+
+
+def buildcmd(config,cpuset=None):
+  """Build the cmsRun command for a configuration."""
+  cfg = config['cfg']
+  if not os.path.isfile(cfg):
+    cfg = os.path.join(os.environ.get('CMSSW_BASE',''),'src',cfg)
+  cmd = ['cmsRun','-j',f"FwkJobReport_{config['key']}.xml",cfg]
+  for k, v in config['args'].items():
+    if isinstance(v,bool):
+      v = 'True' if v else 'False'
+    cmd.append(f"{k}={v}")
+  if cpuset:
+    cmd = ['taskset','-c',cpuset]+cmd
+  return cmd
+
+
+def collectoutputs(config,workdir,tstart=0):
+  """Find ThroughputService, FastTimerService and job report outputs of a configuration.
+  The process name in the log file name is not known, so only logs written since tstart are considered."""
+  tag = f"_scale{config['scale']}_nthread{config['nthreads']}{config['logtag']}"
+  tplogs = [f for f in glob.glob(os.path.join(workdir,f"ThroughputService_*{tag}.log")) if os.path.getmtime(f)>=tstart]
+  tplog  = max(tplogs,key=os.path.getmtime) if tplogs else None
+  resources = None
+  if tplog is not None: # same logtag, see Performance/python/utils.py
+    resources = os.path.join(workdir,os.path.basename(tplog).replace('ThroughputService','resources').replace('.log','.json'))
+    if not os.path.isfile(resources):
+      resources = None
+  jobreport = os.path.join(workdir,f"FwkJobReport_{config['key']}.xml")
+  if not os.path.isfile(jobreport):
+    jobreport = None
+  return tplog, resources, jobreport
+
+
+def runconfig(db,config,workdir,matrixname,cpuset=None,dryrun=False,verb=0):
+  """Run a single configuration and store its results."""
+  cmd = buildcmd(config,cpuset=cpuset)
+  print(f">>> Running {config['key']}: {' '.join(cmd)}")
+  if dryrun:
+    return
+  row = {
+    'key': config['key'], 'matrix': matrixname, 'step': config['step'], 'scale': config['scale'],
+    'nthreads': config['nthreads'], 'logtag': config['logtag'], 'rep': config['rep'], 'cpuset': cpuset or '',
+    'host': socket.gethostname(), 'cmssw': os.environ.get('CMSSW_VERSION',''), 'cmd': ' '.join(cmd),
+    'status': 'running', 'tstart': time.time(),
+  }
+  storerow(db,row)
+  logfile = os.path.join(workdir,f"cmsRun_{config['key']}.log")
+  with open(logfile,'w') as log:
+    returncode = subprocess.call(cmd,cwd=workdir,stdout=log,stderr=subprocess.STDOUT)
+  row.update({ 'returncode': returncode, 'tstop': time.time(), 'status': 'done' if returncode==0 else 'failed' })
+  tplog, resources, jobreport = collectoutputs(config,workdir,tstart=row['tstart'])
+  row.update({ 'throughputlog': tplog, 'resources': resources, 'jobreport': jobreport })
+  if tplog is not None:
+    cpufname = resources if resources is not None else jobreport
+    result = analyzelog(tplog,nthreads=config['nthreads'],scale=config['scale'],cpufname=cpufname,verb=verb)
+    row.update({ k: result[k] for k in ['nevts','rate','rate_lo','rate_hi','ms_per_evt','cputime','cpueff'] })
+    row['walltime'] = getcputime(jobreport)[1] if jobreport is not None else result['runtime']
+  elif returncode==0:
+    print(f">>> WARNING! No ThroughputService log found for {config['key']}!")
+  storerow(db,row)
+  print(f">>> Finished {config['key']} with status {row['status']} (returncode={returncode})")
+
+
+def storerow(db,row):
+  """Insert or update a row in the results database (NaN values are stored as NULL)."""
+  row = { k: (None if isinstance(v,float) and v!=v else v) for k, v in row.items() }
+  keys = list(row.keys())
+  db.execute(f"INSERT OR REPLACE INTO results ({', '.join(keys)}) VALUES ({', '.join('?' for k in keys)})",
+             [row[k] for k in keys])
+  db.commit()
+
+
+def exportdb(db,fname):
+  """Export the results database as CSV table."""
+  import csv
+  cursor = db.execute("SELECT * FROM results ORDER BY step, scale, nthreads, logtag")
+  with open(fname,'w',newline='') as file:
+    writer = csv.writer(file)
+    writer.writerow([d[0] for d in cursor.description])
+    writer.writerows(cursor)
+  print(f">>> Created {fname}")
+
+
+def main(args):
+  os.makedirs(args.output,exist_ok=True)
+  db = opendb(os.path.join(args.output,args.db))
+  if args.export:
+    exportdb(db,args.export)
+    return
+  with open(args.matrix,'r') as file:
+    matrix = json.load(file)
+  matrixname = os.path.basename(args.matrix).replace('.json','')
+  configs = expandmatrix(matrix)
+  if args.steps:
+    configs = [c for c in configs if c['step'] in args.steps]
+  done = set(k for k, in db.execute("SELECT key FROM results WHERE status='done'"))
+  print(f">>> Benchmark matrix {args.matrix} has {len(configs)} configurations, {len(done)} already done")
+  for config in configs:
+    if args.resume and config['key'] in done:
+      if args.verbosity>=1:
+        print(f">>> Skipping {config['key']} (done)")
+      continue
+    cpuset = getcpuset(config['nthreads'],offset=args.cpuoffset) if args.pin else None
+    runconfig(db,config,args.output,matrixname,cpuset=cpuset,dryrun=args.dryrun,verb=args.verbosity)
+  db.close()
+
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  description = '''This script runs a benchmark matrix of cmsRun jobs and collects the outputs in a results database.'''
+  parser = ArgumentParser(description=description,epilog="Good luck!")
+  parser.add_argument('matrix',           help="JSON file with the benchmark matrix")
+  parser.add_argument('-o', '--output',   default="benchmarks",
+                                          help="working directory for the jobs and database, default=%(default)r")
+  parser.add_argument('--db',             default="benchmarks.db",
+                                          help="sqlite database file (in output directory), default=%(default)r")
+  parser.add_argument('-s', '--steps',    nargs='+', default=None,
+                                          help="only run these steps, default=%(default)r")
+  parser.add_argument('--resume',         action='store_true',
+                                          help="skip configurations which are already done, default=%(default)r")
+  parser.add_argument('--pin',            action='store_true',
+                                          help="pin jobs to a contiguous CPU set with taskset, default=%(default)r")
+  parser.add_argument('--cpuoffset',      type=int, default=0,
+                                          help="first core of the CPU set, default=%(default)r")
+  parser.add_argument('--export',         default=None,
+                                          help="export the database to a CSV file and exit, default=%(default)r")
+  parser.add_argument('--dryrun',         action='store_true',
+                                          help="only print the commands, default=%(default)r")
+  parser.add_argument('-v', '--verbose',  dest='verbosity', type=int, nargs='?', const=1, default=0,
+                                          help="set verbosity level, default=%(default)r" )
+  args = parser.parse_args()
+  main(args)
+  print(">>> Done.")
+
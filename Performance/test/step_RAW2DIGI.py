@@ -16,10 +16,14 @@ options.register('nthreads', 1, VarParsing.multiplicity.singleton, VarParsing.va
                  "number of nthreads")
 options.register('logtag', "", VarParsing.multiplicity.singleton, VarParsing.varType.string,
                  "tag for ThroughputService log")
+options.register('fastTimer', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
+                 "add FastTimerService with JSON summary resources$LOGTAG.json")
 options.register('fromFEDRaw', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
                  "start from FEDRawDataCollection (skip raw binary)")
 options.register('scaleFEDs', 1, VarParsing.multiplicity.singleton, VarParsing.varType.int,
                  "naively scale data by copying FED data")
+options.register('synthetic', "", VarParsing.multiplicity.singleton, VarParsing.varType.string,
+                 "manifest JSON from generateSlinkData.py (overrides inputs, FEDs, module locator and FED/ECON-D config)")
 options.register('inputTrigFiles',[],
                  VarParsing.multiplicity.list, VarParsing.varType.string, "input Trigger link file")
 options.parseArguments()
@@ -34,7 +38,13 @@ scale      = options.scaleFEDs
 fromFEDRaw = options.fromFEDRaw
 inputFiles = options.files
 inputTrigFiles = options.inputTrigFiles
-if len(inputFiles)!=len(inputTrigFiles) and not fromFEDRaw:
+synthetic  = None
+if options.synthetic: # synthetic S-link data without trigger link
+  with open(options.synthetic,'r') as infile:
+    synthetic = json.load(infile)
+  inputFiles = synthetic['files']
+  inputTrigFiles = [ ]
+if len(inputFiles)!=len(inputTrigFiles) and not fromFEDRaw and synthetic is None:
     raise ValueError('Number of input files does not match trigger files!!!')
 if len(inputFiles)<0:
     raise ValueError('Missing input files')
@@ -45,7 +55,12 @@ print(f'\t trigfiles={inputTrigFiles}')
 # GET COMMON CONFIG
 from HGCalCommissioning.Configuration.SysValEras_cff import *
 procname = 'FEDRAW2DIGI' if fromFEDRaw else 'RAW2DIGI'
-process, eraConfig = initSysValCMSProcess(procname=procname, era=era, run=run, maxEvents=options.maxEvents, nthreads=nthreads)
+process, eraConfig = initSysValCMSProcess(procname=procname, era=era, run=run, maxEvents=options.maxEvents, nthreads=nthreads,
+                                          modulemapper=(synthetic['modules'] if synthetic else None))
+if synthetic is not None:
+  eraConfig['fedId'] = synthetic['fedIds']
+  process.hgcalConfigESProducer.fedjson = cms.string(synthetic['fedconfig'])
+  process.hgcalConfigESProducer.modjson = cms.string(synthetic['modconfig'])
 print(f">>> Era = {era} has the following config:")
 print(f">>>   eraConfig  = {eraConfig}")
 print(f">>>   inputFiles = {inputFiles}")
@@ -61,7 +76,8 @@ if scale>=2:
 
 # MEASURE PERFORMANCE
 logtag = f"_{procname}_scale{scale}_nthread{nthreads}{options.logtag}"
-#addFastTimerService(process,logtag=logtag)
+if options.fastTimer:
+  addFastTimerService(process,logtag=logtag)
 addThroughoutService(process,options,logtag=logtag)
 
 # INPUT: BIN -> RAW
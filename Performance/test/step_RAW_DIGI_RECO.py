@@ -16,6 +16,8 @@ options.register('nthreads', 1, VarParsing.multiplicity.singleton, VarParsing.va
                  "number of nthreads")
 options.register('logtag', "", VarParsing.multiplicity.singleton, VarParsing.varType.string,
                  "tag for ThroughputService log")
+options.register('fastTimer', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
+                 "add FastTimerService with JSON summary resources$LOGTAG.json")
 options.register('fromFEDRaw', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
                  "start from FEDRawDataCollection (skip raw binary)")
 options.register('scaleFEDs', 1, VarParsing.multiplicity.singleton, VarParsing.varType.int,
@@ -64,7 +66,8 @@ if scale >= 2:
 
 # MEASURE PERFORMANCE
 logtag = f"_{procname}_scale{scale}_nthread{nthreads}{options.logtag}"
-# addFastTimerService(process,logtag=logtag)
+if options.fastTimer:
+    addFastTimerService(process, logtag=logtag)
 addThroughoutService(process, options, logtag=logtag)
 
 # INPUT: BIN -> RAW
@@ -16,6 +16,8 @@ options.register('scaleFEDs', 1, VarParsing.multiplicity.singleton, VarParsing.v
                  "naively scale data by copying FED data")
 options.register('logtag', "", VarParsing.multiplicity.singleton, VarParsing.varType.string,
                  "tag for ThroughputService log")
+options.register('fastTimer', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
+                 "add FastTimerService with JSON summary resources$LOGTAG.json")
 options.register('gpu', False, VarParsing.multiplicity.singleton, VarParsing.varType.bool,
                  "run on GPUs")
 options.parseArguments()
@@ -44,7 +46,8 @@ if scale>=2: # assume options.files already contains scaled DIGIs
 
 # MEASURE PERFORMANCE
 logtag = f"_RECO_scale{scale}_nthread{nthreads}{options.logtag}"
-#addFastTimerService(process,logtag=logtag)
+if options.fastTimer:
+  addFastTimerService(process,logtag=logtag)
 addThroughoutService(process,options,logtag=logtag)
 
 # SOURCE